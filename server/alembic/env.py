@@ -0,0 +1,39 @@
+# server/alembic/env.py
+import os
+import sys
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config as app_config
+
+alembic_config = context.config
+if alembic_config.config_file_name is not None:
+    fileConfig(alembic_config.config_file_name)
+
+# Схема описана SQL-миграциями, автогенерации по моделям нет
+target_metadata = None
+
+
+def run_migrations_offline():
+    context.configure(url=app_config.DATABASE_URL, target_metadata=target_metadata, literal_binds=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # NullPool: одно соединение на запуск, через тот же DATABASE_URL (pgbouncer), что и приложение
+    engine = create_engine(app_config.DATABASE_URL, poolclass=pool.NullPool)
+    with engine.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
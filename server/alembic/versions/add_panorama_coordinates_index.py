@@ -1,7 +1,7 @@
 """add panorama coordinates index
 
 Revision ID: add_panorama_coordinates_index
-Revises: previous_revision
+Revises:
 Create Date: 2024-03-21 10:00:00.000000
 
 """
@@ -10,11 +10,14 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = 'add_panorama_coordinates_index'
-down_revision = 'previous_revision'  # Замените на предыдущую ревизию
+down_revision = None  # Первая ревизия: базовую схему создает bootstrap.py
 branch_labels = None
 depends_on = None
 
 def upgrade():
+    # Таблица panoramas есть только у модели app/models.py; в основной схеме (photos_4326) ее нет
+    if not sa.inspect(op.get_bind()).has_table('panoramas'):
+        return
     # Создаем составной индекс для координат
     op.create_index(
         'idx_panorama_coordinates',
@@ -24,4 +27,4 @@ def upgrade():
 
 def downgrade():
     # Удаляем индекс при откате
-    op.drop_index('idx_panorama_coordinates') 
\ No newline at end of file
+    op.execute('DROP INDEX IF EXISTS idx_panorama_coordinates') 
\ No newline at end of file
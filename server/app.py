@@ -1,28 +1,26 @@
 # server/app.py
-from flask import Flask, request, make_response, send_from_directory, jsonify
+import time
+_STARTED = time.perf_counter()
+
+from flask import Flask, request, make_response, jsonify
 from flask_cors import CORS
 from flask_compress import Compress
 from pathlib import Path
 import os
 import re
 import config
-import time
-import random
-from werkzeug.security import generate_password_hash
 
-# --- Database / Repository Imports ---
-try:
-    from repositories import user_repository
-except ImportError:
-    print("Warning: Could not import user_repository. Database operations might fail.")
-    user_repository = None
+# --- Database Imports ---
+from database import release_connection
+from services.static_assets import StaticAssets
 
 # --- Blueprint Imports ---
 try:
-    from controllers.auth_controller import auth_blueprint
+    from controllers.auth_controller import auth_blueprint, load_auth_claims
 except Exception as e:
     print(f"Warning: Could not import auth_blueprint. {e}")
     auth_blueprint = None
+    load_auth_claims = None
 
 try:
     from controllers.pano_controller import pano_blueprint
@@ -47,6 +45,13 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 PUBLIC_DIR   = getattr(config, "PUBLIC_DIR", PROJECT_ROOT / "public")
 BUILD_DIR    = PUBLIC_DIR / "build"
 
+# Маршруты со своим Cache-Control (статика: immutable / no-cache, тайлы панорам: max-age):
+# если заголовок уже выставлен, no-store к ним не добавляется
+CACHED_ENDPOINTS = {
+    "favicon", "manifest", "static_from_build", "assets_from_build", "spa_fallback",
+    "pano.get_pano_tile", "pano.get_pano_preview",
+}
+
 # --- Парсинг CORS из .env ---
 raw_origins = os.getenv("CLIENT_ORIGINS", getattr(config, "CLIENT_ORIGINS", ""))
 if isinstance(raw_origins, str):
@@ -70,46 +75,8 @@ def origin_allowed(origin: str | None) -> bool:
                 return True
     return False
 
-def ensure_default_admin():
-    """
-    Checks if the default admin user exists in the database.
-    If not, creates it using credentials from config/env.
-    """
-    if user_repository is None:
-        return
-
-    # Small random delay based on PID to desynchronize workers
-    time.sleep((os.getpid() % 10) * 0.2 + random.uniform(0.1, 0.5))
-
-    # Читаем креды администратора из .env (с фоллбэком)
-    username = os.getenv("DEFAULT_ADMIN_USERNAME", getattr(config, "DEFAULT_ADMIN_USERNAME", "admin"))
-    password = os.getenv("DEFAULT_ADMIN_PASSWORD", getattr(config, "DEFAULT_ADMIN_PASSWORD", "change_me_please"))
-
-    print(f"[Worker {os.getpid()}] Startup: Checking for default admin user '{username}'...")
-
-    try:
-        existing_user = user_repository.get_user_by_username(username)
-        
-        if existing_user:
-            print(f"[Worker {os.getpid()}] Startup: User '{username}' already exists. Skipping creation.")
-        else:
-            print(f"[Worker {os.getpid()}] Startup: User '{username}' not found. Creating...")
-            pw_hash = generate_password_hash(password)
-            new_id = user_repository.create_user(username, pw_hash)
-            
-            if new_id:
-                print(f"[Worker {os.getpid()}] Startup: User '{username}' successfully created (ID: {new_id}).")
-            else:
-                check_again = user_repository.get_user_by_username(username)
-                if check_again:
-                     print(f"[Worker {os.getpid()}] Startup: User '{username}' was created by another worker.")
-                else:
-                     print(f"[Worker {os.getpid()}] Startup: Failed to create user '{username}'. Check DB connection.")
-                
-    except Exception as e:
-        print(f"[Worker {os.getpid()}] Startup Warning: Could not verify/create admin. Error: {e}")
-
 def create_app():
+    create_started = time.perf_counter()
     app = Flask(__name__, static_folder=None)
     
     # Читаем секретные ключи из .env
@@ -132,7 +99,8 @@ def create_app():
         SESSION_COOKIE_SECURE=is_cookie_secure,
         SESSION_COOKIE_HTTPONLY=True,
         JSON_AS_ASCII=False,
-        MAX_CONTENT_LENGTH= 1024 * 1024 * 1024 * 1024,  
+        # Большие ортофото лучше грузить частями через /api/upload_ortho/init (см. UploadService)
+        MAX_CONTENT_LENGTH=getattr(config, "MAX_CONTENT_LENGTH", 1024 * 1024 * 1024 * 1024),
     )
 
     # ---------------- COMPRESSION SETTINGS (GZIP) ----------------
@@ -154,8 +122,8 @@ def create_app():
         app,
         resources={r"/api/*": {"origins": ALLOWED_ORIGINS}},
         supports_credentials=True,
-        expose_headers=["Content-Type", "Authorization"],
-        allow_headers=["Content-Type", "Authorization", "X-Requested-With"],
+        expose_headers=["Content-Type", "Authorization", "Upload-Offset"],
+        allow_headers=["Content-Type", "Authorization", "X-Requested-With", "Upload-Offset"],
         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     )
 
@@ -164,12 +132,15 @@ def create_app():
         origin = request.headers.get("Origin")
         if origin_allowed(origin):
             response.headers["Access-Control-Allow-Origin"] = origin or "*"
-            response.headers["Vary"] = "Origin"
+            response.vary.add("Origin")
         response.headers["Access-Control-Allow-Credentials"] = "true"
         response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With"
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With, Upload-Offset"
+        response.headers["Access-Control-Expose-Headers"] = "Upload-Offset"
         
-        # Disable caching for API, but keep for map tiles
+        # Disable caching for API, but keep for map tiles, pano tiles and frontend assets
+        if request.endpoint in CACHED_ENDPOINTS and "Cache-Control" in response.headers:
+            return response
         if 'application/vnd.mapbox-vector-tile' not in response.headers.get('Content-Type', ''):
              response.headers["Cache-Control"] = "no-store"
              
@@ -179,6 +150,11 @@ def create_app():
     def cors_preflight(any_path):
         return make_response("", 204)
 
+    # ---------------- AUTH MIDDLEWARE ----------------
+    # Токен из cookie проверяется один раз на запрос, claims доступны в g.auth_claims
+    if load_auth_claims:
+        app.before_request(load_auth_claims)
+
     # ---------------- API REGISTRATION (Routing) ----------------
     if auth_blueprint:
         app.register_blueprint(auth_blueprint, url_prefix="/api/auth")
@@ -192,70 +168,70 @@ def create_app():
     if ortho_blueprint:
         app.register_blueprint(ortho_blueprint, url_prefix="/api")
 
+    # Соединение из пула PostgreSQL, взятое запросом, возвращается в пул после ответа
+    app.teardown_appcontext(release_connection)
+
     # API Health Check
     @app.get("/api/health")
     def health():
         return jsonify({"ok": True, "db": "postgres", "env": os.getenv("APP_ENV", "unknown")})
 
     # ---------------- STATIC SERVING (Frontend / SPA) ----------------
-    
+    # Таблица файлов строится один раз при старте (при --preload — в мастере, общая для воркеров).
+    # Сборка имеет приоритет над public; готовые .br/.gz пишет services/static_assets.py при сборке образа
+    assets = StaticAssets([
+        ("", BUILD_DIR, None, True),
+        ("static/", PUBLIC_DIR / "static", None),
+        ("assets/", PUBLIC_DIR / "assets", None),
+        ("", PUBLIC_DIR, ("favicon.ico", "manifest.json", "index.html")),
+    ])
+
     @app.route("/favicon.ico")
     def favicon():
-        if (BUILD_DIR / "favicon.ico").exists():
-            return send_from_directory(BUILD_DIR, "favicon.ico", conditional=True)
-        return send_from_directory(PUBLIC_DIR, "favicon.ico", conditional=True)
+        response = assets.send("favicon.ico")
+        return response if response is not None else ("Not Found", 404)
 
     @app.route("/manifest.json")
     def manifest():
-        if (BUILD_DIR / "manifest.json").exists():
-            return send_from_directory(BUILD_DIR, "manifest.json", conditional=True)
-        return send_from_directory(PUBLIC_DIR, "manifest.json", conditional=True)
+        response = assets.send("manifest.json")
+        return response if response is not None else ("Not Found", 404)
 
     @app.route("/static/<path:filename>")
     def static_from_build(filename):
-        build_static = BUILD_DIR / "static"
-        public_static = PUBLIC_DIR / "static"
-        if (build_static / filename).exists():
-            return send_from_directory(build_static, filename, conditional=True)
-        if (public_static / filename).exists():
-            return send_from_directory(public_static, filename, conditional=True)
-        return ("Not Found", 404)
+        response = assets.send("static/" + filename)
+        return response if response is not None else ("Not Found", 404)
 
     @app.route("/assets/<path:filename>")
     def assets_from_build(filename):
-        build_assets = BUILD_DIR / "assets"
-        public_assets = PUBLIC_DIR / "assets"
-        if (build_assets / filename).exists():
-            return send_from_directory(build_assets, filename, conditional=True)
-        if (public_assets / filename).exists():
-            return send_from_directory(public_assets, filename, conditional=True)
-        return ("Not Found", 404)
+        response = assets.send("assets/" + filename)
+        return response if response is not None else ("Not Found", 404)
 
     @app.route("/", defaults={"path": ""})
     @app.route("/<path:path>")
     def spa_fallback(path: str):
-        candidate = BUILD_DIR / path
-        if candidate.is_file():
-            rel = os.path.relpath(candidate, BUILD_DIR)
-            return send_from_directory(BUILD_DIR, rel, conditional=True)
-
-        index_file = (BUILD_DIR / "index.html") if (BUILD_DIR / "index.html").exists() else (PUBLIC_DIR / "index.html")
-        if not index_file.exists():
+        response = assets.send(path) if path else None
+        if response is None:
+            response = assets.send("index.html")
+        if response is None:
             return {
                 "ok": False,
                 "error": "index.html not found",
                 "looked_in": [str(BUILD_DIR / "index.html"), str(PUBLIC_DIR / "index.html")],
             }, 500
-        return send_from_directory(index_file.parent, index_file.name, conditional=True)
+        return response
 
-    # --- INITIALIZATION CHECKS ---
-    with app.app_context():
-        # Only run admin ensure if not in a pure static context (optional, but safe)
-        ensure_default_admin()
+    # --- STARTUP REPORT ---
+    # Схема БД, бакеты и администратор создаются заранее (bootstrap.py), воркер только регистрирует маршруты
+    done = time.perf_counter()
+    print(f"[Worker {os.getpid()}] Startup: app ready in {(done - _STARTED) * 1000:.0f} ms "
+          f"(imports {(create_started - _STARTED) * 1000:.0f} ms, create_app {(done - create_started) * 1000:.0f} ms, static files {len(assets)})")
 
     return app
 
 if __name__ == "__main__":
+    # Локальный запуск без entrypoint.sh: сначала разовая инициализация схемы
+    import bootstrap
+    bootstrap.run()
     application = create_app()
     # Read port from env, fallback to 5000
     port = int(os.getenv("APP_PORT", 5000))
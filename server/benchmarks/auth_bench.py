@@ -0,0 +1,86 @@
+# server/benchmarks/auth_bench.py
+"""
+Бенчмарк накладных расходов авторизации на один запрос:
+прежняя проверка токена (split + base64 + hmac.new + json.loads на каждый вызов)
+против decode_access_token с заготовкой HMAC и кэшем проверенных токенов.
+
+Запуск из папки server:
+    python benchmarks/auth_bench.py [--tokens 100] [--requests 200000]
+"""
+import argparse
+import base64
+import hmac
+import json
+import os
+import random
+import sys
+import time
+from hashlib import sha256
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from services import auth_service
+
+
+def legacy_decode(token):
+    """Копия прежней реализации decode_access_token"""
+    try:
+        parts = token.split(".")
+        if len(parts) != 3:
+            return None
+        header_b64, payload_b64, sig_b64 = parts
+        signing_input = f"{header_b64}.{payload_b64}".encode("ascii")
+        expected_sig = hmac.new(config.JWT_SECRET.encode("utf-8"), signing_input, sha256).digest()
+        actual_sig = base64.urlsafe_b64decode(sig_b64 + "=" * (-len(sig_b64) % 4))
+        if not hmac.compare_digest(expected_sig, actual_sig):
+            return None
+        payload = json.loads(base64.urlsafe_b64decode(payload_b64 + "=" * (-len(payload_b64) % 4)).decode("utf-8"))
+        if int(payload.get("exp", 0)) < int(time.time()):
+            return None
+        return payload
+    except Exception:
+        return None
+
+
+def uncached_decode(token):
+    """Новая проверка без кэша: только выигрыш от заготовки HMAC"""
+    auth_service._verified.clear()
+    return auth_service.decode_access_token(token)
+
+
+def run(name, func, stream):
+    started = time.perf_counter()
+    for token in stream:
+        if func(token) is None:
+            raise SystemExit(f"{name}: токен не прошел проверку")
+    elapsed = time.perf_counter() - started
+    per_call = elapsed / len(stream) * 1e6
+    print(f"{name:<10} {elapsed:8.3f} s  {per_call:8.2f} мкс/запрос")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=100, help="сколько разных пользователей (cookie)")
+    parser.add_argument("--requests", type=int, default=200000)
+    args = parser.parse_args()
+
+    tokens = [
+        auth_service.create_access_token({"uid": i, "u": f"user{i}"}, expires_in=3600)
+        for i in range(args.tokens)
+    ]
+    rnd = random.Random(0)
+    stream = [rnd.choice(tokens) for _ in range(args.requests)]
+
+    print(f"Токенов: {args.tokens}, запросов: {args.requests}")
+    legacy = run("legacy", legacy_decode, stream)
+    uncached = run("hmac_copy", uncached_decode, stream)
+    auth_service._verified.clear()
+    cached = run("cached", auth_service.decode_access_token, stream)
+    print(f"Ускорение: заготовка HMAC x{legacy / uncached:.1f}, с кэшем x{legacy / cached:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
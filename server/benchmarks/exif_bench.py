@@ -0,0 +1,81 @@
+# server/benchmarks/exif_bench.py
+"""
+Микро-бенчмарк разбора EXIF/GPS панорам: быстрый разбор APP1 (services/exif_reader)
+против прежнего пути (весь файл в память + PIL getexif).
+
+Запуск из папки server:
+    python benchmarks/exif_bench.py /path/to/panos [--repeat 5]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from services.exif_reader import read_exif_gps, EXIF_HEAD_BYTES
+
+
+def pil_path(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    img = Image.open(io.BytesIO(data))
+    exif = img.getexif()
+    gps = exif.get_ifd(34853) if exif else {}
+    return gps.get(2), gps.get(4)
+
+
+def fast_path(path):
+    with open(path, "rb") as f:
+        head = f.read(EXIF_HEAD_BYTES)
+    return read_exif_gps(head)
+
+
+def run(name, func, files, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for path in files:
+            func(path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    per_file = best / len(files) * 1000
+    print(f"{name:<8} {best:8.3f} s  {per_file:8.3f} ms/файл")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    files = sorted(
+        os.path.join(args.folder, name) for name in os.listdir(args.folder)
+        if name.lower().endswith((".jpg", ".jpeg"))
+    )
+    if not files:
+        print("В папке нет JPEG")
+        return 1
+
+    # Оба пути должны находить координаты в одних и тех же файлах
+    mismatches = 0
+    for path in files:
+        fast = fast_path(path)
+        has_fast = bool(fast and fast[0] is not None and fast[1] is not None)
+        lat, lon = pil_path(path)
+        if has_fast != (lat is not None and lon is not None):
+            mismatches += 1
+            print(f"Расхождение: {path}")
+
+    print(f"Файлов: {len(files)}, повторов: {args.repeat}, расхождений: {mismatches}")
+    pil = run("pil", pil_path, files, args.repeat)
+    fast = run("fast", fast_path, files, args.repeat)
+    print(f"Ускорение: x{pil / fast:.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
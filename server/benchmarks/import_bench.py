@@ -0,0 +1,93 @@
+# server/benchmarks/import_bench.py
+"""
+Бенчмарк запуска воркера: `python -X importtime` для импорта приложения в отдельном процессе.
+
+Печатает общее время импорта, пиковую память процесса, самые дорогие пакеты верхнего уровня
+и проверяет, что тяжелые библиотеки (GDAL, PIL, numpy, piexif, requests) не загружаются при старте,
+а откладываются до первого использования (services/lazy_import.py).
+
+Запуск из папки server:
+    python benchmarks/import_bench.py [--module app] [--create-app] [--top 15] [--repeat 3]
+"""
+import argparse
+import os
+import resource
+import statistics
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Пакеты, которые воркер должен загружать только по требованию
+HEAVY_PACKAGES = ("osgeo", "PIL", "numpy", "piexif", "requests")
+
+
+def run_import(module, create_app):
+    """Импортирует module в новом интерпретаторе; возвращает (строки importtime, пиковый RSS в КБ)"""
+    code = f"import {module}"
+    if create_app:
+        code += f"; {module}.create_app()"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SERVER_DIR, capture_output=True, text=True,
+    )
+    # ru_maxrss детей — максимум по всем завершенным дочерним процессам (Linux: КБ)
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+    return parse_importtime(proc.stderr), rss
+
+
+def parse_importtime(stderr):
+    """Строки вида 'import time:  self [us] | cumulative | imported package' -> [(self, cumulative, name)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app", help="что импортировать (по умолчанию app)")
+    parser.add_argument("--create-app", action="store_true", help="также вызвать module.create_app()")
+    parser.add_argument("--top", type=int, default=15, help="сколько самых дорогих пакетов показать")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    totals = []
+    rows = rss = None
+    for _ in range(args.repeat):
+        try:
+            rows, rss = run_import(args.module, args.create_app)
+        except RuntimeError as e:
+            print(f"Импорт {args.module} не удался: {e}")
+            return 1
+        totals.append(sum(r[0] for r in rows) / 1000)
+
+    print(f"Модуль: {args.module}{' + create_app()' if args.create_app else ''}  повторов: {args.repeat}")
+    print(f"Импорт: медиана {statistics.median(totals):.1f} ms, модулей {len(rows)}, пиковый RSS {rss / 1024:.1f} МБ")
+
+    print("\nСамые дорогие пакеты (cumulative, по корневому имени):")
+    top_level = {}
+    for _, cumulative_us, name in rows:
+        root = name.split(".")[0]
+        top_level[root] = max(top_level.get(root, 0), cumulative_us)
+    for root, cumulative_us in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {root:<24} {cumulative_us / 1000:9.1f} ms")
+
+    loaded = sorted({name.split(".")[0] for _, _, name in rows} & set(HEAVY_PACKAGES))
+    if loaded:
+        print(f"\nТяжелые пакеты загружены при старте: {', '.join(loaded)}")
+        return 1
+    print(f"\nТяжелые пакеты при старте не загружаются ({', '.join(HEAVY_PACKAGES)})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# server/benchmarks/pano_query_bench.py
+"""
+Бенчмарк запросов точек панорам: прежние формы запросов (geom + ::numeric, GROUP BY ST_SnapToGrid)
+против новых (типизированные координаты + покрывающие индексы, предрасчитанные кластеры),
+в том числе с фильтром по дню съемки.
+
+Для каждого запроса печатает медиану времени и узлы плана (видно, есть ли Index Only Scan).
+
+Запуск из папки server (нужен DATABASE_URL):
+    python benchmarks/pano_query_bench.py [--bbox west,south,east,north] [--repeat 20]
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+import config
+
+QUERIES = {
+    "raw_old": """
+        SELECT id, ROUND(ST_Y(geom)::numeric, 6) AS lat, ROUND(ST_X(geom)::numeric, 6) AS lng
+        FROM public.photos_4326
+        WHERE geom && ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)
+        ORDER BY id DESC LIMIT 50000
+    """,
+    "raw_new": """
+        SELECT id, round(latitude * 1e6) / 1e6 AS lat, round(longitude * 1e6) / 1e6 AS lng
+        FROM public.photos_4326
+        WHERE longitude BETWEEN %(west)s AND %(east)s AND latitude BETWEEN %(south)s AND %(north)s
+        ORDER BY id DESC LIMIT 50000
+    """,
+    "ids_gist_cover": """
+        SELECT id, direction
+        FROM public.photos_4326
+        WHERE geom && ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)
+    """,
+    "cluster_old": """
+        SELECT MIN(id), AVG(ST_Y(geom)), AVG(ST_X(geom)), COUNT(*)
+        FROM public.photos_4326
+        WHERE geom && ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)
+        GROUP BY ST_SnapToGrid(geom, %(g)s)
+    """,
+    "cluster_new": """
+        SELECT MIN(id), SUM(sum_y) / SUM(count), SUM(sum_x) / SUM(count), SUM(count)
+        FROM public.photos_4326_clusters
+        WHERE grid_size = %(g)s
+          AND cell_x BETWEEN round(%(west)s / %(g)s)::bigint AND round(%(east)s / %(g)s)::bigint
+          AND cell_y BETWEEN round(%(south)s / %(g)s)::bigint AND round(%(north)s / %(g)s)::bigint
+        GROUP BY cell_x, cell_y
+    """,
+    "cluster_new_day": """
+        SELECT MIN(id), SUM(sum_y) / SUM(count), SUM(sum_x) / SUM(count), SUM(count)
+        FROM public.photos_4326_clusters
+        WHERE grid_size = %(g)s
+          AND cell_x BETWEEN round(%(west)s / %(g)s)::bigint AND round(%(east)s / %(g)s)::bigint
+          AND cell_y BETWEEN round(%(south)s / %(g)s)::bigint AND round(%(north)s / %(g)s)::bigint
+          AND day BETWEEN %(day)s AND %(day)s
+        GROUP BY cell_x, cell_y
+    """,
+    "raw_new_day": """
+        SELECT id, round(latitude * 1e6) / 1e6 AS lat, round(longitude * 1e6) / 1e6 AS lng
+        FROM public.photos_4326
+        WHERE longitude BETWEEN %(west)s AND %(east)s AND latitude BETWEEN %(south)s AND %(north)s
+          AND "timestamp" >= %(day)s AND "timestamp" < %(day)s + 1
+        ORDER BY id DESC LIMIT 50000
+    """,
+}
+
+
+def plan_nodes(plan):
+    nodes = [plan["Node Type"] + (f" ({plan['Index Name']})" if "Index Name" in plan else "")]
+    for child in plan.get("Plans", []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bbox", help="west,south,east,north (по умолчанию — экстент таблицы)")
+    parser.add_argument("--grid", type=float, default=0.006, help="шаг сетки кластеров (по умолчанию зум 14)")
+    parser.add_argument("--day", help="день съемки для запросов *_day (по умолчанию — последний)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--only", help="список запросов через запятую: " + ",".join(QUERIES))
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(config.DATABASE_URL)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    if args.bbox:
+        west, south, east, north = (float(v) for v in args.bbox.split(","))
+    else:
+        cur.execute("SELECT ST_XMin(e), ST_YMin(e), ST_XMax(e), ST_YMax(e) FROM (SELECT ST_Extent(geom) AS e FROM public.photos_4326) s")
+        west, south, east, north = cur.fetchone()
+    if args.day:
+        day = datetime.date.fromisoformat(args.day)
+    else:
+        cur.execute('SELECT max("timestamp")::date FROM public.photos_4326')
+        day = cur.fetchone()[0] or datetime.date.today()
+    params = {"west": west, "south": south, "east": east, "north": north, "g": args.grid, "day": day}
+    print(f"BBOX: {west:.5f},{south:.5f},{east:.5f},{north:.5f}  grid={args.grid}  day={day}  repeat={args.repeat}")
+
+    names = args.only.split(",") if args.only else list(QUERIES)
+    for name in names:
+        query = QUERIES[name]
+        try:
+            cur.execute(query, params)
+            rows = len(cur.fetchall())
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                cur.execute(query, params)
+                cur.fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+            explain = cur.fetchone()[0]
+            explain = explain if isinstance(explain, list) else json.loads(explain)
+            nodes = " -> ".join(plan_nodes(explain[0]["Plan"]))
+            print(f"{name:<15} {statistics.median(timings):9.2f} ms  rows={rows:<7} {nodes}")
+        except psycopg2.Error as e:
+            print(f"{name:<15} ошибка: {str(e).strip()}")
+
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# server/bootstrap.py
+"""
+Разовая инициализация перед запуском воркеров gunicorn (entrypoint.sh):
+таблицы, индексы, триггеры, миграции alembic, бакеты MinIO и администратор по умолчанию.
+
+Все шаги идемпотентны — повторный запуск ничего не меняет. Воркеры больше не выполняют DDL
+и сетевые проверки при импорте, поэтому старт и rolling restart занимают миллисекунды.
+
+Запуск из корня проекта:
+    python server/bootstrap.py [--skip-minio] [--skip-alembic]
+В конце печатается отчет по времени каждого шага; код возврата 1, если упал шаг схемы БД.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import config
+from database import Database, release_connection
+from managers.pano_manager import PanoManager
+from managers.pano_cluster_manager import PanoClusterManager
+from managers.pano_nav_manager import PanoNavManager
+from managers.ortho_manager import OrthoManager
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def init_auth_tables():
+    # Таблица users, базовые таблицы и пользователи по умолчанию из .env
+    import init_pg_auth
+    init_pg_auth.init_auth_db()
+
+
+def run_alembic():
+    """alembic upgrade head — последующие миграции поверх идемпотентной базовой схемы"""
+    try:
+        from alembic import command
+        from alembic.config import Config
+    except ImportError:
+        return "skipped (alembic not installed)"
+    cfg = Config(os.path.join(SERVER_DIR, "alembic.ini"))
+    cfg.set_main_option("script_location", os.path.join(SERVER_DIR, "alembic"))
+    command.upgrade(cfg, "head")
+
+
+def ensure_buckets():
+    from storage import MinioStorage
+    from services.storage_service import StorageService
+    MinioStorage(bucket_name=getattr(config, "MINIO_BUCKET_NAME", "panoramas")).ensure_bucket()
+    # Бакет ортофото с политикой Public Read
+    StorageService().ensure_bucket()
+
+
+def ensure_default_admin():
+    """
+    Checks if the default admin user exists in the database.
+    If not, creates it using credentials from config/env.
+    """
+    from repositories import user_repository
+    from services.password_service import hash_password
+
+    # Читаем креды администратора из .env (с фоллбэком)
+    username = os.getenv("DEFAULT_ADMIN_USERNAME", getattr(config, "DEFAULT_ADMIN_USERNAME", "admin"))
+    password = os.getenv("DEFAULT_ADMIN_PASSWORD", getattr(config, "DEFAULT_ADMIN_PASSWORD", "change_me_please"))
+
+    if user_repository.get_user_by_username(username):
+        return f"user '{username}' exists"
+    new_id = user_repository.create_user(username, hash_password(password))
+    if not new_id:
+        raise RuntimeError(f"Failed to create user '{username}'. Check DB connection.")
+    return f"user '{username}' created (ID: {new_id})"
+
+
+def run(skip_minio=False, skip_alembic=False):
+    """Выполняет все шаги и печатает отчет. Возвращает True, если шаги схемы БД прошли успешно."""
+    db = Database()
+    steps = [
+        ("auth tables", init_auth_tables, True),
+        ("photos_4326", lambda: PanoManager(db).ensure_schema(), True),
+        ("pano clusters", lambda: PanoClusterManager(db).ensure_schema(), True),
+        ("pano navigation", lambda: PanoNavManager(db).ensure_schema(), True),
+        ("orthophotos", lambda: OrthoManager(db).ensure_schema(), True),
+    ]
+    if not skip_alembic:
+        steps.append(("alembic upgrade", run_alembic, True))
+    if not skip_minio:
+        steps.append(("minio buckets", ensure_buckets, False))
+    steps.append(("default admin", ensure_default_admin, False))
+
+    report = []
+    ok = True
+    started = time.perf_counter()
+    for name, func, required in steps:
+        step_started = time.perf_counter()
+        try:
+            note = func() or "ok"
+        except Exception as e:
+            note = f"FAILED: {e}"
+            ok = ok and not required
+        finally:
+            release_connection()
+        report.append((name, (time.perf_counter() - step_started) * 1000, note))
+    total = (time.perf_counter() - started) * 1000
+
+    print("Bootstrap report:")
+    for name, ms, note in report:
+        print(f"  {name:<16} {ms:9.1f} ms  {note}")
+    print(f"  {'total':<16} {total:9.1f} ms")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--skip-minio", action="store_true", help="не проверять бакеты MinIO")
+    parser.add_argument("--skip-alembic", action="store_true", help="не применять миграции alembic")
+    args = parser.parse_args()
+    return 0 if run(skip_minio=args.skip_minio, skip_alembic=args.skip_alembic) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
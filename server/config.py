@@ -56,13 +56,28 @@ ORTHO_FOLDER = os.getenv("ORTHO_FOLDER", os.path.join(UPLOAD_FOLDER, "orthos"))
 # Поднимаемся на уровень выше server, чтобы попасть в data
 TEMP_FOLDER = os.getenv("TEMP_FOLDER", os.path.join(BASE_DIR, "..", "data", "temp", "orthos"))
 TASKS_FOLDER = os.getenv("TASKS_FOLDER", os.path.join(BASE_DIR, "..", "data", "tasks"))
+# Состояния возобновляемых (chunked) загрузок
+UPLOAD_SESSIONS_FOLDER = os.getenv("UPLOAD_SESSIONS_FOLDER", os.path.join(BASE_DIR, "..", "data", "uploads"))
+
+# Размер части возобновляемой загрузки (S3 требует минимум 5 МБ для всех частей, кроме последней)
+UPLOAD_CHUNK_SIZE = max(int(os.getenv("UPLOAD_CHUNK_SIZE", 16 * 1024 * 1024)), 5 * 1024 * 1024)
+# Через сколько секунд незавершенная сессия загрузки удаляется вместе с принятыми частями
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 3600))
+# Лимит тела обычного (не chunked) запроса
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", 1024 * 1024 * 1024 * 1024))
+
+# Статика фронтенда (services/static_assets.py): таблица файлов сборки строится при старте воркера.
+# Файлы с хешем в имени кэшируются браузером на STATIC_IMMUTABLE_MAX_AGE секунд (immutable);
+# STATIC_AUTO_RELOAD перечитывает таблицу, если файла в ней нет (пересборка фронта без перезапуска)
+STATIC_IMMUTABLE_MAX_AGE = int(os.getenv("STATIC_IMMUTABLE_MAX_AGE", 365 * 24 * 3600))
+STATIC_AUTO_RELOAD = _env_bool("STATIC_AUTO_RELOAD", APP_ENV == "development")
 
 # Внутренние подпапки
 PANO_FOLDER = os.path.join(UPLOAD_FOLDER, "panos")
 TILES_FOLDER = os.path.join(ORTHO_FOLDER, "tiles")
 
 # Создаём все директории при старте
-for d in (UPLOAD_FOLDER, PANO_FOLDER, ORTHO_FOLDER, TILES_FOLDER, TEMP_FOLDER, TASKS_FOLDER):
+for d in (UPLOAD_FOLDER, PANO_FOLDER, ORTHO_FOLDER, TILES_FOLDER, TEMP_FOLDER, TASKS_FOLDER, UPLOAD_SESSIONS_FOLDER):
     os.makedirs(d, exist_ok=True)
 
 # =======================================================
@@ -80,6 +95,35 @@ DATABASE_URL = os.getenv(
     f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
 
+# Пул соединений на воркер. PgBouncer (transaction mode) держит к Postgres не больше
+# PGBOUNCER_POOL_SIZE (default_pool_size) соединений, поэтому по умолчанию
+# пул воркера = PGBOUNCER_POOL_SIZE / число воркеров gunicorn (WEB_CONCURRENCY)
+PGBOUNCER_POOL_SIZE = int(os.getenv("PGBOUNCER_POOL_SIZE", 20))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 4))
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", max(1, PGBOUNCER_POOL_SIZE // max(1, WEB_CONCURRENCY))))
+# Сколько секунд запрос ждет свободное соединение, прежде чем получить ошибку
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+
+# gunicorn (gunicorn.conf.py): приложение импортируется в мастере до fork, и воркеры делят его страницы памяти.
+# GDAL, PIL, numpy, piexif и requests грузятся лениво в каждом воркере; PRELOAD_MODULES (через запятую,
+# например "osgeo.gdal,PIL.Image") загружает их в мастере, если они все равно нужны каждому воркеру
+GUNICORN_PRELOAD = _env_bool("GUNICORN_PRELOAD", True)
+PRELOAD_MODULES = [m.strip() for m in os.getenv("PRELOAD_MODULES", "").split(",") if m.strip()]
+
+# Кэш пользователей (по id и username) в каждом воркере: время жизни записи (сек) и размер
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 30))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 1024))
+# Сколько недавно проверенных токенов держать в памяти воркера (повторная проверка без HMAC и JSON)
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", 4096))
+
+# Хеширование паролей: метод и стоимость в формате werkzeug (scrypt:N:r:p | pbkdf2:sha256:итерации).
+# Хеши со старыми параметрами пересчитываются при успешном входе (PASSWORD_REHASH_ON_LOGIN)
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+PASSWORD_REHASH_ON_LOGIN = _env_bool("PASSWORD_REHASH_ON_LOGIN", True)
+# Потоков на воркер для хеширования (под gevent вычисления идут вне цикла событий)
+PASSWORD_HASH_THREADS = int(os.getenv("PASSWORD_HASH_THREADS", 2))
+
 # =======================================================
 # 6. OBJECT STORAGE (MinIO)
 # =======================================================
@@ -89,8 +133,69 @@ MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minioadmin")
 MINIO_SECURE = _env_bool("MINIO_SECURE", False)
 MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME", "panoramas")
 MINIO_ORTHO_BUCKET = os.getenv("MINIO_ORTHO_BUCKET", "orthophotos")
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+# Размер общего пула HTTP-соединений к MinIO на процесс (urllib3 PoolManager maxsize)
+MINIO_POOL_MAXSIZE = int(os.getenv("MINIO_POOL_MAXSIZE", 32))
+
+# Адрес MinIO, доступный из браузера (для presigned URL). По умолчанию совпадает с внутренним.
+MINIO_PUBLIC_ENDPOINT = os.getenv("MINIO_PUBLIC_ENDPOINT", MINIO_ENDPOINT)
+MINIO_PUBLIC_SECURE = _env_bool("MINIO_PUBLIC_SECURE", MINIO_SECURE)
+# Время жизни presigned URL на загрузку (секунды)
+PRESIGNED_UPLOAD_EXPIRES = int(os.getenv("PRESIGNED_UPLOAD_EXPIRES", 3600))
+
+# Способ отдачи файлов (панорамы, ортофото) клиенту:
+#   proxy    — байты идут через Flask (поток из MinIO)
+#   redirect — 302 на короткоживущий presigned URL MinIO
+#   accel    — заголовок X-Accel-Redirect для nginx (location DOWNLOAD_ACCEL_PREFIX должна быть internal
+#              и проксировать на MinIO: location /_minio/ { internal; proxy_pass http://minio:9000/; })
+DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE", "proxy").strip().lower()
+PRESIGNED_DOWNLOAD_EXPIRES = int(os.getenv("PRESIGNED_DOWNLOAD_EXPIRES", 300))
+DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX", "/_minio/")
+
+# Пирамида кубических тайлов для панорам (строится в фоне после загрузки)
+PANO_TILES_ENABLED = _env_bool("PANO_TILES_ENABLED", True)
+PANO_TILE_SIZE = int(os.getenv("PANO_TILE_SIZE", 512))
+PANO_TILE_QUALITY = int(os.getenv("PANO_TILE_QUALITY", 85))
+# Размер грани в превью-полосе (уровень 0, первая отрисовка)
+PANO_PREVIEW_FACE_SIZE = int(os.getenv("PANO_PREVIEW_FACE_SIZE", 256))
+# Сколько пирамид строится одновременно в одном воркере (и сколько потоков для проекции граней под gevent)
+PANO_TILE_WORKERS = int(os.getenv("PANO_TILE_WORKERS", 2))
+# Навигационный граф панорам: соседние кадры одной съемки связываются, если между ними
+# не больше NAV_SEQUENCE_MAX_GAP секунд и NAV_SEQUENCE_MAX_DISTANCE метров;
+# плюс до NAV_NEAR_LIMIT ближайших панорам в радиусе NAV_NEAR_RADIUS метров
+NAV_SEQUENCE_MAX_GAP = int(os.getenv("NAV_SEQUENCE_MAX_GAP", 300))
+NAV_SEQUENCE_MAX_DISTANCE = float(os.getenv("NAV_SEQUENCE_MAX_DISTANCE", 100))
+NAV_NEAR_RADIUS = float(os.getenv("NAV_NEAR_RADIUS", 25))
+NAV_NEAR_LIMIT = int(os.getenv("NAV_NEAR_LIMIT", 4))
+# Время кеширования векторных тайлов точек панорам (/panoramas/tiles/z/x/y.pbf)
+PANO_MVT_MAX_AGE = int(os.getenv("PANO_MVT_MAX_AGE", 300))
+
+# Пакетная загрузка панорам: параллельных PUT в MinIO на запрос и размер пачки INSERT
+PANO_UPLOAD_PARALLELISM = int(os.getenv("PANO_UPLOAD_PARALLELISM", 8))
+PANO_INSERT_BATCH_SIZE = int(os.getenv("PANO_INSERT_BATCH_SIZE", 100))
+
+# Постраничные списки панорам и ортофотопланов (?limit=): размер страницы по умолчанию и максимум
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", 200))
+LIST_MAX_PAGE_SIZE = int(os.getenv("LIST_MAX_PAGE_SIZE", 2000))
 
 # =======================================================
 # 7. TITILER & GDAL
 # =======================================================
-TITILER_INTERNAL_URL = os.getenv("TITILER_INTERNAL_URL", "http://titiler:80")
\ No newline at end of file
+TITILER_INTERNAL_URL = os.getenv("TITILER_INTERNAL_URL", "http://titiler:80")
+
+# Чтение исходников ортофотопланов напрямую из MinIO через /vsis3/ (без полного скачивания во TEMP_FOLDER)
+GDAL_VSIS3_ENABLED = _env_bool("GDAL_VSIS3_ENABLED", True)
+# Размер блочного кэша GDAL (МБ) и кэша VSI для HTTP range-чтений (байты)
+GDAL_CACHEMAX = int(os.getenv("GDAL_CACHEMAX", 512))
+GDAL_VSI_CACHE_SIZE = int(os.getenv("GDAL_VSI_CACHE_SIZE", 64 * 1024 * 1024))
+# Сколько байт читать одним запросом при открытии удалённого файла (заголовок + IFD)
+GDAL_INGESTED_BYTES_AT_OPEN = int(os.getenv("GDAL_INGESTED_BYTES_AT_OPEN", 32768))
+
+# Профиль сжатия COG по умолчанию: auto | jpeg | webp | zstd | deflate | lerc | none
+# auto выбирает профиль по типу данных и числу каналов (RGB -> JPEG/YCbCr, DEM -> LERC и т.д.)
+COG_DEFAULT_PROFILE = os.getenv("COG_DEFAULT_PROFILE", "auto").strip().lower()
+COG_BLOCKSIZE = int(os.getenv("COG_BLOCKSIZE", 512))
+COG_OVERVIEW_RESAMPLING = os.getenv("COG_OVERVIEW_RESAMPLING", "AVERAGE").strip().upper()
+COG_JPEG_QUALITY = int(os.getenv("COG_JPEG_QUALITY", 85))
+# Допустимая погрешность LERC для DEM (в единицах высоты)
+COG_LERC_MAX_Z_ERROR = float(os.getenv("COG_LERC_MAX_Z_ERROR", 0.01))
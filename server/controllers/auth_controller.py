@@ -1,11 +1,11 @@
 # ./backend/controllers/auth_controller.py
-from flask import Blueprint, request, jsonify, make_response
-from werkzeug.security import check_password_hash
+from flask import Blueprint, request, jsonify, make_response, g
 from flask_cors import cross_origin
 import time
 
 from services.auth_service import create_access_token, decode_access_token
-from repositories.user_repository import get_user_by_username
+from services import password_service
+from repositories.user_repository import get_user_by_username, update_password
 import config
 
 auth_blueprint = Blueprint("auth", __name__)
@@ -27,6 +27,23 @@ def _set_token_cookie(resp, token: str):
     return resp
 
 
+def load_auth_claims():
+    """
+    before_request: cookie с токеном разбирается один раз на запрос,
+    claims кладутся в g.auth_claims (None — не авторизован), id пользователя — в g.user_id.
+    """
+    token = request.cookies.get(COOKIE_NAME)
+    g.auth_claims = decode_access_token(token) if token else None
+    g.user_id = g.auth_claims.get("uid") if g.auth_claims else None
+
+
+def current_claims():
+    """Claims текущего запроса (если middleware не подключен — разбираем здесь)."""
+    if "auth_claims" not in g:
+        load_auth_claims()
+    return g.auth_claims
+
+
 def _clear_token_cookie(resp):
     resp.set_cookie(
         COOKIE_NAME,
@@ -61,10 +78,15 @@ def login():
             return jsonify({"status": "error", "message": "Please provide username and password"}), 400
 
         user = get_user_by_username(username)
-        if not user or not check_password_hash(user["password"], password):
+        # Проверка хеша выполняется в пуле потоков и не блокирует остальные запросы воркера
+        if not user or not password_service.verify_password(user["password"], password):
             # Same response to protect against enumeration
             return jsonify({"status": "fail", "message": "Invalid credentials"}), 401
 
+        # Параметры хеширования поменялись (PASSWORD_HASH_METHOD) — пересчитываем хеш, пока знаем пароль
+        if getattr(config, "PASSWORD_REHASH_ON_LOGIN", True) and password_service.needs_rehash(user["password"]):
+            update_password(user["id"], password_service.hash_password(password))
+
         token = create_access_token(
             {"uid": user["id"], "u": user["username"]},
             expires_in=config.ACCESS_TOKEN_EXPIRES,
@@ -96,11 +118,7 @@ def me():
     if request.method == "OPTIONS":
         return jsonify({"status": "ok"}), 200
 
-    token = request.cookies.get(COOKIE_NAME)
-    if not token:
-        return jsonify({"authenticated": False}), 200
-
-    payload = decode_access_token(token)
+    payload = current_claims()
     if not payload:
         return jsonify({"authenticated": False}), 200
 
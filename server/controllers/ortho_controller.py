@@ -1,13 +1,16 @@
 # server/controllers/ortho_controller.py
-from flask import Blueprint, jsonify, request, make_response
+from flask import Blueprint, jsonify, request, make_response, Response
+from werkzeug.exceptions import RequestEntityTooLarge
 from managers.ortho_manager import OrthoManager
 from database import Database
 from services.task_service import TaskService
 from services.storage_service import StorageService
-from services.gdal_service import GdalService
+from services.gdal_service import GdalService, COG_PROFILES, OVERVIEW_RESAMPLINGS
 from services.ortho_service import OrthoService
+from services.upload_service import UploadService, UploadError
 import json
 import os
+import config
 
 ortho_blueprint = Blueprint("ortho", __name__)
 
@@ -22,6 +25,9 @@ class OrthoController:
         self.storage_service = StorageService()
         self.gdal_service = GdalService()
         
+        # Возобновляемые загрузки частями прямо в MinIO
+        self.upload_service = UploadService(self.storage_service)
+
         # Оркестратор
         self.ortho_service = OrthoService(
             self.db, 
@@ -36,7 +42,17 @@ class OrthoController:
         c = OrthoController()
 
         blueprint.add_url_rule("/orthophotos", view_func=c.get_orthophotos, methods=["GET"])
+        blueprint.add_url_rule("/orthophotos/summary", view_func=c.get_orthophotos_summary, methods=["GET"])
         blueprint.add_url_rule("/upload_ortho", view_func=c.upload_ortho, methods=["POST"])
+        # Возобновляемая загрузка: init -> PUT части с offset -> complete
+        blueprint.add_url_rule("/upload_ortho/init", view_func=c.init_chunked_upload, methods=["POST"])
+        blueprint.add_url_rule("/upload_ortho/<upload_id>", view_func=c.get_chunked_upload, methods=["GET"])
+        blueprint.add_url_rule("/upload_ortho/<upload_id>", view_func=c.put_upload_chunk, methods=["PUT"])
+        blueprint.add_url_rule("/upload_ortho/<upload_id>/complete", view_func=c.complete_chunked_upload, methods=["POST"])
+        blueprint.add_url_rule("/upload_ortho/<upload_id>", view_func=c.abort_chunked_upload, methods=["DELETE"])
+        # Прямая загрузка в MinIO по presigned URL (Flask не трогает байты); завершение — тот же /complete
+        blueprint.add_url_rule("/upload_ortho/direct", view_func=c.init_direct_upload, methods=["POST"])
+        blueprint.add_url_rule("/upload_ortho/<upload_id>/part_urls", view_func=c.get_upload_part_urls, methods=["GET"])
         blueprint.add_url_rule("/orthophotos/<int:ortho_id>/process", view_func=c.process_ortho_cog, methods=["POST"])
         blueprint.add_url_rule("/orthophotos/<int:ortho_id>", view_func=c.get_ortho, methods=["GET"])
         blueprint.add_url_rule("/orthophotos/<int:ortho_id>/download", view_func=c.download_ortho_file, methods=["GET"])
@@ -45,6 +61,7 @@ class OrthoController:
         blueprint.add_url_rule("/orthophotos/<int:ortho_id>/tiles/<int:z>/<int:x>/<int:y>.png", view_func=c.get_ortho_tile, methods=["GET"])
         blueprint.add_url_rule("/orthophotos/<int:ortho_id>/reproject", view_func=c.reproject_ortho, methods=["POST"])
         blueprint.add_url_rule("/tasks/<task_id>", view_func=c.get_task_status, methods=["GET"])
+        blueprint.add_url_rule("/orthophotos/cog_profiles", view_func=c.get_cog_profiles, methods=["GET"])
         
         # [NEW] Маршруты для превью
         blueprint.add_url_rule("/orthophotos/<int:ortho_id>/generate_preview", view_func=c.generate_preview, methods=["POST"])
@@ -53,7 +70,30 @@ class OrthoController:
     # --- Handlers ---
 
     def get_orthophotos(self):
-        return jsonify(self.ortho_service.get_all()), 200
+        """
+        Без параметров — весь список массивом (как раньше).
+        С ?limit / ?after / ?fields — страница {"items", "next_cursor"}; следующая страница: ?after=<next_cursor>.
+        """
+        paginate = any(k in request.args for k in ("limit", "after", "fields"))
+        fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()] or None
+        try:
+            body = self.ortho_service.list_json(
+                after_id=request.args.get("after", type=int),
+                limit=request.args.get("limit", type=int),
+                fields=fields,
+                paginate=paginate
+            )
+            return Response(body, mimetype="application/json"), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    def get_orthophotos_summary(self):
+        try:
+            return jsonify(self.ortho_service.get_summary()), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
 
     def upload_ortho(self):
         files = request.files.getlist("files")
@@ -90,6 +130,143 @@ class OrthoController:
             "status": "started"
         }), 202
 
+    def _cog_params(self):
+        """
+        Читает параметры сжатия из тела запроса: {"profile", "blocksize", "overview_resampling"}.
+        Возвращает (params, error).
+        """
+        data = request.get_json(silent=True) or {}
+        profile = (data.get("profile") or "").strip().lower() or None
+        resampling = (data.get("overview_resampling") or "").strip().upper() or None
+        blocksize = data.get("blocksize")
+
+        if profile and profile != "auto" and profile not in COG_PROFILES:
+            return None, f"Неизвестный профиль: {profile}"
+        if resampling and resampling not in OVERVIEW_RESAMPLINGS:
+            return None, f"Недопустимый метод ресемплинга: {resampling}"
+        if blocksize is not None:
+            try:
+                blocksize = int(blocksize)
+            except (TypeError, ValueError):
+                return None, "blocksize должен быть числом"
+            if blocksize not in (128, 256, 512, 1024, 2048):
+                return None, "blocksize должен быть одним из 128, 256, 512, 1024, 2048"
+
+        return {"profile": profile, "blocksize": blocksize, "overview_resampling": resampling}, None
+
+    def get_cog_profiles(self):
+        return jsonify({
+            "profiles": ["auto"] + list(COG_PROFILES.keys()),
+            "overview_resampling": list(OVERVIEW_RESAMPLINGS),
+            "default_profile": getattr(config, "COG_DEFAULT_PROFILE", "auto"),
+            "default_blocksize": getattr(config, "COG_BLOCKSIZE", 512),
+        }), 200
+
+    # --- Возобновляемая загрузка ---
+
+    def init_chunked_upload(self):
+        data = request.get_json(silent=True) or {}
+        try:
+            session = self.upload_service.init_upload(
+                data.get("filename"),
+                data.get("size"),
+                content_type=data.get("content_type") or "image/tiff"
+            )
+            return jsonify(session), 201
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    def get_chunked_upload(self, upload_id):
+        try:
+            return jsonify(self.upload_service.get_status(upload_id)), 200
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    def put_upload_chunk(self, upload_id):
+        # offset можно передать как ?offset=N или заголовком Upload-Offset (как в tus)
+        offset = request.args.get("offset", request.headers.get("Upload-Offset"))
+        # Часть не больше chunk_size: ограничиваем тело запроса, чтобы не читать лишнего
+        request.max_content_length = self.upload_service.chunk_size
+        try:
+            data = request.get_data(cache=False)
+            result = self.upload_service.put_chunk(upload_id, offset, data)
+            response = jsonify(result)
+            response.headers["Upload-Offset"] = str(result["offset"])
+            return response, 200
+        except RequestEntityTooLarge:
+            return jsonify({"error": "Часть больше chunk_size"}), 413
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    def init_direct_upload(self):
+        data = request.get_json(silent=True) or {}
+        try:
+            session = self.upload_service.init_direct_upload(
+                data.get("filename"),
+                data.get("size"),
+                content_type=data.get("content_type") or "image/tiff"
+            )
+            return jsonify(session), 201
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    def get_upload_part_urls(self, upload_id):
+        # ?parts=1,2,3 или диапазон ?parts=1-100
+        raw = request.args.get("parts", "1")
+        try:
+            part_numbers = []
+            for item in raw.split(","):
+                item = item.strip()
+                if "-" in item:
+                    start, end = (int(v) for v in item.split("-", 1))
+                    part_numbers.extend(range(start, end + 1))
+                elif item:
+                    part_numbers.append(int(item))
+        except ValueError:
+            return jsonify({"error": "Неверный формат parts"}), 400
+        if len(part_numbers) > 1000:
+            return jsonify({"error": "Не более 1000 частей за запрос"}), 400
+
+        try:
+            return jsonify(self.upload_service.get_part_urls(upload_id, part_numbers)), 200
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    def complete_chunked_upload(self, upload_id):
+        try:
+            filename = self.upload_service.complete(upload_id)
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+        # Файл уже собран в MinIO — запускаем обычную фоновую обработку
+        task_id = self.ortho_service.start_stored_upload_process(filename)
+        return jsonify({
+            "message": "Файл собран в хранилище и поставлен в очередь обработки",
+            "task_id": task_id,
+            "status": "started"
+        }), 202
+
+    def abort_chunked_upload(self, upload_id):
+        try:
+            self.upload_service.abort(upload_id)
+            return jsonify({"status": "aborted"}), 200
+        except UploadError as e:
+            return jsonify({"error": str(e)}), e.status
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
     def process_ortho_cog(self, ortho_id):
         # 1. Проверяем состояние файла перед запуском
         ortho = self.ortho_manager.get_ortho_by_id(ortho_id)
@@ -99,8 +276,12 @@ class OrthoController:
         if getattr(ortho, 'is_cog', False):
             return jsonify({"error": "Файл уже является COG. Конвертация не требуется."}), 400
 
+        params, error = self._cog_params()
+        if error:
+            return jsonify({"error": error}), 400
+
         # 2. Запускаем задачу
-        task_id = self.ortho_service.start_cog_process(ortho_id)
+        task_id = self.ortho_service.start_cog_process(ortho_id, **params)
         if not task_id:
             return jsonify({"error": "Не удалось запустить процесс"}), 500
             
@@ -116,8 +297,12 @@ class OrthoController:
         if crs and ("3857" in crs or "Pseudo-Mercator" in crs or "Google" in crs):
             return jsonify({"error": "Файл уже находится в проекции Web Mercator (EPSG:3857)."}), 400
 
+        params, error = self._cog_params()
+        if error:
+            return jsonify({"error": error}), 400
+
         # 2. Запускаем задачу
-        task_id = self.ortho_service.start_reproject_process(ortho_id)
+        task_id = self.ortho_service.start_reproject_process(ortho_id, **params)
         if not task_id:
              return jsonify({"error": "Не удалось запустить процесс"}), 500
              
@@ -1,106 +1,120 @@
 # server/controllers/pano_controller.py
 
-from flask import Blueprint, request, jsonify, send_file, Response
+from flask import Blueprint, request, jsonify, send_file, Response, stream_with_context, make_response
 from flask_cors import cross_origin
 import io
 import os
-import piexif
 import mimetypes
-from PIL import Image
-from datetime import datetime
+from datetime import datetime, date
 import traceback
 import logging
 import json
+import uuid
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # Use centralized Database class
 from database import Database
 from storage import MinioStorage
+from services.pano_tile_service import PanoTileService, CUBE_FACES
+from services import exif_reader
+from services.pano_manifest import PanoManifestReader, ManifestError, guess_format
+from services.lazy_import import lazy_module
+from services.task_service import TaskService
+from managers.pano_manager import PanoManager, pano_filter_sql
+from managers.pano_cluster_manager import PanoClusterManager, grid_for_zoom
+from managers.pano_nav_manager import PanoNavManager
+from controllers.vector import tile_bounds
 import config
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# PIL и piexif нужны только запасному разбору EXIF — загружаются при первом обращении
+Image = lazy_module("PIL.Image")
+piexif = lazy_module("piexif")
+
 pano_blueprint = Blueprint("pano", __name__)
 
+# Как часто (сек) удаляются записи presign, по которым так и не пришел complete
+_PRESIGN_CLEANUP_INTERVAL = 600
+_last_presign_cleanup = 0.0
+
 class PanoController:
     def __init__(self):
         # Use centralized Database class (connects via pgbouncer)
         self.db = Database()
-        self.storage = MinioStorage()
+        self.manager = PanoManager(self.db)
         
         # Подтягиваем имя бакета из конфигурации (.env)
         self.pano_bucket = getattr(config, 'MINIO_BUCKET_NAME', 'panoramas')
+        # Общий пул соединений MinIO; бакет передается явно в каждый вызов
+        self.storage = MinioStorage(bucket_name=self.pano_bucket)
+        # Пирамида кубических тайлов хранится в том же бакете (tiles/<id>/...)
+        self.tiles = PanoTileService(self.storage, self.pano_bucket)
+        # Ключи, выданные presign_pano_uploads: complete принимает только их
+        self.presigned = TaskService(os.path.join(getattr(config, "UPLOAD_SESSIONS_FOLDER", "data/uploads"), "pano"))
         
-        # Гарантируем, что таблица photos_4326 и индексы существуют!
-        self._ensure_table()
-        
-        # Ensure bucket exists
-        if self.storage.client:
-            try:
-                # Используем динамическое имя бакета
-                if not self.storage.client.bucket_exists(self.pano_bucket):
-                    self.storage.client.make_bucket(self.pano_bucket)
-            except Exception as e:
-                logger.warning(f"MinIO bucket warning: {e}")
+        # Предрасчитанные кластеры по сеткам зумов (поддерживаются триггерами на photos_4326)
+        self.clusters = PanoClusterManager(self.db)
+        # Навигационный граф (next/prev по съемке, near) для переходов между панорамами
+        self.nav = PanoNavManager(self.db)
 
-    def _ensure_table(self):
-        """Создает таблицу photos_4326 и необходимые индексы, если их нет"""
-        try:
-            cursor = self.db.get_cursor()
-            
-            # 1. Создаем таблицу (если нет)
-            query_table = """
-                CREATE TABLE IF NOT EXISTS public.photos_4326 (
-                    id SERIAL PRIMARY KEY,
-                    geom geometry(PointZ, 4326),
-                    path VARCHAR,
-                    filename VARCHAR,
-                    directory VARCHAR,
-                    altitude NUMERIC,
-                    direction NUMERIC,
-                    rotation INTEGER,
-                    longitude VARCHAR,
-                    latitude VARCHAR,
-                    "timestamp" TIMESTAMP,
-                    "order" INTEGER
-                );
-            """
-            cursor.execute(query_table)
-
-            # 2. Идемпотентное создание пространственного индекса
-            query_gist_index = """
-                CREATE INDEX IF NOT EXISTS idx_photos_4326_geom_gist 
-                ON public.photos_4326 USING GIST (geom);
-            """
-            cursor.execute(query_gist_index)
-
-            # 3. Опциональное создание обычного индекса по ID для быстрой сортировки
-            query_id_index = """
-                CREATE INDEX IF NOT EXISTS idx_photos_4326_id 
-                ON public.photos_4326 (id DESC);
-            """
-            cursor.execute(query_id_index)
-
-            self.db.commit()
-            logger.info("Table photos_4326 and indexes are ready.")
-        except Exception as e:
-            logger.warning(f"Could not initialize photos_4326 or indexes: {e}")
-            if self.db.connection:
-                self.db.connection.rollback()
+        # Таблицы, индексы, триггеры и бакет создает bootstrap.py до запуска воркеров
 
     @staticmethod
     def register_routes(blueprint):
         controller = PanoController()
         
         blueprint.add_url_rule("/panoramas", view_func=controller.get_panoramas, methods=["GET"])
+        # Векторные тайлы точек панорам (кластеры на зумах <= 17, сырые точки выше)
+        blueprint.add_url_rule("/panoramas/tiles/<int:z>/<int:x>/<int:y>.pbf", view_func=controller.get_pano_mvt, methods=["GET"])
         blueprint.add_url_rule("/upload", view_func=controller.upload_pano_files, methods=["POST", "OPTIONS"])
+        # Та же загрузка, но результаты по каждому файлу отдаются построчно (NDJSON) по мере готовности
+        blueprint.add_url_rule("/upload/batch", view_func=controller.upload_pano_batch, methods=["POST", "OPTIONS"])
+        # Прямая загрузка в MinIO: presigned PUT на каждый файл, затем регистрация по ключам объектов
+        blueprint.add_url_rule("/upload/presign", view_func=controller.presign_pano_uploads, methods=["POST", "OPTIONS"])
+        blueprint.add_url_rule("/upload/complete", view_func=controller.complete_pano_uploads, methods=["POST", "OPTIONS"])
+        # Массовый импорт метаданных из манифеста (CSV / GeoJSON / JSON lines) через COPY
+        blueprint.add_url_rule("/upload/manifest", view_func=controller.import_pano_manifest, methods=["POST", "OPTIONS"])
+        # Постраничный список для админки (keyset по id) и краткая сводка
+        blueprint.add_url_rule("/pano_info", view_func=controller.list_panos, methods=["GET"])
+        blueprint.add_url_rule("/pano_info/summary", view_func=controller.get_pano_summary, methods=["GET"])
         blueprint.add_url_rule("/pano_info/<int:pano_id>", view_func=controller.get_pano_info, methods=["GET"])
         blueprint.add_url_rule("/pano_info/<int:pano_id>/download", view_func=controller.download_pano_file, methods=["GET"])
+        blueprint.add_url_rule("/pano_info/<int:pano_id>/neighbors", view_func=controller.get_pano_neighbors, methods=["GET"])
+        blueprint.add_url_rule("/pano_info/<int:pano_id>/links", view_func=controller.get_pano_links, methods=["GET"])
+        # Многоуровневые тайлы; правила с <int:pano_id> проверяются раньше, чем <path:filename>
+        blueprint.add_url_rule("/panoramas/<int:pano_id>/tiles", view_func=controller.get_pano_tiles_meta, methods=["GET"])
+        blueprint.add_url_rule("/panoramas/<int:pano_id>/preview.jpg", view_func=controller.get_pano_preview, methods=["GET"])
+        blueprint.add_url_rule("/panoramas/<int:pano_id>/tiles/<int:level>/<face>/<int:x>_<int:y>.jpg", view_func=controller.get_pano_tile, methods=["GET"])
+        blueprint.add_url_rule("/pano_info/<int:pano_id>/tiles", view_func=controller.build_pano_tiles, methods=["POST", "OPTIONS"])
         blueprint.add_url_rule("/panoramas/<path:filename>", view_func=controller.get_pano_image_direct, methods=["GET"])
         blueprint.add_url_rule("/pano_info/<int:pano_id>", view_func=controller.delete_pano, methods=["DELETE"])
         blueprint.add_url_rule("/pano_info/<int:pano_id>", view_func=controller.update_pano, methods=["PUT"])
 
+    @staticmethod
+    def _pano_filters():
+        """
+        Фильтры выборки точек из query string: date_from, date_to (YYYY-MM-DD, включительно),
+        directory, session. Некорректная дата -> ValueError.
+        """
+        filters = {}
+        for key in ("date_from", "date_to"):
+            value = request.args.get(key)
+            if value:
+                try:
+                    filters[key] = date.fromisoformat(value)
+                except ValueError:
+                    raise ValueError(f"Invalid {key}: expected YYYY-MM-DD")
+        for key in ("directory", "session"):
+            value = request.args.get(key)
+            if value:
+                filters[key] = value
+        return filters
+
     @cross_origin()
     def get_panoramas(self):
         """
@@ -113,46 +127,24 @@ class PanoController:
             west = request.args.get('west', type=float)
             zoom = request.args.get('zoom', type=int)
             limit = request.args.get('limit', type=int, default=50000)
+            try:
+                filters = self._pano_filters()
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
 
             cursor = self.db.get_cursor()
-            grid_size = None
+            filter_sql, params = pano_filter_sql(filters)
             
-            # Строгая логика зумов:
-            if zoom is not None and zoom <= 17:
-                grids = {
-                    # Зум 0-10: Очень сильная кластеризация (~2000 км -> ~11 км). 1 кластер на город/регион.
-                    0: 20.0, 1: 10.0, 2: 5.0, 3: 2.5, 4: 1.5,
-                    5: 1.0, 6: 0.8, 7: 0.6, 8: 0.4, 9: 0.2, 10: 0.1,
-                    
-                    # Зум 11-17: Умеренная кластеризация (~5 км -> ~50 метров). Несколько на улицу.
-                    11: 0.05, 12: 0.025, 13: 0.012, 14: 0.006,
-                    15: 0.003, 16: 0.0015, 17: 0.0005
-                }
-                grid_size = grids.get(zoom, 0.0005)
+            # Строгая логика зумов: шаг сетки из ZOOM_GRIDS (зум 18+ — сырые точки)
+            grid_size = grid_for_zoom(zoom)
 
             if north is not None and south is not None:
                 if grid_size:
-                    # PostgreSQL сам группирует и собирает JSON массив
-                    query = """
-                        SELECT COALESCE(json_agg(json_build_object(
-                            'id', sub.id,
-                            'lat', sub.lat,
-                            'lng', sub.lng,
-                            'count', sub.count
-                        )), '[]'::json)
-                        FROM (
-                            SELECT 
-                                MIN(id) as id, 
-                                ROUND(AVG(ST_Y(geom))::numeric, 6) AS lat, 
-                                ROUND(AVG(ST_X(geom))::numeric, 6) AS lng, 
-                                COUNT(*) as count
-                            FROM public.photos_4326
-                            WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
-                            GROUP BY ST_SnapToGrid(geom, %s)
-                            LIMIT %s
-                        ) sub;
-                    """
-                    params = (west, south, east, north, grid_size, limit)
+                    # Кластеры уже посчитаны — читаем готовые строки по ключу ячейки
+                    result = self.clusters.get_clusters_json(grid_size, west, south, east, north, limit, filters)
+                    if isinstance(result, str):
+                        return Response(result, mimetype='application/json')
+                    return jsonify(result)
                 else:
                     # Сырые точки (Зум 18+)
                     query = """
@@ -165,34 +157,39 @@ class PanoController:
                         FROM (
                             SELECT 
                                 id, 
-                                ROUND(ST_Y(geom)::numeric, 6) as lat, 
-                                ROUND(ST_X(geom)::numeric, 6) as lng
-                            FROM public.photos_4326
-                            WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+                                round(latitude * 1e6) / 1e6 as lat, 
+                                round(longitude * 1e6) / 1e6 as lng
+                            FROM public.photos_4326 p
+                            WHERE longitude BETWEEN %(west)s AND %(east)s
+                              AND latitude BETWEEN %(south)s AND %(north)s
+                              {filter_sql}
                             ORDER BY id DESC
-                            LIMIT %s
+                            LIMIT %(limit)s
                         ) sub;
-                    """
-                    params = (west, south, east, north, limit)
+                    """.format(filter_sql=filter_sql)
+                    params.update({"west": west, "east": east, "south": south, "north": north, "limit": limit})
             else:
                 # Дефолтный ответ без BBOX
                 query = """
                     SELECT COALESCE(json_agg(json_build_object(
                         'id', id, 
-                        'lat', ROUND(ST_Y(geom)::numeric, 6), 
-                        'lng', ROUND(ST_X(geom)::numeric, 6), 
+                        'lat', round(latitude * 1e6) / 1e6, 
+                        'lng', round(longitude * 1e6) / 1e6, 
                         'count', 1
                     )), '[]'::json)
                     FROM (
-                        SELECT id, geom FROM public.photos_4326 ORDER BY id DESC LIMIT %s
+                        SELECT id, latitude, longitude FROM public.photos_4326 p
+                        WHERE TRUE {filter_sql}
+                        ORDER BY id DESC LIMIT %(limit)s
                     ) sub;
-                """
-                params = (limit,)
+                """.format(filter_sql=filter_sql)
+                params["limit"] = limit
 
             cursor.execute(query, params)
             
             # Получаем готовый JSON от базы! Никаких циклов Python.
-            result = cursor.fetchone()[0]
+            row = cursor.fetchone()
+            result = next(iter(row.values())) if isinstance(row, dict) else row[0]
             
             # Возвращаем напрямую
             if isinstance(result, str):
@@ -205,8 +202,129 @@ class PanoController:
         except Exception as e:
             logger.error(f"Error getting panoramas: {e}")
             traceback.print_exc()
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
+            return jsonify({"error": str(e)}), 500
+
+    @staticmethod
+    def _tile_lonlat_bounds(z, x, y):
+        """Границы тайла в EPSG:4326 (west, south, east, north)"""
+        min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+        r = 6378137.0
+        to_lon = lambda mx: math.degrees(mx / r)
+        to_lat = lambda my: math.degrees(math.atan(math.sinh(my / r)))
+        return to_lon(min_x), to_lat(min_y), to_lon(max_x), to_lat(max_y)
+
+    @cross_origin()
+    def get_pano_mvt(self, z, x, y):
+        """
+        MVT-тайл слоя "panoramas". На зумах с кластеризацией точки берутся из
+        photos_4326_clusters (id, count), выше — сырые точки (id, direction, count=1).
+        Клиент кеширует тайлы и при панорамировании запрашивает только новые.
+        """
+        if z < 0 or z > 30 or not (0 <= x < 2 ** z) or not (0 <= y < 2 ** z):
+            return jsonify({"error": "Invalid tile"}), 400
+        try:
+            filters = self._pano_filters()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+            west, south, east, north = self._tile_lonlat_bounds(z, x, y)
+            grid_size = grid_for_zoom(z)
+            cursor = self.db.get_cursor()
+
+            if grid_size:
+                cells, params = self.clusters.cells_sql(filters)
+                # Центр кластера строго внутри тайла — один кластер не рисуется в двух тайлах
+                query = """
+                    WITH bounds AS (
+                        SELECT ST_MakeEnvelope(%(min_x)s, %(min_y)s, %(max_x)s, %(max_y)s, 3857) AS geom
+                    ),
+                    cells AS ({cells}),
+                    mvtgeom AS (
+                        SELECT
+                            ST_AsMVTGeom(ST_Transform(ST_SetSRID(ST_MakePoint(c.lng, c.lat), 4326), 3857), bounds.geom) AS geom,
+                            c.id, c.count
+                        FROM cells c, bounds
+                        WHERE c.lng >= %(west)s AND c.lng < %(east)s
+                          AND c.lat >= %(south)s AND c.lat < %(north)s
+                    )
+                    SELECT ST_AsMVT(mvtgeom.*, 'panoramas') AS mvt FROM mvtgeom
+                """.format(cells=cells)
+            else:
+                filter_sql, params = pano_filter_sql(filters)
+                query = """
+                    WITH bounds AS (
+                        SELECT ST_MakeEnvelope(%(min_x)s, %(min_y)s, %(max_x)s, %(max_y)s, 3857) AS geom
+                    ),
+                    mvtgeom AS (
+                        SELECT
+                            ST_AsMVTGeom(ST_Transform(ST_Force2D(p.geom), 3857), bounds.geom) AS geom,
+                            p.id, p.direction, 1 AS count
+                        FROM public.photos_4326 p, bounds
+                        WHERE p.geom && ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)
+                          {filter_sql}
+                    )
+                    SELECT ST_AsMVT(mvtgeom.*, 'panoramas') AS mvt FROM mvtgeom
+                """.format(filter_sql=filter_sql)
+            params.update({
+                "min_x": min_x, "min_y": min_y, "max_x": max_x, "max_y": max_y,
+                "west": west, "south": south, "east": east, "north": north, "g": grid_size
+            })
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+            mvt = row["mvt"] if isinstance(row, dict) else row[0]
+            self.db.commit()
+
+            if not mvt:
+                return b'', 204
+
+            response = make_response(bytes(mvt))
+            response.headers['Content-Type'] = 'application/vnd.mapbox-vector-tile'
+            # Тайлы меняются при загрузке панорам: короткий max-age + ETag для дешевой ревалидации
+            response.headers['Cache-Control'] = f"public, max-age={getattr(config, 'PANO_MVT_MAX_AGE', 300)}"
+            response.add_etag()
+            return response.make_conditional(request)
+        except Exception as e:
+            logger.error(f"Pano MVT error: {e}")
+            self.db.rollback()
+            return jsonify({"error": str(e)}), 500
+
+    @cross_origin()
+    def list_panos(self):
+        """
+        Страница списка панорам: ?limit, ?after=<next_cursor>, ?fields=id,filename,...
+        и те же фильтры, что у /panoramas (date_from, date_to, directory, session).
+        """
+        try:
+            filters = self._pano_filters()
+            fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()] or None
+            result = self.manager.list_panos_json(
+                after_id=request.args.get("after", type=int),
+                limit=request.args.get("limit", type=int),
+                fields=fields,
+                filters=filters
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error listing panoramas: {e}")
+            return jsonify({"error": str(e)}), 500
+        if isinstance(result, str):
+            return Response(result, mimetype='application/json')
+        return jsonify(result)
+
+    @cross_origin()
+    def get_pano_summary(self):
+        """Число панорам (с фильтрами — точное, ?estimate=1 без фильтров — по статистике) и диапазон дат"""
+        try:
+            filters = self._pano_filters()
+            estimate = request.args.get("estimate", "").lower() in ("1", "true", "yes")
+            return jsonify(self.manager.get_summary(filters, estimate=estimate))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error getting pano summary: {e}")
             return jsonify({"error": str(e)}), 500
 
     @cross_origin()
@@ -225,7 +343,52 @@ class PanoController:
                 })
             return jsonify({"error": "Not found"}), 404
         except Exception as e:
-            if self.db.connection: self.db.connection.rollback()
+            self.db.rollback()
+            return jsonify({"error": str(e)}), 500
+
+    @staticmethod
+    def _with_urls(item):
+        """Добавляет относительные URL изображения и тайлов (как в ответе /panoramas/<id>/tiles)"""
+        item["image_url"] = f"panoramas/{item['filename']}"
+        item["tiles_url"] = f"panoramas/{item['id']}/tiles"
+        return item
+
+    @cross_origin()
+    def get_pano_neighbors(self, pano_id):
+        """
+        Ближайшие панорамы (KNN по GiST). Параметры: radius (м, по умолчанию NAV_NEAR_RADIUS * 2),
+        limit, heading (градусы) и tolerance — только соседи в этом секторе.
+        """
+        try:
+            radius = request.args.get('radius', type=float, default=getattr(config, "NAV_NEAR_RADIUS", 25) * 2)
+            limit = min(request.args.get('limit', type=int, default=8), 100)
+            heading = request.args.get('heading', type=float)
+            tolerance = request.args.get('tolerance', type=float, default=45.0)
+            neighbors = self.nav.get_neighbors(pano_id, radius, limit, heading=heading, tolerance=tolerance)
+            self.db.commit()
+            if neighbors is None:
+                return jsonify({"error": "Not found"}), 404
+            return jsonify({"id": pano_id, "neighbors": [self._with_urls(n) for n in neighbors]})
+        except Exception as e:
+            self.db.rollback()
+            return jsonify({"error": str(e)}), 500
+
+    @cross_origin()
+    def get_pano_links(self, pano_id):
+        """Ребра навигационного графа: ?rel=next|prev|near; для next/prev возвращается один ближайший переход"""
+        rel = request.args.get('rel')
+        if rel and rel not in ("next", "prev", "near"):
+            return jsonify({"error": "rel должен быть next, prev или near"}), 400
+        try:
+            links = [self._with_urls(link) for link in self.nav.get_links(pano_id, rel)]
+            self.db.commit()
+            if rel in ("next", "prev"):
+                if not links:
+                    return jsonify({"error": "Not found"}), 404
+                return jsonify(links[0])
+            return jsonify({"id": pano_id, "links": links})
+        except Exception as e:
+            self.db.rollback()
             return jsonify({"error": str(e)}), 500
 
     @cross_origin()
@@ -238,13 +401,10 @@ class PanoController:
             filename = res['filename'] if isinstance(res, dict) else res[0]
             mime_type, _ = mimetypes.guess_type(filename)
             if not mime_type: mime_type = "application/octet-stream"
-            orig_bucket = self.storage.bucket_name
-            self.storage.bucket_name = self.pano_bucket
             response = None
             if self.storage.client:
-                try: response = self.storage.send_local_file(filename, mimetype=mime_type)
+                try: response = self.storage.serve_file(filename, mimetype=mime_type, bucket_name=self.pano_bucket)
                 except: pass
-            self.storage.bucket_name = orig_bucket
             if response: return response
             return jsonify({"error": "File not found in storage"}), 404
         except Exception as e:
@@ -255,46 +415,334 @@ class PanoController:
         try:
             mime_type, _ = mimetypes.guess_type(filename)
             if not mime_type: mime_type = "application/octet-stream"
-            orig_bucket = self.storage.bucket_name
-            self.storage.bucket_name = self.pano_bucket
-            response = self.storage.send_local_file(filename, mimetype=mime_type)
-            self.storage.bucket_name = orig_bucket
-            return response
+            return self.storage.serve_file(filename, mimetype=mime_type, bucket_name=self.pano_bucket)
         except Exception as e:
             return jsonify({"error": str(e)}), 404
 
+    # Тайлы неизменны, пока пирамиду не перестроили; ETag из MinIO позволяет дешево ревалидировать
+    TILE_CACHE_CONTROL = "public, max-age=86400"
+
+    def _serve_tile_object(self, key):
+        response = self.storage.serve_file(key, mimetype="image/jpeg", bucket_name=self.pano_bucket)
+        # Редирект (DOWNLOAD_MODE=redirect) ведет на presigned URL, который живет PRESIGNED_DOWNLOAD_EXPIRES
+        # секунд, — его не кэшируем (app.py выставит no-store)
+        if not isinstance(response, tuple) and response.status_code in (200, 206, 304):
+            response.headers["Cache-Control"] = self.TILE_CACHE_CONTROL
+        return response
+
+    @cross_origin()
+    def get_pano_tiles_meta(self, pano_id):
+        """Описание пирамиды для Marzipano (CubeGeometry levels + шаблоны URL)"""
+        try:
+            meta = self.tiles.get_meta(pano_id)
+            if meta is None:
+                return jsonify({"error": "Tiles not ready"}), 404
+            meta["tile_url"] = f"panoramas/{pano_id}/tiles/{{z}}/{{f}}/{{x}}_{{y}}.jpg"
+            meta["preview_url"] = f"panoramas/{pano_id}/preview.jpg"
+            return jsonify(meta)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @cross_origin()
+    def get_pano_preview(self, pano_id):
+        try:
+            return self._serve_tile_object(self.tiles.preview_key(pano_id))
+        except Exception as e:
+            return jsonify({"error": str(e)}), 404
+
+    @cross_origin()
+    def get_pano_tile(self, pano_id, level, face, x, y):
+        if face not in CUBE_FACES:
+            return jsonify({"error": "Unknown face"}), 404
+        try:
+            return self._serve_tile_object(self.tiles.tile_key(pano_id, level, face, x, y))
+        except Exception as e:
+            return jsonify({"error": str(e)}), 404
+
+    @cross_origin()
+    def build_pano_tiles(self, pano_id):
+        """(Пере)строение пирамиды для уже загруженной панорамы, например для старых записей"""
+        if request.method == "OPTIONS": return "", 200
+        try:
+            cursor = self.db.get_cursor()
+            cursor.execute("SELECT filename FROM public.photos_4326 WHERE id = %s", (pano_id,))
+            res = cursor.fetchone()
+            if not res: return jsonify({"error": "Not found"}), 404
+            filename = res['filename'] if isinstance(res, dict) else res[0]
+            self.tiles.generate_async(pano_id, filename)
+            return jsonify({"status": "processing", "pano_id": pano_id}), 202
+        except Exception as e:
+            self.db.rollback()
+            return jsonify({"error": str(e)}), 500
+
     @cross_origin()
     def upload_pano_files(self):
         if request.method == "OPTIONS": return "", 200
         uploaded_files = request.files.getlist("files")
         successful, failed, failed_reasons = [], [], []
-        orig_bucket = self.storage.bucket_name
-        self.storage.bucket_name = self.pano_bucket
         try:
-            for file in uploaded_files:
+            for result in self._ingest_pano_files(uploaded_files):
+                if result["status"] == "ok":
+                    successful.append(result["filename"])
+                else:
+                    failed.append(result["filename"])
+                    failed_reasons.append(result["error"])
+            return jsonify({"message": "Upload complete", "successful_uploads": successful, "failed_uploads": failed, "skipped_files": failed_reasons})
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @cross_origin()
+    def upload_pano_batch(self):
+        """
+        Пакетная загрузка с построчным ответом (application/x-ndjson):
+        по строке на каждый файл по мере сохранения и итоговая строка {"done": true, ...}.
+        """
+        if request.method == "OPTIONS": return "", 200
+        uploaded_files = request.files.getlist("files")
+
+        def generate():
+            counts = {"ok": 0, "failed": 0}
+            try:
+                for result in self._ingest_pano_files(uploaded_files):
+                    counts[result["status"]] += 1
+                    yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+            yield json.dumps({"done": True, "successful": counts["ok"], "failed": counts["failed"]}) + "\n"
+
+        response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+        # nginx не должен копить ответ целиком — клиент видит прогресс сразу
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+    def _ingest_pano_files(self, files):
+        """
+        Конвейер загрузки: EXIF читается только из заголовка файла, объекты уходят в MinIO
+        параллельно (не больше PANO_UPLOAD_PARALLELISM одновременно), строки пишутся в БД
+        пачками по PANO_INSERT_BATCH_SIZE. Генерирует результат по каждому файлу по мере готовности:
+        в полете не больше 2 * PANO_UPLOAD_PARALLELISM файлов, завершенные разбираются между отправками.
+
+        Части multipart werkzeug уже держит в SpooledTemporaryFile (крупные — на диске),
+        поэтому файл ни разу не читается в память целиком.
+        """
+        parallelism = max(1, getattr(config, "PANO_UPLOAD_PARALLELISM", 8))
+        batch_size = max(1, getattr(config, "PANO_INSERT_BATCH_SIZE", 100))
+        window = parallelism * 2
+        pending = []
+        futures = {}
+
+        def drain(done):
+            for future in done:
+                item = futures.pop(future)
                 try:
-                    original_name = file.filename
-                    file_content = file.read()
-                    mime_type, _ = mimetypes.guess_type(original_name)
-                    if not mime_type: mime_type = "image/jpeg"
-                    img_stream = io.BytesIO(file_content)
-                    lat, lon, alt, direction, dt = self._parse_exif_data(img_stream)
-                    if lat is None or lon is None: raise ValueError("В файле нет GPS-координат (EXIF)")
-                    timestamp_str = dt.strftime("%Y%m%d_%H%M%S") if dt else "nodate"
-                    new_filename = f"pano_{timestamp_str}_{original_name}"
-                    file_path = f"{self.pano_bucket}/{new_filename}" 
-                    save_stream = io.BytesIO(file_content)
-                    self.storage.save_file(save_stream, new_filename, content_type=mime_type)
-                    self._insert_pano_db(new_filename, file_path, lat, lon, alt, direction, dt)
-                    successful.append(original_name)
+                    future.result()
                 except Exception as e:
-                    failed.append(file.filename)
-                    failed_reasons.append(str(e))
-            return jsonify({"message": "Upload complete", "successful_uploads": successful, "failed_uploads": failed, "skipped_files": failed_reasons})
+                    yield {"filename": item["original_name"], "status": "failed", "error": str(e)}
+                    continue
+                pending.append(item)
+                if len(pending) >= batch_size:
+                    batch = pending[:]
+                    del pending[:]
+                    yield from self._insert_pano_batch(batch)
+
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            for file in files:
+                try:
+                    item = self._prepare_pano_upload(file)
+                except Exception as e:
+                    yield {"filename": file.filename, "status": "failed", "error": str(e)}
+                    continue
+                futures[pool.submit(self._store_pano_object, file, item)] = item
+
+                # Окно заполнено — ждем хотя бы один файл, иначе забираем уже готовые без ожидания
+                if len(futures) >= window:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                else:
+                    done = [f for f in futures if f.done()]
+                yield from drain(done)
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                yield from drain(done)
+
+        if pending:
+            yield from self._insert_pano_batch(pending)
+
+    @cross_origin()
+    def import_pano_manifest(self):
+        """
+        Импорт метаданных панорам (файлы уже лежат в бакете или во внешнем хранилище).
+        Манифест — файл в поле "manifest" или тело запроса; формат из ?format= или по расширению.
+        """
+        if request.method == "OPTIONS": return "", 200
+        upload = request.files.get("manifest")
+        if upload:
+            stream, name, content_type = upload.stream, upload.filename, upload.mimetype
+        else:
+            stream, name, content_type = request.stream, "", request.mimetype
+        fmt = (request.args.get("format") or guess_format(name, content_type)).lower()
+        try:
+            reader = PanoManifestReader(stream, fmt, default_directory=self.pano_bucket, bucket_name=self.pano_bucket)
+            result = self.manager.bulk_upsert(reader)
+            result["invalid"] = reader.invalid
+            result["errors"] = reader.errors
+            return jsonify(result)
+        except ManifestError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    def _prepare_pano_upload(self, file):
+        """
+        Разбирает EXIF по первым EXIF_HEAD_BYTES байтам и готовит имя объекта.
+        Имя уникально (как в presign_pano_uploads): повторная загрузка того же файла не перезаписывает
+        объект, на который уже ссылается строка photos_4326, и при ошибке вставки пачки
+        удаляются только объекты, созданные этой пачкой.
+        """
+        original_name = os.path.basename(file.filename or "")
+        if not original_name:
+            raise ValueError("Пустое имя файла")
+        stream = file.stream
+        stream.seek(0)
+        head = stream.read(self.EXIF_HEAD_BYTES)
+        stream.seek(0)
+        lat, lon, alt, direction, dt = self._parse_exif_data(io.BytesIO(head))
+        if lat is None or lon is None: raise ValueError("В файле нет GPS-координат (EXIF)")
+        mime_type, _ = mimetypes.guess_type(original_name)
+        timestamp_str = dt.strftime("%Y%m%d_%H%M%S") if dt else "nodate"
+        new_filename = f"pano_{timestamp_str}_{uuid.uuid4().hex[:12]}_{original_name}"
+        return {
+            "original_name": original_name, "filename": new_filename, "mime_type": mime_type or "image/jpeg",
+            "lat": lat, "lon": lon, "alt": alt, "direction": direction, "timestamp": dt
+        }
+
+    def _store_pano_object(self, file, item):
+        # Поток из временного файла werkzeug передается в put_object без копирования в BytesIO
+        self.storage.save_file(file.stream, item["filename"], content_type=item["mime_type"], bucket_name=self.pano_bucket)
+
+    def _insert_pano_batch(self, items):
+        """
+        Пачка строк уходит в БД одним COPY + INSERT (PanoManager.bulk_upsert) в одной транзакции.
+        Загрузка только вставляет строки: обновление по path остается за импортом манифеста.
+        """
+        records = [{
+            "filename": i["filename"], "path": f"{self.pano_bucket}/{i['filename']}", "directory": self.pano_bucket,
+            "latitude": float(i["lat"]), "longitude": float(i["lon"]), "altitude": float(i["alt"] or 0),
+            "direction": float(i["direction"] or 0), "rotation": 0, "timestamp": i["timestamp"]
+        } for i in items]
+        try:
+            returned = self.manager.bulk_upsert(records, returning=True, update_existing=False)["rows"]
+        except Exception as e:
+            logger.error(f"Batch insert error: {e}")
+            for i in items:
+                # Объект без строки в БД недоступен — убираем его из бакета (ключ уникален, чужих строк нет)
+                try: self.storage.delete_file(i["filename"], bucket_name=self.pano_bucket)
+                except Exception: pass
+                yield {"filename": i["original_name"], "status": "failed", "error": str(e)}
+            return
+
+        ids = {row["filename"]: row["id"] for row in returned}
+        for i in items:
+            pano_id = ids.get(i["filename"])
+            self.tiles.generate_async(pano_id, i["filename"])
+            yield {"filename": i["original_name"], "status": "ok", "id": pano_id, "object_key": i["filename"]}
+
+    # Сколько байт с начала JPEG читаем для разбора EXIF (APP1 всегда в начале файла)
+    EXIF_HEAD_BYTES = exif_reader.EXIF_HEAD_BYTES
+
+    @cross_origin()
+    def presign_pano_uploads(self):
+        """Выдает presigned PUT URL для каждого файла. Байты в Flask не попадают."""
+        if request.method == "OPTIONS": return "", 200
+        data = request.get_json(silent=True) or {}
+        names = data.get("filenames") or []
+        if not names:
+            return jsonify({"error": "Нет файлов"}), 400
+        if not self.storage.client:
+            return jsonify({"error": "MinIO not available"}), 500
+        self._cleanup_presigned()
+        try:
+            uploads = []
+            for name in names:
+                original_name = os.path.basename(str(name))
+                object_key = f"pano_{uuid.uuid4().hex[:12]}_{original_name}"
+                self.presigned.save_state(object_key, {"filename": original_name, "created_at": int(time.time())})
+                uploads.append({
+                    "filename": original_name,
+                    "object_key": object_key,
+                    "url": self.storage.presigned_put_url(object_key, bucket_name=self.pano_bucket)
+                })
+            return jsonify({"uploads": uploads})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
-        finally:
-            self.storage.bucket_name = orig_bucket
+
+    @cross_origin()
+    def complete_pano_uploads(self):
+        """
+        Колбэк после прямой загрузки: читает только заголовок каждого объекта,
+        извлекает EXIF/GPS и регистрирует панораму в БД.
+        """
+        if request.method == "OPTIONS": return "", 200
+        data = request.get_json(silent=True) or {}
+        object_keys = data.get("object_keys") or []
+        successful, failed, failed_reasons = [], [], []
+        for object_key in object_keys:
+            object_key = str(object_key)
+            try:
+                self._claim_presigned(object_key)
+                self._ingest_stored_pano(object_key)
+                successful.append(object_key)
+            except Exception as e:
+                failed.append(object_key)
+                failed_reasons.append(str(e))
+        return jsonify({"message": "Upload complete", "successful_uploads": successful, "failed_uploads": failed, "skipped_files": failed_reasons})
+
+    def _claim_presigned(self, object_key):
+        """
+        Ключ должен быть выдан presign_pano_uploads и еще не зарегистрирован: иначе клиент
+        мог бы передать ключ чужой панорамы, и при отсутствии GPS в EXIF объект был бы удален.
+        Запись presign одноразовая — повторный complete с тем же ключом отклоняется.
+        """
+        record = self.presigned.get_state(object_key) if object_key == os.path.basename(object_key) else None
+        if record is None:
+            raise ValueError("Ключ объекта не выдавался для загрузки")
+        self.presigned.delete_state(object_key)
+        if time.time() - record.get("created_at", 0) > getattr(config, "UPLOAD_SESSION_TTL", 24 * 3600):
+            raise ValueError("Срок загрузки истек, запросите presign заново")
+        cursor = self.db.get_cursor()
+        cursor.execute(
+            "SELECT 1 FROM public.photos_4326 WHERE filename = %s OR path = %s LIMIT 1",
+            (object_key, f"{self.pano_bucket}/{object_key}")
+        )
+        exists = cursor.fetchone() is not None
+        self.db.commit()
+        if exists:
+            raise ValueError("Панорама с этим ключом уже зарегистрирована")
+
+    def _cleanup_presigned(self):
+        """Удаляет записи presign старше UPLOAD_SESSION_TTL (не чаще раза в _PRESIGN_CLEANUP_INTERVAL)"""
+        global _last_presign_cleanup
+        now = time.time()
+        if now - _last_presign_cleanup < _PRESIGN_CLEANUP_INTERVAL:
+            return
+        _last_presign_cleanup = now
+        ttl = getattr(config, "UPLOAD_SESSION_TTL", 24 * 3600)
+        for object_key in self.presigned.list_ids():
+            record = self.presigned.get_state(object_key)
+            if not record or now - record.get("created_at", 0) > ttl:
+                self.presigned.delete_state(object_key)
+
+    def _ingest_stored_pano(self, object_key):
+        if self.storage.stat_file(object_key, bucket_name=self.pano_bucket) is None:
+            raise ValueError("Файл не найден в хранилище")
+        head = self.storage.read_head(object_key, self.EXIF_HEAD_BYTES, bucket_name=self.pano_bucket)
+        lat, lon, alt, direction, dt = self._parse_exif_data(io.BytesIO(head))
+        if lat is None or lon is None:
+            # Без координат панорама не нужна — не оставляем мусор в бакете
+            self.storage.delete_file(object_key, bucket_name=self.pano_bucket)
+            raise ValueError("В файле нет GPS-координат (EXIF)")
+        pano_id = self._insert_pano_db(object_key, f"{self.pano_bucket}/{object_key}", lat, lon, alt, direction, dt)
+        self.tiles.generate_async(pano_id, object_key)
 
     @cross_origin()
     def delete_pano(self, pano_id):
@@ -306,14 +754,13 @@ class PanoController:
                 filename = res['filename'] if isinstance(res, dict) else res[0]
                 cursor.execute("DELETE FROM public.photos_4326 WHERE id = %s", (pano_id,))
                 self.db.commit()
-                orig = self.storage.bucket_name
-                self.storage.bucket_name = self.pano_bucket
-                self.storage.delete_file(filename)
-                self.storage.bucket_name = orig
+                self.storage.delete_file(filename, bucket_name=self.pano_bucket)
+                try: self.tiles.delete(pano_id)
+                except Exception as e: logger.warning(f"Pano tiles cleanup error: {e}")
                 return jsonify({"status": "deleted"})
             return jsonify({"error": "Not found"}), 404
         except Exception as e:
-            if self.db.connection: self.db.connection.rollback()
+            self.db.rollback()
             return jsonify({"error": str(e)}), 500
 
     @cross_origin()
@@ -322,12 +769,25 @@ class PanoController:
 
     def _insert_pano_db(self, filename, path, lat, lon, alt, direction, timestamp):
         cursor = self.db.get_cursor()
-        query = 'INSERT INTO public.photos_4326 (geom, path, filename, directory, altitude, direction, rotation, longitude, latitude, "timestamp", "order") VALUES (ST_SetSRID(ST_MakePoint(%s, %s, %s), 4326), %s, %s, %s, %s, %s, 0, %s, %s, %s, 0)'
-        values = (float(lon), float(lat), float(alt or 0), path, filename, self.pano_bucket, float(alt or 0), float(direction or 0), str(lon), str(lat), timestamp or datetime.now())
+        query = 'INSERT INTO public.photos_4326 (geom, path, filename, directory, altitude, direction, rotation, longitude, latitude, "timestamp", "order") VALUES (ST_SetSRID(ST_MakePoint(%s, %s, %s), 4326), %s, %s, %s, %s, %s, 0, %s, %s, %s, 0) RETURNING id'
+        values = (float(lon), float(lat), float(alt or 0), path, filename, self.pano_bucket, float(alt or 0), float(direction or 0), float(lon), float(lat), timestamp or datetime.now())
         cursor.execute(query, values)
+        row = cursor.fetchone()
         self.db.commit()
+        return row['id'] if isinstance(row, dict) else row[0]
 
     def _parse_exif_data(self, stream):
+        # Быстрый путь: разбираем только сегмент APP1 из заголовка, изображение не открываем
+        try:
+            stream.seek(0)
+            parsed = exif_reader.read_exif_gps(stream.read(self.EXIF_HEAD_BYTES))
+            stream.seek(0)
+            if parsed is not None:
+                return parsed
+        except Exception as e:
+            logger.warning(f"Fast exif parsing error: {e}")
+            stream.seek(0)
+        # Запасной путь через PIL/piexif (нестандартные или поврежденные заголовки)
         try:
             img = Image.open(stream)
             exif = img.getexif()
@@ -1,14 +1,39 @@
 # ./backend/database.py
 
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
 from psycopg2.extras import RealDictCursor
 import config
 import os
 
+# Один пул на процесс (воркер gunicorn): все экземпляры Database берут соединения из него
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+# Соединение, выданное текущему потоку. Под gevent (monkey.patch_all в воркере gunicorn)
+# threading.local привязан к гринлету, поэтому у каждого запроса своя транзакция.
+_local = threading.local()
+
+
+class PoolTimeout(Exception):
+    """Все соединения пула заняты дольше DB_POOL_TIMEOUT секунд"""
+    pass
+
+
 class Database:
     """
-    Класс-обёртка для работы с PostgreSQL.
+    Класс-обёртка для работы с PostgreSQL поверх пула соединений.
     Настройки подключения берутся строго из config.py.
+
+    Каждый гринлет/поток получает собственное соединение из общего пула:
+      - with db.connection() as cur: ... — выдать соединение, COMMIT при выходе, ROLLBACK при ошибке;
+      - get_cursor() / commit() / rollback() — прежний интерфейс, соединение держится до release()
+        (в веб-запросе release() вызывается автоматически в teardown приложения).
+    Разорванные соединения отбрасываются и при следующем обращении открываются заново.
     """
     def __init__(self):
         # Используем готовую строку подключения DATABASE_URL из config (приоритетный способ), 
@@ -22,70 +47,198 @@ class Database:
         self.database = getattr(config, "DB_NAME", "botplus_db")
         self.user = getattr(config, "DB_USER", "botplus_user")
         self.password = getattr(config, "DB_PASSWORD", "botplus_password")
-        
-        self.connection = None
+
+    # --- Пул ---
+
+    def _get_pool(self):
+        global _pool, _pool_slots
+        if _pool is None:
+            with _pool_lock:
+                if _pool is None:
+                    min_size = getattr(config, "DB_POOL_MIN", 1)
+                    max_size = max(min_size, getattr(config, "DB_POOL_MAX", 5))
+                    try:
+                        if self.database_url:
+                            # Подключение через единый URL (идеально для PgBouncer и SQLAlchemy)
+                            _pool = pg_pool.ThreadedConnectionPool(
+                                min_size, max_size, self.database_url, cursor_factory=RealDictCursor
+                            )
+                        else:
+                            # Fallback на классический метод передачи аргументов
+                            _pool = pg_pool.ThreadedConnectionPool(
+                                min_size, max_size,
+                                host=self.host,
+                                port=self.port,
+                                database=self.database,
+                                user=self.user,
+                                password=self.password,
+                                cursor_factory=RealDictCursor
+                            )
+                    except Exception as e:
+                        # Логируем точные параметры подключения при ошибке
+                        print(f"CRITICAL: Failed to connect to PostgreSQL at {self.host}:{self.port}/{self.database}")
+                        print(f"Error details: {e}")
+                        raise e
+                    # ThreadedConnectionPool при исчерпании сразу бросает PoolError — ждем свободный слот сами
+                    _pool_slots = threading.BoundedSemaphore(max_size)
+        return _pool
+
+    def _checkout(self):
+        pool = self._get_pool()
+        if not _pool_slots.acquire(timeout=getattr(config, "DB_POOL_TIMEOUT", 30)):
+            raise PoolTimeout("PostgreSQL pool exhausted")
+        try:
+            conn = pool.getconn()
+            # Соединение могло умереть, пока лежало в пуле (рестарт pgbouncer/postgres)
+            if conn.closed or conn.get_transaction_status() == TRANSACTION_STATUS_UNKNOWN:
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
+            # Автокоммит отключен, чтобы мы могли управлять транзакциями вручную (self.commit())
+            conn.autocommit = False
+            return conn
+        except Exception as e:
+            _pool_slots.release()
+            print(f"CRITICAL: Failed to connect to PostgreSQL at {self.host}:{self.port}/{self.database}")
+            print(f"Error details: {e}")
+            raise e
+
+    def _checkin(self, conn, discard=False):
+        try:
+            if not discard and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                # Незавершенная транзакция не должна достаться следующему владельцу
+                conn.rollback()
+        except psycopg2.Error:
+            discard = True
+        try:
+            self._get_pool().putconn(conn, close=discard or bool(conn.closed))
+        finally:
+            _pool_slots.release()
+
+    # --- Соединение текущего гринлета ---
+
+    @property
+    def conn(self):
+        """Соединение текущего гринлета/потока или None"""
+        return getattr(_local, "conn", None)
 
     def connect(self):
         """
-        Устанавливает соединение, если оно отсутствует или закрыто.
+        Выдает текущему гринлету соединение из пула, если его еще нет или оно разорвано.
         """
-        # Если объект соединения есть, но связь разорвана (closed != 0) — сбрасываем
-        if self.connection is not None:
-            if self.connection.closed != 0:
-                self.connection = None
-
-        if self.connection is None:
-            try:
-                if self.database_url:
-                    # Подключение через единый URL (идеально для PgBouncer и SQLAlchemy)
-                    self.connection = psycopg2.connect(
-                        self.database_url,
-                        cursor_factory=RealDictCursor
-                    )
-                else:
-                    # Fallback на классический метод передачи аргументов
-                    self.connection = psycopg2.connect(
-                        host=self.host,
-                        port=self.port,
-                        database=self.database,
-                        user=self.user,
-                        password=self.password,
-                        cursor_factory=RealDictCursor
-                    )
-                
-                # Автокоммит отключен, чтобы мы могли управлять транзакциями вручную (self.commit())
-                self.connection.autocommit = False
-            except Exception as e:
-                # Логируем точные параметры подключения при ошибке
-                print(f"CRITICAL: Failed to connect to PostgreSQL at {self.host}:{self.port}/{self.database}")
-                print(f"Error details: {e}")
-                raise e
+        conn = self.conn
+        if conn is not None and conn.closed:
+            self._checkin(conn, discard=True)
+            conn = None
+        if conn is None:
+            conn = self._checkout()
+            _local.conn = conn
+        return conn
+
+    def release(self):
+        """
+        Возвращает соединение текущего гринлета в пул (незавершенная транзакция откатывается).
+        """
+        conn = self.conn
+        if conn is not None:
+            _local.conn = None
+            self._checkin(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        with db.connection() as cur: ... — транзакция на соединении текущего гринлета.
+        COMMIT при выходе, ROLLBACK при исключении; если соединение было взято здесь — оно же и возвращается.
+
+        Вложенный вызов (внутри другого connection() или когда у вызывающего кода через get_cursor()
+        уже открыта транзакция) работает в SAVEPOINT: RELEASE при выходе, ROLLBACK TO при ошибке.
+        Чужую незавершенную транзакцию он не фиксирует и не откатывает — это делает внешний уровень.
+        """
+        owned = self.conn is None
+        conn = self.connect()
+        depth = getattr(_local, "depth", 0)
+        savepoint = None
+        if depth > 0 or conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            savepoint = f"db_connection_{depth}"
+        cursor = conn.cursor()
+        _local.depth = depth + 1
+        try:
+            if savepoint:
+                cursor.execute(f"SAVEPOINT {savepoint}")
+            yield cursor
+            if savepoint:
+                cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+            else:
+                conn.commit()
+        except Exception:
+            if savepoint:
+                try:
+                    cursor.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+                    cursor.execute(f"RELEASE SAVEPOINT {savepoint}")
+                except psycopg2.Error:
+                    # Соединение разорвано: внешней транзакции уже нет
+                    self.rollback()
+            else:
+                self.rollback()
+            raise
+        finally:
+            _local.depth = depth
+            if not cursor.closed:
+                cursor.close()
+            if owned:
+                self.release()
+
+    # --- Прежний интерфейс ---
 
     def get_cursor(self):
         """
         Возвращает курсор для выполнения запросов.
         """
-        self.connect()
-        return self.connection.cursor()
+        return self.connect().cursor()
 
     def commit(self):
         """
         Фиксирует транзакцию.
         """
-        if self.connection:
-            self.connection.commit()
+        if self.conn is not None:
+            self.conn.commit()
 
     def rollback(self):
         """
         Откатывает транзакцию (полезно при обработке исключений).
+        Если соединение разорвано, оно отбрасывается — следующий запрос откроет новое.
         """
-        if self.connection:
-            self.connection.rollback()
+        conn = self.conn
+        if conn is None:
+            return
+        try:
+            if not conn.closed:
+                conn.rollback()
+                return
+        except psycopg2.Error as e:
+            print(f"Discarding broken PostgreSQL connection: {e}")
+        _local.conn = None
+        self._checkin(conn, discard=True)
 
     def close(self):
         """
-        Закрывает соединение.
+        Закрывает соединение (возвращает его в пул).
         """
-        if self.connection:
-            self.connection.close()
-            self.connection = None
\ No newline at end of file
+        self.release()
+
+
+def release_connection(exception=None):
+    """Возвращает в пул соединение текущего гринлета (teardown запроса, конец фонового потока)"""
+    Database().release()
+
+
+def reset_after_fork():
+    """
+    Вызывается в воркере сразу после fork (gunicorn post_fork при preload_app).
+    Соединения, открытые в мастере, остаются его: воркер их не закрывает
+    (закрытие завершило бы сессию мастера) и создает собственный пул при первом запросе.
+    """
+    global _pool, _pool_slots, _pool_lock, _local
+    _pool = None
+    _pool_slots = None
+    _pool_lock = threading.Lock()
+    _local = threading.local()
@@ -22,10 +22,12 @@ else
 fi
 
 echo "-----------------------------------------------------"
-echo "📦 Инициализация базы данных и таблиц..."
+echo "📦 Инициализация базы данных, миграций и хранилища..."
 
-# 2. Выполняем скрипт создания таблиц и дефолтных пользователей
-python server/init_pg_auth.py
+# 2. Разовая идемпотентная инициализация ДО запуска воркеров:
+#    таблицы, индексы, триггеры, alembic upgrade head, бакеты MinIO, администратор.
+#    Воркеры gunicorn больше не выполняют DDL при импорте. Печатает отчет по времени шагов.
+python server/bootstrap.py
 
 echo "✅ Инициализация БД успешно завершена."
 echo "-----------------------------------------------------"
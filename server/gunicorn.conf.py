@@ -0,0 +1,48 @@
+# server/gunicorn.conf.py
+"""
+Настройки gunicorn для docker-compose:
+    gunicorn -c server/gunicorn.conf.py "server.app:create_app()"
+
+preload_app (GUNICORN_PRELOAD): приложение импортируется один раз в мастере, воркеры получают его
+через fork, и страницы памяти с Flask, psycopg2, minio и кодом приложения остаются общими (copy-on-write).
+GDAL, PIL, numpy и piexif загружаются лениво в воркере при первом использовании (services/lazy_import.py);
+PRELOAD_MODULES загружает их в мастере, если они все равно нужны каждому воркеру.
+"""
+import os
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+
+# При preload модули приложения импортируются в мастере раньше, чем воркер gevent выполнит
+# monkey.patch_all: threading.local и блокировки уровня модулей (пул БД, кэши) остались бы
+# потоковыми, и все гринлеты воркера делили бы одно соединение. Патчим до загрузки приложения.
+if worker_class == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+
+import config
+
+bind = "0.0.0.0:5000"
+workers = getattr(config, "WEB_CONCURRENCY", 4)
+timeout = 36000
+keepalive = 5
+preload_app = getattr(config, "GUNICORN_PRELOAD", True)
+
+
+def when_ready(server):
+    """Мастер: приложение загружено, воркеры еще не созданы"""
+    if not preload_app:
+        return
+    from services.lazy_import import preload
+    names = getattr(config, "PRELOAD_MODULES", [])
+    if names:
+        server.log.info("Preloaded modules: %s", ", ".join(preload(names)) or "-")
+
+
+def post_fork(server, worker):
+    """Воркер: соединения PostgreSQL и MinIO, унаследованные от мастера, не используются"""
+    if not preload_app:
+        return
+    import database
+    import storage
+    database.reset_after_fork()
+    storage.reset_after_fork()
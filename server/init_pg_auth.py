@@ -2,7 +2,7 @@
 
 import os
 import psycopg2
-from werkzeug.security import generate_password_hash
+from services.password_service import hash_password
 
 def init_auth_db():
     print("Connecting to PostgreSQL to initialize all tables...")
@@ -34,13 +34,14 @@ def init_auth_db():
                 path VARCHAR,
                 filename VARCHAR,
                 directory VARCHAR,
-                altitude NUMERIC,
-                direction NUMERIC,
+                altitude DOUBLE PRECISION,
+                direction DOUBLE PRECISION,
                 rotation INTEGER,
-                longitude VARCHAR,
-                latitude VARCHAR,
+                longitude DOUBLE PRECISION,
+                latitude DOUBLE PRECISION,
                 "timestamp" TIMESTAMP,
-                "order" INTEGER
+                "order" INTEGER,
+                session VARCHAR
             );
         """)
         
@@ -62,7 +63,7 @@ def init_auth_db():
         cur.execute("SELECT id FROM users WHERE username = %s", (admin_username,))
         if not cur.fetchone():
             print(f"Creating user '{admin_username}'...")
-            pw_hash = generate_password_hash(admin_password) 
+            pw_hash = hash_password(admin_password) 
             cur.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (admin_username, pw_hash))
             print(f"User '{admin_username}' successfully created!")
             
@@ -74,7 +75,7 @@ def init_auth_db():
         cur.execute("SELECT id FROM users WHERE username = %s", (user_username,))
         if not cur.fetchone():
             print(f"Creating user '{user_username}'...")
-            user_pw_hash = generate_password_hash(user_password)
+            user_pw_hash = hash_password(user_password)
             cur.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (user_username, user_pw_hash))
             print(f"User '{user_username}' successfully created!")
         
@@ -85,6 +86,8 @@ def init_auth_db():
         
     except Exception as e:
         print(f"Error during Database initialization: {e}")
+        # Вызывающий (bootstrap, скрипт запуска) должен узнать о неудаче
+        raise
 
 if __name__ == "__main__":
     init_auth_db()
\ No newline at end of file
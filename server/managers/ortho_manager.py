@@ -1,161 +1,143 @@
 # ./backend/managers/ortho_manager.py
 
 from models.ortho import Ortho
+from managers.pano_manager import list_page_size
 import json
 
+# Поля списка ортофотопланов (?fields=...): имя в ответе -> выражение SQL.
+# Форма ответа совпадает с прежним OrthoService.get_all
+ORTHO_LIST_FIELDS = {
+    "id": "o.id",
+    "filename": "o.filename",
+    "url": "'/api/orthophotos/' || o.id || '/download'",
+    "preview_url": "CASE WHEN COALESCE(o.preview_filename, '') <> '' THEN '/api/orthophotos/' || o.id || '/preview' END",
+    # bounds хранится текстом: некорректный JSON не должен ронять весь список
+    "bounds": """CASE WHEN o.bounds IS JSON OBJECT THEN o.bounds::json
+                      ELSE json_build_object('north', 0, 'south', 0, 'east', 0, 'west', 0) END""",
+    "wgs84_bounds": """CASE WHEN o.geometry IS NOT NULL THEN json_build_object(
+                          'west', ST_XMin(o.geometry), 'south', ST_YMin(o.geometry),
+                          'east', ST_XMax(o.geometry), 'north', ST_YMax(o.geometry)) END""",
+    "crs": "COALESCE(NULLIF(o.crs, ''), CASE WHEN position('_3857' in o.filename) > 0 THEN 'EPSG:3857' END)",
+    "is_visible": "COALESCE(o.is_visible, FALSE)",
+    "is_cog": "COALESCE(o.is_cog, FALSE)",
+    "cog_profile": "o.cog_profile",
+    "upload_date": "o.upload_date::text",
+}
+
 class OrthoManager:
     def __init__(self, db):
         self.db = db
-        # Создаем таблицу и проверяем структуру при инициализации
-        self._ensure_table()
 
-    def _ensure_table(self):
-        cursor = self.db.get_cursor()
-        
-        # 1. Создание таблицы (если нет)
-        query_create = """
-        CREATE TABLE IF NOT EXISTS orthophotos (
-            id SERIAL PRIMARY KEY,
-            filename TEXT NOT NULL,
-            bounds TEXT,
-            url TEXT,
-            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            crs TEXT,
-            is_visible BOOLEAN DEFAULT FALSE,
-            is_cog BOOLEAN DEFAULT FALSE
-        )
+    def ensure_schema(self):
+        """
+        Создает таблицу orthophotos и добавляет недостающие колонки одной транзакцией.
+        Вызывается один раз при развертывании (bootstrap.py), а не при создании менеджера в каждом воркере.
         """
         try:
-            cursor.execute(query_create)
-            self.db.commit()
-        except Exception as e:
-            print(f"Error creating table orthophotos: {e}")
-            if self.db.connection:
-                self.db.connection.rollback()
-
-        # --- МИГРАЦИИ (Добавление колонок в существующую таблицу) ---
-
-        # 2. CRS
-        try:
-            query_migrate_crs = "ALTER TABLE orthophotos ADD COLUMN IF NOT EXISTS crs TEXT;"
-            cursor.execute(query_migrate_crs)
-            self.db.commit()
-        except Exception as e:
-            print(f"Migration warning (adding crs column): {e}")
-            if self.db.connection:
-                self.db.connection.rollback()
+            cursor = self.db.get_cursor()
 
-        # 3. is_visible
-        try:
-            query_migrate_vis = "ALTER TABLE orthophotos ADD COLUMN IF NOT EXISTS is_visible BOOLEAN DEFAULT FALSE;"
-            cursor.execute(query_migrate_vis)
-            self.db.commit()
-        except Exception as e:
-            print(f"Migration warning (adding is_visible column): {e}")
-            if self.db.connection:
-                self.db.connection.rollback()
+            # 1. Создание таблицы (если нет)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS orthophotos (
+                id SERIAL PRIMARY KEY,
+                filename TEXT NOT NULL,
+                bounds TEXT,
+                url TEXT,
+                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                crs TEXT,
+                is_visible BOOLEAN DEFAULT FALSE,
+                is_cog BOOLEAN DEFAULT FALSE
+            )
+            """)
 
-        # 4. is_cog (Cloud Optimized GeoTIFF)
-        try:
-            query_migrate_cog = "ALTER TABLE orthophotos ADD COLUMN IF NOT EXISTS is_cog BOOLEAN DEFAULT FALSE;"
-            cursor.execute(query_migrate_cog)
+            # --- МИГРАЦИИ (Добавление колонок в существующую таблицу) ---
+            # crs, is_visible, is_cog (Cloud Optimized GeoTIFF), geometry (PostGIS MultiPolygon),
+            # превью и профиль сжатия COG — одним ALTER TABLE.
+            # geometry требует установленного PostGIS (CREATE EXTENSION postgis;) в базе.
+            cursor.execute("""
+                ALTER TABLE orthophotos
+                    ADD COLUMN IF NOT EXISTS crs TEXT,
+                    ADD COLUMN IF NOT EXISTS is_visible BOOLEAN DEFAULT FALSE,
+                    ADD COLUMN IF NOT EXISTS is_cog BOOLEAN DEFAULT FALSE,
+                    ADD COLUMN IF NOT EXISTS geometry geometry(MultiPolygon, 4326),
+                    ADD COLUMN IF NOT EXISTS preview_filename TEXT,
+                    ADD COLUMN IF NOT EXISTS cog_profile TEXT;
+            """)
             self.db.commit()
         except Exception as e:
-            print(f"Migration warning (adding is_cog column): {e}")
-            if self.db.connection:
-                self.db.connection.rollback()
+            print(f"Error initializing table orthophotos: {e}. Make sure PostGIS extension is enabled.")
+            self.db.rollback()
+            raise e
 
-        # 5. Geometry (PostGIS MultiPolygon)
-        try:
-            # Пытаемся добавить поле geometry. 
-            # Требует установленного PostGIS (CREATE EXTENSION postgis;) в базе.
-            query_migrate_geom = "ALTER TABLE orthophotos ADD COLUMN IF NOT EXISTS geometry geometry(MultiPolygon, 4326);"
-            cursor.execute(query_migrate_geom)
-            self.db.commit()
-        except Exception as e:
-            print(f"Migration warning (adding geometry column): {e}. Make sure PostGIS extension is enabled.")
-            if self.db.connection:
-                self.db.connection.rollback()
+    def list_orthos_json(self, after_id=None, limit=None, fields=None, paginate=True):
+        """
+        Список ортофотопланов как готовый JSON-текст от PostgreSQL (без объектов Ortho и json.loads на строку).
+        paginate=True — страница по id DESC: {"items": [...], "next_cursor": id | null};
+        paginate=False — весь список массивом (прежний формат GET /orthophotos).
+        fields — подмножество ORTHO_LIST_FIELDS (неизвестное поле -> ValueError).
+        """
+        fields = list(fields or ORTHO_LIST_FIELDS)
+        unknown = [f for f in fields if f not in ORTHO_LIST_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        if "id" not in fields:
+            fields.insert(0, "id")
+        columns = ", ".join(f'{ORTHO_LIST_FIELDS[f]} AS "{f}"' for f in fields)
 
-        # 6. Preview Filename
         try:
-            query_migrate_preview = "ALTER TABLE orthophotos ADD COLUMN IF NOT EXISTS preview_filename TEXT;"
-            cursor.execute(query_migrate_preview)
+            cursor = self.db.get_cursor()
+            if not paginate:
+                cursor.execute(f"""
+                    SELECT COALESCE(json_agg(row_to_json(t) ORDER BY t.id DESC), '[]'::json)::text AS result
+                    FROM (SELECT {columns} FROM orthophotos o) t
+                """)
+            else:
+                params = {"limit": list_page_size(limit), "after": after_id}
+                cursor.execute(f"""
+                    WITH page AS (
+                        SELECT {columns}
+                        FROM orthophotos o
+                        WHERE %(after)s::integer IS NULL OR o.id < %(after)s
+                        ORDER BY o.id DESC
+                        LIMIT %(limit)s + 1
+                    ),
+                    items AS (
+                        SELECT * FROM page ORDER BY id DESC LIMIT %(limit)s
+                    )
+                    SELECT json_build_object(
+                        'items', COALESCE((SELECT json_agg(row_to_json(t) ORDER BY t.id DESC) FROM items t), '[]'::json),
+                        'next_cursor', CASE WHEN (SELECT count(*) FROM page) > %(limit)s THEN (SELECT min(id) FROM items) END
+                    )::text AS result
+                """, params)
+            row = cursor.fetchone()
             self.db.commit()
+            return row["result"] if isinstance(row, dict) else row[0]
         except Exception as e:
-            print(f"Migration warning (adding preview_filename column): {e}")
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
+            raise e
 
-    def get_all_orthos(self):
+    def get_summary(self):
+        """Краткая сводка для админки: сколько ортофотопланов, из них COG и видимых, последний id"""
         try:
             cursor = self.db.get_cursor()
-            # [UPDATED] Вытаскиваем крайние точки из геометрии с помощью PostGIS функций
-            query = """
-                SELECT id, filename, bounds, url, crs, upload_date, is_visible, is_cog, preview_filename,
-                       ST_XMin(geometry) as wgs_west,
-                       ST_YMin(geometry) as wgs_south,
-                       ST_XMax(geometry) as wgs_east,
-                       ST_YMax(geometry) as wgs_north
-                FROM orthophotos ORDER BY id DESC
-            """
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            
-            orthos = []
-            for row in rows:
-                if isinstance(row, dict):
-                    r_id = row["id"]
-                    r_name = row["filename"]
-                    r_bounds = row["bounds"]
-                    r_url = row["url"]
-                    r_crs = row.get("crs")
-                    r_date = row["upload_date"]
-                    r_vis = row.get("is_visible", False)
-                    r_cog = row.get("is_cog", False)
-                    r_preview = row.get("preview_filename")
-                    w_west = row.get("wgs_west")
-                    w_south = row.get("wgs_south")
-                    w_east = row.get("wgs_east")
-                    w_north = row.get("wgs_north")
-                else:
-                    r_id = row[0]
-                    r_name = row[1]
-                    r_bounds = row[2]
-                    r_url = row[3]
-                    r_crs = row[4] if len(row) > 4 else None
-                    r_date = row[5] if len(row) > 5 else None
-                    r_vis = row[6] if len(row) > 6 else False
-                    r_cog = row[7] if len(row) > 7 else False
-                    r_preview = row[8] if len(row) > 8 else None
-                    w_west = row[9] if len(row) > 9 else None
-                    w_south = row[10] if len(row) > 10 else None
-                    w_east = row[11] if len(row) > 11 else None
-                    w_north = row[12] if len(row) > 12 else None
-
-                # [NEW] Формируем объект WGS84 границ, если геометрия существует
-                wgs84_bounds = None
-                if w_west is not None and w_south is not None:
-                    wgs84_bounds = { "west": w_west, "south": w_south, "east": w_east, "north": w_north }
-
-                ortho = Ortho(
-                    filename=r_name,
-                    bounds=r_bounds,
-                    url=r_url,
-                    ortho_id=r_id,
-                    upload_date=r_date,
-                    crs=r_crs,
-                    is_visible=r_vis,
-                    is_cog=r_cog,
-                    preview_filename=r_preview,
-                    wgs84_bounds=wgs84_bounds # Передаем в модель
-                )
-                orthos.append(ortho)
-                
-            return orthos
+            cursor.execute("""
+                SELECT count(*) AS count,
+                       count(*) FILTER (WHERE is_cog) AS cog,
+                       count(*) FILTER (WHERE is_visible) AS visible,
+                       max(id) AS last_id,
+                       max(upload_date) AS last_upload
+                FROM orthophotos
+            """)
+            row = cursor.fetchone()
+            self.db.commit()
+            if not isinstance(row, dict):
+                row = dict(zip([d[0] for d in cursor.description], row))
+            summary = dict(row)
+            if summary.get("last_upload") is not None:
+                summary["last_upload"] = summary["last_upload"].isoformat()
+            return summary
         except Exception as e:
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
             raise e
 
     def get_ortho_by_id(self, ortho_id):
@@ -167,7 +149,8 @@ class OrthoManager:
                        ST_XMin(geometry) as wgs_west,
                        ST_YMin(geometry) as wgs_south,
                        ST_XMax(geometry) as wgs_east,
-                       ST_YMax(geometry) as wgs_north
+                       ST_YMax(geometry) as wgs_north,
+                       cog_profile
                 FROM orthophotos WHERE id = %s
             """
             cursor.execute(query, (ortho_id,))
@@ -188,6 +171,7 @@ class OrthoManager:
                     w_south = row.get("wgs_south")
                     w_east = row.get("wgs_east")
                     w_north = row.get("wgs_north")
+                    r_profile = row.get("cog_profile")
                 else:
                     r_id = row[0]
                     r_name = row[1]
@@ -202,6 +186,7 @@ class OrthoManager:
                     w_south = row[10] if len(row) > 10 else None
                     w_east = row[11] if len(row) > 11 else None
                     w_north = row[12] if len(row) > 12 else None
+                    r_profile = row[13] if len(row) > 13 else None
 
                 # [NEW] Формируем объект WGS84 границ
                 wgs84_bounds = None
@@ -218,13 +203,13 @@ class OrthoManager:
                     is_visible=r_vis,
                     is_cog=r_cog,
                     preview_filename=r_preview,
-                    wgs84_bounds=wgs84_bounds # Передаем в модель
+                    wgs84_bounds=wgs84_bounds, # Передаем в модель
+                    cog_profile=r_profile
                 )
                 return ortho
             return None
         except Exception:
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
             raise
 
     def insert_ortho(self, ortho):
@@ -237,22 +222,23 @@ class OrthoManager:
             cog_val = getattr(ortho, 'is_cog', False)
             geom_wkt = getattr(ortho, 'geometry_wkt', None) 
             preview_val = getattr(ortho, 'preview_filename', None) 
+            profile_val = getattr(ortho, 'cog_profile', None)
 
             # Если передана геометрия (WKT), используем PostGIS функцию ST_Multi(ST_GeomFromText(..., 4326))
             if geom_wkt:
                 query = """
-                    INSERT INTO orthophotos (filename, bounds, url, crs, is_visible, is_cog, preview_filename, geometry)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, ST_Multi(ST_GeomFromText(%s, 4326)))
+                    INSERT INTO orthophotos (filename, bounds, url, crs, is_visible, is_cog, preview_filename, cog_profile, geometry)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, ST_Multi(ST_GeomFromText(%s, 4326)))
                     RETURNING id
                 """
-                cursor.execute(query, (ortho.filename, ortho.bounds, url_val, crs_val, vis_val, cog_val, preview_val, geom_wkt))
+                cursor.execute(query, (ortho.filename, ortho.bounds, url_val, crs_val, vis_val, cog_val, preview_val, profile_val, geom_wkt))
             else:
                 query = """
-                    INSERT INTO orthophotos (filename, bounds, url, crs, is_visible, is_cog, preview_filename)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    INSERT INTO orthophotos (filename, bounds, url, crs, is_visible, is_cog, preview_filename, cog_profile)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id
                 """
-                cursor.execute(query, (ortho.filename, ortho.bounds, url_val, crs_val, vis_val, cog_val, preview_val))
+                cursor.execute(query, (ortho.filename, ortho.bounds, url_val, crs_val, vis_val, cog_val, preview_val, profile_val))
             
             row = cursor.fetchone()
             if isinstance(row, dict):
@@ -263,8 +249,7 @@ class OrthoManager:
             self.db.commit()
             return new_id
         except Exception:
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
             raise
 
     def update_ortho(self, ortho_id, updated_fields):
@@ -277,7 +262,7 @@ class OrthoManager:
             set_clause = []
             values = []
             for field, value in updated_fields.items():
-                if field in ['filename', 'bounds', 'url', 'crs', 'is_visible', 'is_cog', 'preview_filename']:
+                if field in ['filename', 'bounds', 'url', 'crs', 'is_visible', 'is_cog', 'preview_filename', 'cog_profile']:
                     set_clause.append(f"{field} = %s")
                     values.append(value)
 
@@ -291,8 +276,7 @@ class OrthoManager:
             cursor.execute(query, tuple(values))
             self.db.commit()
         except Exception:
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
             raise
 
     def delete_ortho(self, ortho_id):
@@ -302,6 +286,5 @@ class OrthoManager:
             cursor.execute(query, (ortho_id,))
             self.db.commit()
         except Exception:
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
             raise
\ No newline at end of file
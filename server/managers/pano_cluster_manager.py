@@ -0,0 +1,324 @@
+# ./backend/managers/pano_cluster_manager.py
+
+# Шаг сетки кластеризации (в градусах) для каждого зума карты
+ZOOM_GRIDS = {
+    # Зум 0-10: Очень сильная кластеризация (~2000 км -> ~11 км). 1 кластер на город/регион.
+    0: 20.0, 1: 10.0, 2: 5.0, 3: 2.5, 4: 1.5,
+    5: 1.0, 6: 0.8, 7: 0.6, 8: 0.4, 9: 0.2, 10: 0.1,
+
+    # Зум 11-17: Умеренная кластеризация (~5 км -> ~50 метров). Несколько на улицу.
+    11: 0.05, 12: 0.025, 13: 0.012, 14: 0.006,
+    15: 0.003, 16: 0.0015, 17: 0.0005
+}
+
+# Максимальный зум, на котором отдаются кластеры (выше — сырые точки)
+MAX_CLUSTER_ZOOM = 17
+
+# Ключ ячейки кэша: сетка + ячейка + фильтруемые атрибуты (день съемки, директория, сессия)
+_KEY_COLUMNS = "grid_size, cell_x, cell_y, day, directory, session"
+_KEY_EXPR = """g.grid_size,
+                           round(ST_X(p.geom) / g.grid_size)::bigint,
+                           round(ST_Y(p.geom) / g.grid_size)::bigint,
+                           COALESCE(p."timestamp"::date, DATE 'epoch'),
+                           COALESCE(p.directory, ''),
+                           COALESCE(p.session, '')"""
+
+
+def grid_for_zoom(zoom):
+    if zoom is None or zoom > MAX_CLUSTER_ZOOM:
+        return None
+    return ZOOM_GRIDS.get(zoom, ZOOM_GRIDS[MAX_CLUSTER_ZOOM])
+
+
+def cluster_filter_sql(filters, alias="c"):
+    """
+    Условия по фильтрам (date_from, date_to, directory, session) для строк кэша кластеров.
+    Возвращает (sql, params) для подстановки с именованными параметрами.
+    """
+    clauses, params = [], {}
+    if filters.get("date_from"):
+        clauses.append(f"{alias}.day >= %(date_from)s")
+        params["date_from"] = filters["date_from"]
+    if filters.get("date_to"):
+        clauses.append(f"{alias}.day <= %(date_to)s")
+        params["date_to"] = filters["date_to"]
+    if filters.get("directory"):
+        clauses.append(f"{alias}.directory = %(directory)s")
+        params["directory"] = filters["directory"]
+    if filters.get("session"):
+        clauses.append(f"{alias}.session = %(session)s")
+        params["session"] = filters["session"]
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+class PanoClusterManager:
+    """
+    Предрасчитанные кластеры панорам для каждой сетки из ZOOM_GRIDS.
+
+    Ячейка = (grid_size, round(x / grid_size), round(y / grid_size)) — то же, что ST_SnapToGrid.
+    Строки кэша дополнительно разделены по дню съемки, директории и сессии, поэтому запросы
+    с фильтрами тоже читают готовые строки: кластер = сумма строк ячейки, подходящих под фильтр.
+    В строке хранятся count, суммы координат и минимальный id.
+
+    Таблица поддерживается триггерами на photos_4326 уровня оператора (transition tables):
+    вставка добавляет к счетчикам/суммам, удаление вычитает, обновление = вставка + удаление.
+    Пересчет из базовой таблицы нужен только для ячеек, у которых удалили представителя (id).
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def ensure_schema(self):
+        """Создает таблицы, функции и триггеры; при пустой таблице кластеров строит ее с нуля"""
+        try:
+            cursor = self.db.get_cursor()
+
+            # Кэш прежнего формата (без фильтруемых атрибутов в ключе) просто пересоздаем
+            cursor.execute("""
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.tables
+                    WHERE table_schema = 'public' AND table_name = 'photos_4326_clusters'
+                ) AND NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = 'public' AND table_name = 'photos_4326_clusters' AND column_name = 'session'
+                ) AS outdated
+            """)
+            row = cursor.fetchone()
+            if row["outdated"] if isinstance(row, dict) else row[0]:
+                cursor.execute("DROP TABLE public.photos_4326_clusters")
+
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS public.photos_4326_cluster_grids (
+                    grid_size DOUBLE PRECISION PRIMARY KEY
+                );
+                CREATE TABLE IF NOT EXISTS public.photos_4326_clusters (
+                    grid_size DOUBLE PRECISION NOT NULL,
+                    cell_x BIGINT NOT NULL,
+                    cell_y BIGINT NOT NULL,
+                    day DATE NOT NULL,
+                    directory VARCHAR NOT NULL,
+                    session VARCHAR NOT NULL,
+                    id INTEGER,
+                    count BIGINT NOT NULL,
+                    sum_x DOUBLE PRECISION NOT NULL,
+                    sum_y DOUBLE PRECISION NOT NULL,
+                    PRIMARY KEY ({_KEY_COLUMNS})
+                );
+            """)
+
+            # Набор сеток синхронизируем с ZOOM_GRIDS (изменили шаги — удалили лишние ячейки)
+            grids = sorted(set(ZOOM_GRIDS.values()))
+            cursor.execute("DELETE FROM public.photos_4326_cluster_grids WHERE NOT (grid_size = ANY(%s))", (grids,))
+            removed = cursor.rowcount
+            cursor.execute("DELETE FROM public.photos_4326_clusters WHERE NOT (grid_size = ANY(%s))", (grids,))
+            cursor.execute("""
+                INSERT INTO public.photos_4326_cluster_grids (grid_size)
+                SELECT unnest(%s::double precision[])
+                ON CONFLICT DO NOTHING
+            """, (grids,))
+            added = cursor.rowcount
+
+            cursor.execute(f"""
+                -- Добавляет точки к ячейкам всех сеток (порядок по ключу — меньше взаимоблокировок)
+                CREATE OR REPLACE FUNCTION public.photos_4326_clusters_add(pts public.photos_4326[])
+                RETURNS void LANGUAGE sql AS $$
+                    INSERT INTO public.photos_4326_clusters AS c ({_KEY_COLUMNS}, id, count, sum_x, sum_y)
+                    SELECT {_KEY_EXPR},
+                           MIN(p.id), COUNT(*), SUM(ST_X(p.geom)), SUM(ST_Y(p.geom))
+                    FROM unnest(pts) p
+                    CROSS JOIN public.photos_4326_cluster_grids g
+                    WHERE p.geom IS NOT NULL
+                    GROUP BY 1, 2, 3, 4, 5, 6
+                    ORDER BY 1, 2, 3, 4, 5, 6
+                    ON CONFLICT ({_KEY_COLUMNS}) DO UPDATE SET
+                        id = LEAST(c.id, EXCLUDED.id),
+                        count = c.count + EXCLUDED.count,
+                        sum_x = c.sum_x + EXCLUDED.sum_x,
+                        sum_y = c.sum_y + EXCLUDED.sum_y;
+                $$;
+
+                -- Вычитает точки из ячеек; пустые ячейки удаляет, потерявшим представителя пересчитывает id
+                CREATE OR REPLACE FUNCTION public.photos_4326_clusters_remove(pts public.photos_4326[])
+                RETURNS void LANGUAGE plpgsql AS $$
+                DECLARE
+                    touched public.photos_4326_clusters[];
+                BEGIN
+                    -- Запоминаем измененные ячейки: удаление и пересчет id ниже трогают только их,
+                    -- а не всю таблицу кластеров
+                    WITH u AS (
+                        UPDATE public.photos_4326_clusters c SET
+                            count = c.count - r.count,
+                            sum_x = c.sum_x - r.sum_x,
+                            sum_y = c.sum_y - r.sum_y,
+                            id = CASE WHEN c.id = ANY(r.ids) THEN NULL ELSE c.id END
+                        FROM (
+                            SELECT {_KEY_EXPR},
+                                   array_agg(p.id) AS ids, COUNT(*) AS count,
+                                   SUM(ST_X(p.geom)) AS sum_x, SUM(ST_Y(p.geom)) AS sum_y
+                            FROM unnest(pts) p
+                            CROSS JOIN public.photos_4326_cluster_grids g
+                            WHERE p.geom IS NOT NULL
+                            GROUP BY 1, 2, 3, 4, 5, 6
+                        ) r (grid_size, cell_x, cell_y, day, directory, session, ids, count, sum_x, sum_y)
+                        WHERE c.grid_size = r.grid_size AND c.cell_x = r.cell_x AND c.cell_y = r.cell_y
+                          AND c.day = r.day AND c.directory = r.directory AND c.session = r.session
+                        RETURNING c AS cell
+                    )
+                    SELECT array_agg(cell) INTO touched FROM u;
+
+                    IF touched IS NULL THEN
+                        RETURN;
+                    END IF;
+
+                    DELETE FROM public.photos_4326_clusters c
+                    USING unnest(touched) t
+                    WHERE t.count <= 0
+                      AND c.grid_size = t.grid_size AND c.cell_x = t.cell_x AND c.cell_y = t.cell_y
+                      AND c.day = t.day AND c.directory = t.directory AND c.session = t.session;
+
+                    UPDATE public.photos_4326_clusters c SET id = (
+                        SELECT MIN(ph.id) FROM public.photos_4326 ph
+                        WHERE ph.geom && ST_MakeEnvelope(
+                                  (c.cell_x - 0.5) * c.grid_size, (c.cell_y - 0.5) * c.grid_size,
+                                  (c.cell_x + 0.5) * c.grid_size, (c.cell_y + 0.5) * c.grid_size, 4326)
+                          AND round(ST_X(ph.geom) / c.grid_size)::bigint = c.cell_x
+                          AND round(ST_Y(ph.geom) / c.grid_size)::bigint = c.cell_y
+                          AND COALESCE(ph."timestamp"::date, DATE 'epoch') = c.day
+                          AND COALESCE(ph.directory, '') = c.directory
+                          AND COALESCE(ph.session, '') = c.session
+                    )
+                    FROM unnest(touched) t
+                    WHERE t.count > 0 AND t.id IS NULL
+                      AND c.grid_size = t.grid_size AND c.cell_x = t.cell_x AND c.cell_y = t.cell_y
+                      AND c.day = t.day AND c.directory = t.directory AND c.session = t.session;
+                END;
+                $$;
+
+                CREATE OR REPLACE FUNCTION public.photos_4326_clusters_sync()
+                RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    IF TG_OP = 'INSERT' THEN
+                        PERFORM public.photos_4326_clusters_add(ARRAY(SELECT n FROM new_rows n));
+                    ELSIF TG_OP = 'DELETE' THEN
+                        PERFORM public.photos_4326_clusters_remove(ARRAY(SELECT o FROM old_rows o));
+                    ELSE
+                        -- Меняем только строки, у которых сдвинулась точка или поменялся ключ фильтров
+                        PERFORM public.photos_4326_clusters_add(ARRAY(
+                            SELECT n FROM new_rows n JOIN old_rows o ON o.id = n.id
+                            WHERE n.geom IS DISTINCT FROM o.geom
+                               OR n."timestamp"::date IS DISTINCT FROM o."timestamp"::date
+                               OR n.directory IS DISTINCT FROM o.directory
+                               OR n.session IS DISTINCT FROM o.session));
+                        PERFORM public.photos_4326_clusters_remove(ARRAY(
+                            SELECT o FROM old_rows o JOIN new_rows n ON n.id = o.id
+                            WHERE n.geom IS DISTINCT FROM o.geom
+                               OR n."timestamp"::date IS DISTINCT FROM o."timestamp"::date
+                               OR n.directory IS DISTINCT FROM o.directory
+                               OR n.session IS DISTINCT FROM o.session));
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$;
+
+                CREATE OR REPLACE TRIGGER photos_4326_clusters_ins
+                    AFTER INSERT ON public.photos_4326
+                    REFERENCING NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION public.photos_4326_clusters_sync();
+                CREATE OR REPLACE TRIGGER photos_4326_clusters_upd
+                    AFTER UPDATE ON public.photos_4326
+                    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION public.photos_4326_clusters_sync();
+                CREATE OR REPLACE TRIGGER photos_4326_clusters_del
+                    AFTER DELETE ON public.photos_4326
+                    REFERENCING OLD TABLE AS old_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION public.photos_4326_clusters_sync();
+            """)
+
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM public.photos_4326_clusters) AS filled")
+            row = cursor.fetchone()
+            filled = row["filled"] if isinstance(row, dict) else row[0]
+            self.db.commit()
+
+            # Первый запуск или новые сетки: строим кластеры из базовой таблицы
+            if not filled or added or removed:
+                self.rebuild(force=bool(added or removed))
+        except Exception as e:
+            print(f"Could not initialize pano clusters: {e}")
+            self.db.rollback()
+            raise e
+
+    def rebuild(self, force=True):
+        """
+        Полный пересчет кластеров (после массовых правок в обход триггеров или для сброса
+        накопленной погрешности сумм). force=False — только если таблица еще пуста
+        (несколько воркеров стартуют одновременно, строит первый).
+        """
+        try:
+            cursor = self.db.get_cursor()
+            cursor.execute("LOCK TABLE public.photos_4326_clusters IN EXCLUSIVE MODE")
+            if not force:
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM public.photos_4326_clusters) AS filled")
+                row = cursor.fetchone()
+                if row["filled"] if isinstance(row, dict) else row[0]:
+                    self.db.commit()
+                    return
+            cursor.execute("TRUNCATE public.photos_4326_clusters")
+            cursor.execute(f"""
+                INSERT INTO public.photos_4326_clusters ({_KEY_COLUMNS}, id, count, sum_x, sum_y)
+                SELECT {_KEY_EXPR},
+                       MIN(p.id), COUNT(*), SUM(ST_X(p.geom)), SUM(ST_Y(p.geom))
+                FROM public.photos_4326 p
+                CROSS JOIN public.photos_4326_cluster_grids g
+                WHERE p.geom IS NOT NULL
+                GROUP BY 1, 2, 3, 4, 5, 6
+            """)
+            self.db.commit()
+        except Exception as e:
+            print(f"Error rebuilding pano clusters: {e}")
+            self.db.rollback()
+            raise e
+
+    @staticmethod
+    def cells_sql(filters):
+        """
+        Подзапрос кластеров по диапазону ячеек (параметры g, west, south, east, north):
+        строки кэша, подходящие под фильтры, складываются по ячейке.
+        """
+        filter_sql, params = cluster_filter_sql(filters)
+        query = f"""
+            SELECT
+                MIN(c.id) AS id,
+                SUM(c.count) AS count,
+                SUM(c.sum_x) / SUM(c.count) AS lng,
+                SUM(c.sum_y) / SUM(c.count) AS lat
+            FROM public.photos_4326_clusters c
+            WHERE c.grid_size = %(g)s
+              AND c.cell_x BETWEEN round(%(west)s / %(g)s)::bigint AND round(%(east)s / %(g)s)::bigint
+              AND c.cell_y BETWEEN round(%(south)s / %(g)s)::bigint AND round(%(north)s / %(g)s)::bigint
+              {filter_sql}
+            GROUP BY c.cell_x, c.cell_y
+        """
+        return query, params
+
+    def get_clusters_json(self, grid_size, west, south, east, north, limit, filters=None):
+        """
+        Кластеры в BBOX как готовый JSON-массив (формирует PostgreSQL).
+        Диапазон ячеек считается из BBOX, выборка идет по первичному ключу.
+        """
+        cells, params = self.cells_sql(filters or {})
+        cursor = self.db.get_cursor()
+        query = f"""
+            SELECT COALESCE(json_agg(json_build_object(
+                'id', sub.id,
+                'lat', round(sub.lat * 1e6) / 1e6,
+                'lng', round(sub.lng * 1e6) / 1e6,
+                'count', sub.count
+            )), '[]'::json) AS clusters
+            FROM (
+                {cells}
+                LIMIT %(limit)s
+            ) sub;
+        """
+        params.update({"g": grid_size, "west": west, "south": south, "east": east, "north": north, "limit": limit})
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        return row["clusters"] if isinstance(row, dict) else row[0]
@@ -1,12 +1,247 @@
 # ./backend/managers/pano_manager.py
 
 from models.pano import Pano
+import csv
+import io
 import json
+from datetime import datetime, timedelta
+import config
+
+# Колонки временной таблицы для COPY (порядок = порядок полей в CSV-потоке)
+_STAGING_COLUMNS = ("seq", "filename", "path", "directory", "lon", "lat", "alt", "direction", "rotation", "ts", "session")
+
+
+class _CopyStream:
+    """
+    Файлоподобный объект для cursor.copy_expert: лениво превращает записи в CSV,
+    чтобы манифест на сотни тысяч строк не собирался в памяти целиком.
+    """
+    def __init__(self, records):
+        self.rows = iter(records)
+        self.buffer = ""
+        self.count = 0
+        self.out = io.StringIO()
+        self.writer = csv.writer(self.out, lineterminator="\n")
+
+    def _write(self, record):
+        ts = record.get("timestamp")
+        self.writer.writerow((
+            self.count, record["filename"], record.get("path") or record["filename"], record.get("directory") or "",
+            record["longitude"], record["latitude"],
+            "" if record.get("altitude") is None else record["altitude"],
+            "" if record.get("direction") is None else record["direction"],
+            record.get("rotation") or 0,
+            ts.isoformat() if hasattr(ts, "isoformat") else (ts or ""),
+            record.get("session") or "",
+        ))
+        self.count += 1
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) + self.out.tell() < size:
+            record = next(self.rows, None)
+            if record is None:
+                break
+            self._write(record)
+        self.buffer += self.out.getvalue()
+        self.out.seek(0)
+        self.out.truncate()
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+# Поля, доступные в постраничном списке (?fields=...): имя в ответе -> выражение SQL
+PANO_LIST_FIELDS = {
+    "id": "p.id",
+    "filename": "p.filename",
+    "path": "p.path",
+    "directory": "p.directory",
+    "session": "p.session",
+    "latitude": "round(p.latitude * 1e6) / 1e6",
+    "longitude": "round(p.longitude * 1e6) / 1e6",
+    "altitude": "p.altitude",
+    "heading": "p.direction",
+    "roll": "p.rotation",
+    "upload_date": 'p."timestamp"',
+}
+PANO_LIST_DEFAULT_FIELDS = ("id", "filename", "latitude", "longitude", "heading", "roll", "altitude", "upload_date")
+
+
+def pano_filter_sql(filters, alias="p"):
+    """
+    Условия по фильтрам (date_from, date_to — даты включительно, directory, session) для строк photos_4326.
+    Диапазон "timestamp" обслуживают BRIN и составные индексы. Возвращает (sql, params) с именованными параметрами.
+    """
+    clauses, params = [], {}
+    if filters.get("date_from"):
+        clauses.append(f'{alias}."timestamp" >= %(ts_from)s')
+        params["ts_from"] = datetime.combine(filters["date_from"], datetime.min.time())
+    if filters.get("date_to"):
+        clauses.append(f'{alias}."timestamp" < %(ts_to)s')
+        params["ts_to"] = datetime.combine(filters["date_to"] + timedelta(days=1), datetime.min.time())
+    if filters.get("directory"):
+        clauses.append(f"{alias}.directory = %(directory)s")
+        params["directory"] = filters["directory"]
+    if filters.get("session"):
+        clauses.append(f"{alias}.session = %(session)s")
+        params["session"] = filters["session"]
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def list_page_size(limit):
+    """Размер страницы списка: по умолчанию LIST_PAGE_SIZE, не больше LIST_MAX_PAGE_SIZE"""
+    if not limit or limit <= 0:
+        return getattr(config, "LIST_PAGE_SIZE", 200)
+    return min(limit, getattr(config, "LIST_MAX_PAGE_SIZE", 2000))
+
 
 class PanoManager:
     def __init__(self, db):
         self.db = db
 
+    def ensure_schema(self):
+        """
+        Создает таблицу photos_4326 и необходимые индексы, если их нет.
+        Вызывается один раз при развертывании (bootstrap.py), а не при старте каждого воркера.
+        """
+        try:
+            cursor = self.db.get_cursor()
+            
+            # 1. Создаем таблицу (если нет)
+            query_table = """
+                CREATE TABLE IF NOT EXISTS public.photos_4326 (
+                    id SERIAL PRIMARY KEY,
+                    geom geometry(PointZ, 4326),
+                    path VARCHAR,
+                    filename VARCHAR,
+                    directory VARCHAR,
+                    altitude DOUBLE PRECISION,
+                    direction DOUBLE PRECISION,
+                    rotation INTEGER,
+                    longitude DOUBLE PRECISION,
+                    latitude DOUBLE PRECISION,
+                    "timestamp" TIMESTAMP,
+                    "order" INTEGER,
+                    session VARCHAR
+                );
+            """
+            cursor.execute(query_table)
+
+            # 1a. Миграция старых типов: latitude/longitude были VARCHAR, altitude/direction — NUMERIC.
+            # Координаты берем из geom (источник истины), а не парсим строки.
+            cursor.execute("""
+                DO $$
+                BEGIN
+                    IF EXISTS (
+                        SELECT 1 FROM information_schema.columns
+                        WHERE table_schema = 'public' AND table_name = 'photos_4326'
+                          AND column_name IN ('latitude', 'longitude', 'altitude', 'direction')
+                          AND data_type <> 'double precision'
+                    ) THEN
+                        ALTER TABLE public.photos_4326
+                            ALTER COLUMN latitude TYPE DOUBLE PRECISION USING ST_Y(geom),
+                            ALTER COLUMN longitude TYPE DOUBLE PRECISION USING ST_X(geom),
+                            ALTER COLUMN altitude TYPE DOUBLE PRECISION USING altitude::double precision,
+                            ALTER COLUMN direction TYPE DOUBLE PRECISION USING direction::double precision;
+                    END IF;
+                END
+                $$;
+            """)
+
+            # 1b. Сессия съемки (один выезд): если не задана явно — директория + дата съемки
+            cursor.execute("""
+                ALTER TABLE public.photos_4326 ADD COLUMN IF NOT EXISTS session VARCHAR;
+
+                CREATE OR REPLACE FUNCTION public.photos_4326_default_session()
+                RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    IF NEW.session IS NULL AND NEW."timestamp" IS NOT NULL THEN
+                        NEW.session := COALESCE(NEW.directory, '') || '/' || to_char(NEW."timestamp", 'YYYY-MM-DD');
+                    END IF;
+                    RETURN NEW;
+                END;
+                $$;
+
+                CREATE OR REPLACE TRIGGER photos_4326_default_session
+                    BEFORE INSERT ON public.photos_4326
+                    FOR EACH ROW EXECUTE FUNCTION public.photos_4326_default_session();
+            """)
+            cursor.execute("""
+                UPDATE public.photos_4326
+                SET session = COALESCE(directory, '') || '/' || to_char("timestamp", 'YYYY-MM-DD')
+                WHERE session IS NULL AND "timestamp" IS NOT NULL;
+            """)
+
+            # 2. Покрывающий пространственный индекс: id и direction лежат в самом индексе
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_photos_4326_geom_cover 
+                ON public.photos_4326 USING GIST (geom) INCLUDE (id, direction);
+            """)
+            # Прежний GiST без INCLUDE теперь дублирует покрывающий
+            cursor.execute("DROP INDEX IF EXISTS public.idx_photos_4326_geom_gist;")
+
+            # 2a. B-tree по типизированным координатам: выборка точек в BBOX — index-only scan
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_photos_4326_lonlat 
+                ON public.photos_4326 (longitude, latitude) INCLUDE (id, direction);
+            """)
+
+            # 3. Опциональное создание обычного индекса по ID для быстрой сортировки
+            query_id_index = """
+                CREATE INDEX IF NOT EXISTS idx_photos_4326_id 
+                ON public.photos_4326 (id DESC);
+            """
+            cursor.execute(query_id_index)
+
+            # 4. Уникальный индекс по пути объекта: bulk_upsert сопоставляет записи через ON CONFLICT (path).
+            # Имя файла не уникально (IMG_0001.JPG повторяется в разных съемках), путь — идентичность объекта.
+            # Дубликаты прежних данных не удаляем: сообщаем о них и останавливаемся, решает оператор
+            cursor.execute("SELECT to_regclass('public.idx_photos_4326_path_key') IS NULL AS missing")
+            row = cursor.fetchone()
+            if row["missing"] if isinstance(row, dict) else row[0]:
+                cursor.execute("""
+                    SELECT path, COUNT(*) AS count FROM public.photos_4326
+                    WHERE path IS NOT NULL
+                    GROUP BY path HAVING COUNT(*) > 1
+                    ORDER BY COUNT(*) DESC, path
+                    LIMIT 20
+                """)
+                duplicates = [(r["path"], r["count"]) if isinstance(r, dict) else tuple(r) for r in cursor.fetchall()]
+                if duplicates:
+                    sample = ", ".join(f"{path} x{count}" for path, count in duplicates)
+                    raise RuntimeError(
+                        f"photos_4326 has rows with the same path ({sample}); "
+                        "resolve them manually before idx_photos_4326_path_key can be created"
+                    )
+                cursor.execute("""
+                    CREATE UNIQUE INDEX idx_photos_4326_path_key 
+                    ON public.photos_4326 (path);
+                """)
+            # Поиск по имени файла; уникальность по filename больше не требуется
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_photos_4326_filename 
+                ON public.photos_4326 (filename);
+            """)
+            cursor.execute("DROP INDEX IF EXISTS public.idx_photos_4326_filename_key;")
+
+            # 5. Фильтры по времени: панорамы загружаются выездами, id и "timestamp" растут вместе —
+            # BRIN на порядки меньше B-tree и отсекает блоки вне диапазона дат
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_photos_4326_timestamp_brin 
+                ON public.photos_4326 USING BRIN ("timestamp") WITH (pages_per_range = 32);
+            """)
+            # Выбор одной сессии (повторные съемки одних и тех же улиц)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_photos_4326_session 
+                ON public.photos_4326 (session, "timestamp");
+            """)
+
+            self.db.commit()
+        except Exception as e:
+            print(f"Could not initialize photos_4326 or indexes: {e}")
+            self.db.rollback()
+            raise e
+
     def create_pano(self, pano):
         """
         Создает запись о панораме в таблице photos_4326.
@@ -69,8 +304,8 @@ class PanoManager:
                 alt,                 # altitude
                 heading,             # direction
                 roll,                # rotation
-                str(lon),            # longitude (varchar)
-                str(lat)             # latitude (varchar)
+                lon,                 # longitude
+                lat                  # latitude
             )
 
             cursor.execute(query, values)
@@ -87,8 +322,7 @@ class PanoManager:
 
         except Exception as e:
             print(f"Error creating pano: {e}")
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
             raise e
 
     def get_all_panos(self):
@@ -144,8 +378,94 @@ class PanoManager:
             return panos # Контроллер ждет список объектов/словарей, у которых есть метод to_dict или это уже словари
             
         except Exception as e:
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
+            raise e
+
+    def list_panos_json(self, after_id=None, limit=None, fields=None, filters=None):
+        """
+        Страница списка панорам (keyset по id DESC) как готовый JSON от PostgreSQL:
+        {"items": [...], "next_cursor": id | null}. next_cursor передается как after в следующий запрос.
+        fields — подмножество PANO_LIST_FIELDS (неизвестное поле -> ValueError).
+        """
+        fields = list(fields or PANO_LIST_DEFAULT_FIELDS)
+        unknown = [f for f in fields if f not in PANO_LIST_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        if "id" not in fields:
+            fields.insert(0, "id")
+
+        filter_sql, params = pano_filter_sql(filters or {})
+        if after_id is not None:
+            filter_sql += " AND p.id < %(after)s"
+            params["after"] = after_id
+        params["limit"] = list_page_size(limit)
+
+        # Строку собираем из выбранных колонок, чтобы не читать лишнего
+        columns = ", ".join(f'{PANO_LIST_FIELDS[f]} AS "{f}"' for f in fields)
+        try:
+            cursor = self.db.get_cursor()
+            query = f"""
+                WITH page AS (
+                    SELECT {columns}
+                    FROM public.photos_4326 p
+                    WHERE TRUE {filter_sql}
+                    ORDER BY p.id DESC
+                    LIMIT %(limit)s + 1
+                )
+                SELECT json_build_object(
+                    'items', COALESCE((
+                        SELECT json_agg(row_to_json(t) ORDER BY t.id DESC)
+                        FROM (SELECT * FROM page ORDER BY id DESC LIMIT %(limit)s) t
+                    ), '[]'::json),
+                    'next_cursor', CASE WHEN (SELECT count(*) FROM page) > %(limit)s
+                                        THEN (SELECT min(id) FROM (SELECT id FROM page ORDER BY id DESC LIMIT %(limit)s) k)
+                                   END
+                )::text AS result
+            """
+            cursor.execute(query, params)
+            row = cursor.fetchone()
+            self.db.commit()
+            return row["result"] if isinstance(row, dict) else row[0]
+        except Exception as e:
+            self.db.rollback()
+            raise e
+
+    def get_summary(self, filters=None, estimate=False):
+        """
+        Краткая сводка для админки: число панорам и последний id.
+        estimate=True без фильтров — оценка из статистики планировщика (pg_class.reltuples), без сканирования.
+        """
+        try:
+            cursor = self.db.get_cursor()
+            if estimate and not filters:
+                cursor.execute("""
+                    SELECT GREATEST(c.reltuples, 0)::bigint AS count,
+                           (SELECT max(id) FROM public.photos_4326) AS last_id,
+                           TRUE AS estimated
+                    FROM pg_class c
+                    WHERE c.oid = 'public.photos_4326'::regclass
+                """)
+                params = None
+            else:
+                filter_sql, params = pano_filter_sql(filters or {})
+                cursor.execute(f"""
+                    SELECT count(*) AS count, max(p.id) AS last_id,
+                           min(p."timestamp") AS first_timestamp, max(p."timestamp") AS last_timestamp,
+                           FALSE AS estimated
+                    FROM public.photos_4326 p
+                    WHERE TRUE {filter_sql}
+                """, params)
+            row = cursor.fetchone()
+            self.db.commit()
+            if not isinstance(row, dict):
+                row = dict(zip([d[0] for d in cursor.description], row))
+            summary = dict(row)
+            for key in ("first_timestamp", "last_timestamp"):
+                if summary.get(key) is not None:
+                    summary[key] = summary[key].isoformat()
+            return summary
+        except Exception as e:
+            self.db.rollback()
             raise e
 
     def get_pano_by_id(self, pano_id):
@@ -194,8 +514,7 @@ class PanoManager:
                 )
             return None
         except Exception:
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
             raise
 
     def update_pano(self, pano_id, updated_fields):
@@ -231,10 +550,10 @@ class PanoManager:
                 # Обновляем текстовые поля координат
                 if 'latitude' in updated_fields:
                     set_clauses.append("latitude = %s")
-                    values.append(str(lat))
+                    values.append(float(lat))
                 if 'longitude' in updated_fields:
                     set_clauses.append("longitude = %s")
-                    values.append(str(lon))
+                    values.append(float(lon))
 
             # 2. Остальные поля
             field_map = {
@@ -263,8 +582,7 @@ class PanoManager:
             self.db.commit()
             
         except Exception:
-            if self.db.connection:
-                self.db.connection.rollback()
+            self.db.rollback()
             raise
 
     def delete_pano(self, pano_id):
@@ -274,6 +592,125 @@ class PanoManager:
             cursor.execute(query, (pano_id,))
             self.db.commit()
         except Exception:
-            if self.db.connection:
-                self.db.connection.rollback()
-            raise
\ No newline at end of file
+            self.db.rollback()
+            raise
+
+    def bulk_upsert(self, records, returning=False, update_existing=True):
+        """
+        Массовая загрузка метаданных панорам: COPY ... FROM STDIN во временную таблицу
+        и один INSERT ... ON CONFLICT (path) в photos_4326 с построением геометрии в SQL.
+        Записи с уже существующим path (тот же объект хранилища) обновляются, остальные вставляются.
+        Триггеры навигационного графа на время загрузки отключены: граф для загруженных
+        строк строится после нее одним проходом (photos_4326_nav_rebuild).
+        update_existing=False — только вставка (загрузка файлов: ключи объектов уникальны,
+        совпадение path — ошибка, а не обновление чужой строки).
+
+        records — итерируемое словарей (filename, path, directory, latitude, longitude,
+        altitude, direction, rotation, timestamp, session), например PanoManifestReader.
+        Возвращает {"received", "inserted", "updated"} и при returning=True — список
+        {"id", "filename", "action"} в "rows".
+        """
+        stream = _CopyStream(records)
+        try:
+            cursor = self.db.get_cursor()
+            # Временная таблица живет до конца транзакции (совместимо с pgbouncer в transaction mode)
+            cursor.execute("""
+                CREATE TEMP TABLE pano_staging (
+                    seq BIGINT,
+                    filename VARCHAR,
+                    path VARCHAR,
+                    directory VARCHAR,
+                    lon DOUBLE PRECISION,
+                    lat DOUBLE PRECISION,
+                    alt DOUBLE PRECISION,
+                    direction DOUBLE PRECISION,
+                    rotation INTEGER,
+                    ts TIMESTAMP,
+                    session VARCHAR
+                ) ON COMMIT DROP;
+                CREATE TEMP TABLE pano_merged (id INTEGER) ON COMMIT DROP;
+                -- Без построчного KNN навигационного графа на каждую вставку: граф ниже строится разом
+                SET LOCAL photos_4326.nav_deferred = 'on';
+            """)
+            cursor.copy_expert(
+                f"COPY pano_staging ({', '.join(_STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                stream
+            )
+
+            # Индекс для подзапросов ON CONFLICT ниже (последняя строка с данным path)
+            cursor.execute("CREATE INDEX ON pano_staging (path, seq DESC); ANALYZE pano_staging;")
+
+            # Уникальный индекс по path: одна строка на объект, конкурентные загрузки
+            # не создают дубликатов (ON CONFLICT ждет чужую транзакцию и обновляет ее строку).
+            # Пустые в записи "timestamp"/session не затирают уже сохраненные значения.
+            on_conflict = """
+                    ON CONFLICT (path) DO UPDATE SET
+                        filename = EXCLUDED.filename,
+                        geom = EXCLUDED.geom,
+                        directory = COALESCE(EXCLUDED.directory, p.directory),
+                        altitude = EXCLUDED.altitude,
+                        direction = EXCLUDED.direction,
+                        rotation = EXCLUDED.rotation,
+                        longitude = EXCLUDED.longitude,
+                        latitude = EXCLUDED.latitude,
+                        "timestamp" = COALESCE((
+                            SELECT s.ts FROM pano_staging s
+                            WHERE s.path = EXCLUDED.path ORDER BY s.seq DESC LIMIT 1
+                        ), p."timestamp"),
+                        session = COALESCE((
+                            SELECT NULLIF(s.session, '') FROM pano_staging s
+                            WHERE s.path = EXCLUDED.path ORDER BY s.seq DESC LIMIT 1
+                        ), p.session)
+            """ if update_existing else ""
+
+            merge_sql = f"""
+                WITH src AS (
+                    -- Повторы path внутри одной загрузки: побеждает последняя строка
+                    SELECT DISTINCT ON (path) *
+                    FROM pano_staging
+                    ORDER BY path, seq DESC
+                ),
+                result AS (
+                    INSERT INTO public.photos_4326 AS p (
+                        geom, path, filename, directory, altitude, direction, rotation,
+                        longitude, latitude, "timestamp", "order", session
+                    )
+                    SELECT
+                        ST_SetSRID(ST_MakePoint(src.lon, src.lat, COALESCE(src.alt, 0)), 4326),
+                        src.path, src.filename, NULLIF(src.directory, ''), COALESCE(src.alt, 0),
+                        COALESCE(src.direction, 0), src.rotation, src.lon, src.lat,
+                        COALESCE(src.ts, now()), 0, NULLIF(src.session, '')
+                    FROM src
+                    ORDER BY src.seq
+                    {on_conflict}
+                    -- xmax = 0 только у только что вставленной версии строки
+                    RETURNING p.id, p.filename, CASE WHEN p.xmax = 0 THEN 'inserted' ELSE 'updated' END AS action
+                ),
+                merged AS (
+                    INSERT INTO pano_merged (id) SELECT id FROM result
+                )
+            """
+            if returning:
+                cursor.execute(merge_sql + "SELECT id, filename, action FROM result")
+            else:
+                cursor.execute(merge_sql + "SELECT action, COUNT(*) AS count FROM result GROUP BY action")
+            rows = cursor.fetchall()
+
+            cursor.execute("SET LOCAL photos_4326.nav_deferred = 'off'")
+            cursor.execute("SELECT public.photos_4326_nav_rebuild(ARRAY(SELECT id FROM pano_merged))")
+            self.db.commit()
+        except Exception as e:
+            print(f"Error bulk loading panos: {e}")
+            self.db.rollback()
+            raise e
+
+        rows = [row if isinstance(row, dict) else dict(zip(("id", "filename", "action") if returning else ("action", "count"), row)) for row in rows]
+        result = {"received": stream.count, "inserted": 0, "updated": 0}
+        if returning:
+            for row in rows:
+                result[row["action"]] += 1
+            result["rows"] = rows
+        else:
+            for row in rows:
+                result[row["action"]] = row["count"]
+        return result
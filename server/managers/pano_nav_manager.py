@@ -0,0 +1,343 @@
+# ./backend/managers/pano_nav_manager.py
+
+import config
+
+
+class PanoNavManager:
+    """
+    Навигационный граф панорам (таблица photos_4326_nav) и поиск ближайших.
+
+    Ребра:
+      next / prev — соседние кадры одной съемки (session, упорядочено по "timestamp", "order", id),
+                    если между ними не больше NAV_SEQUENCE_MAX_GAP секунд и NAV_SEQUENCE_MAX_DISTANCE метров;
+      near        — до NAV_NEAR_LIMIT ближайших панорам в радиусе NAV_NEAR_RADIUS (перекрестки,
+                    соседние проезды), в обе стороны.
+
+    Граф обновляется триггерами на photos_4326 (как и кластеры): при вставке пересчитываются
+    ребра новых панорам и их соседей по съемке, при удалении — соседей удаленных.
+    Массовый импорт (PanoManager.bulk_upsert) выключает триггеры параметром photos_4326.nav_deferred
+    и затем достраивает граф одним проходом photos_4326_nav_rebuild по импортированным id.
+    Переход "следующая панорама" — одно чтение по первичному ключу (from_id, rel).
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def ensure_schema(self):
+        max_gap = float(getattr(config, "NAV_SEQUENCE_MAX_GAP", 300))
+        max_distance = float(getattr(config, "NAV_SEQUENCE_MAX_DISTANCE", 100))
+        near_radius = float(getattr(config, "NAV_NEAR_RADIUS", 25))
+        near_limit = int(getattr(config, "NAV_NEAR_LIMIT", 4))
+        try:
+            cursor = self.db.get_cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS public.photos_4326_nav (
+                    from_id INTEGER NOT NULL,
+                    rel VARCHAR(8) NOT NULL,
+                    to_id INTEGER NOT NULL,
+                    distance DOUBLE PRECISION,
+                    heading DOUBLE PRECISION,
+                    PRIMARY KEY (from_id, rel, to_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_photos_4326_nav_to ON public.photos_4326_nav (to_id);
+                -- Порядок кадров внутри съемки
+                CREATE INDEX IF NOT EXISTS idx_photos_4326_session_sequence
+                    ON public.photos_4326 (session, "timestamp", "order", id);
+            """)
+
+            # Раньше съемки группировались по directory: такой граф нужно пересобрать по session
+            cursor.execute("SELECT to_regclass('public.idx_photos_4326_sequence') IS NOT NULL AS legacy")
+            row = cursor.fetchone()
+            legacy = row["legacy"] if isinstance(row, dict) else row[0]
+            cursor.execute("DROP INDEX IF EXISTS public.idx_photos_4326_sequence")
+
+            cursor.execute(r"""
+                -- Пересчитывает ребра next/prev для указанных панорам
+                CREATE OR REPLACE FUNCTION public.photos_4326_nav_sequence(ids INTEGER[])
+                RETURNS void LANGUAGE plpgsql AS $$
+                BEGIN
+                    DELETE FROM public.photos_4326_nav WHERE from_id = ANY(ids) AND rel IN ('next', 'prev');
+
+                    INSERT INTO public.photos_4326_nav (from_id, rel, to_id, distance, heading)
+                    SELECT p.id, s.rel, s.id,
+                           ST_Distance(p.geom::geography, s.geom::geography),
+                           degrees(ST_Azimuth(p.geom::geography, s.geom::geography))
+                    FROM public.photos_4326 p
+                    CROSS JOIN LATERAL (
+                        (SELECT 'next'::varchar AS rel, q.id, q.geom, q."timestamp"
+                         FROM public.photos_4326 q
+                         WHERE q.session = p.session
+                           AND (q."timestamp", q."order", q.id) > (p."timestamp", p."order", p.id)
+                         ORDER BY q."timestamp", q."order", q.id
+                         LIMIT 1)
+                        UNION ALL
+                        (SELECT 'prev'::varchar AS rel, q.id, q.geom, q."timestamp"
+                         FROM public.photos_4326 q
+                         WHERE q.session = p.session
+                           AND (q."timestamp", q."order", q.id) < (p."timestamp", p."order", p.id)
+                         ORDER BY q."timestamp" DESC, q."order" DESC, q.id DESC
+                         LIMIT 1)
+                    ) s
+                    WHERE p.id = ANY(ids)
+                      AND p.geom IS NOT NULL AND s.geom IS NOT NULL
+                      AND abs(extract(epoch FROM s."timestamp" - p."timestamp")) <= %(max_gap)s
+                      AND ST_DWithin(p.geom::geography, s.geom::geography, %(max_distance)s)
+                    ON CONFLICT DO NOTHING;
+                END;
+                $$;
+
+                -- Новые панорамы: ребра самих панорам, соседей по съемке и ближайших
+                CREATE OR REPLACE FUNCTION public.photos_4326_nav_link(ids INTEGER[])
+                RETURNS void LANGUAGE plpgsql AS $$
+                BEGIN
+                    PERFORM public.photos_4326_nav_sequence(ARRAY(
+                        SELECT unnest(ids)
+                        UNION
+                        SELECT n.id
+                        FROM public.photos_4326 p
+                        CROSS JOIN LATERAL (
+                            (SELECT q.id FROM public.photos_4326 q
+                             WHERE q.session = p.session
+                               AND (q."timestamp", q."order", q.id) > (p."timestamp", p."order", p.id)
+                             ORDER BY q."timestamp", q."order", q.id LIMIT 1)
+                            UNION ALL
+                            (SELECT q.id FROM public.photos_4326 q
+                             WHERE q.session = p.session
+                               AND (q."timestamp", q."order", q.id) < (p."timestamp", p."order", p.id)
+                             ORDER BY q."timestamp" DESC, q."order" DESC, q.id DESC LIMIT 1)
+                        ) n
+                        WHERE p.id = ANY(ids)
+                    ));
+
+                    INSERT INTO public.photos_4326_nav (from_id, rel, to_id, distance, heading)
+                    SELECT e.a, 'near', e.b,
+                           ST_Distance(e.ga::geography, e.gb::geography),
+                           degrees(ST_Azimuth(e.ga::geography, e.gb::geography))
+                    FROM (
+                        SELECT p.id AS a, q.id AS b, p.geom AS ga, q.geom AS gb
+                        FROM public.photos_4326 p
+                        CROSS JOIN LATERAL (
+                            SELECT q.id, q.geom FROM public.photos_4326 q
+                            WHERE q.id <> p.id
+                            ORDER BY q.geom <-> p.geom
+                            LIMIT %(near_limit)s
+                        ) q
+                        WHERE p.id = ANY(ids) AND p.geom IS NOT NULL
+                          AND ST_DWithin(p.geom::geography, q.geom::geography, %(near_radius)s)
+                    ) pairs
+                    CROSS JOIN LATERAL (VALUES (pairs.a, pairs.b, pairs.ga, pairs.gb),
+                                               (pairs.b, pairs.a, pairs.gb, pairs.ga)) e(a, b, ga, gb)
+                    ON CONFLICT DO NOTHING;
+                END;
+                $$;
+
+                -- Удаленные/сдвинутые панорамы: убираем их ребра и перешиваем соседей по съемке
+                CREATE OR REPLACE FUNCTION public.photos_4326_nav_unlink(ids INTEGER[])
+                RETURNS void LANGUAGE plpgsql AS $$
+                DECLARE
+                    affected INTEGER[];
+                BEGIN
+                    affected := ARRAY(
+                        SELECT DISTINCT from_id FROM public.photos_4326_nav
+                        WHERE to_id = ANY(ids) AND rel IN ('next', 'prev') AND NOT (from_id = ANY(ids))
+                    );
+                    DELETE FROM public.photos_4326_nav WHERE from_id = ANY(ids) OR to_id = ANY(ids);
+                    PERFORM public.photos_4326_nav_sequence(affected);
+                END;
+                $$;
+
+                -- Достраивает граф после массового импорта ids одним проходом: next/prev для всех
+                -- затронутых съемок оконными функциями, near — одним KNN-запросом по новым точкам
+                CREATE OR REPLACE FUNCTION public.photos_4326_nav_rebuild(ids INTEGER[])
+                RETURNS void LANGUAGE plpgsql AS $$
+                DECLARE
+                    sessions VARCHAR[];
+                BEGIN
+                    -- Съемки, куда панорамы попали, и те, откуда ушли (их бывшие соседи)
+                    sessions := ARRAY(
+                        SELECT p.session FROM public.photos_4326 p
+                        WHERE p.id = ANY(ids) AND p.session IS NOT NULL
+                        UNION
+                        SELECT p.session FROM public.photos_4326_nav n
+                        JOIN public.photos_4326 p ON p.id = n.from_id
+                        WHERE n.to_id = ANY(ids) AND n.rel IN ('next', 'prev') AND p.session IS NOT NULL
+                    );
+
+                    DELETE FROM public.photos_4326_nav WHERE from_id = ANY(ids) OR to_id = ANY(ids);
+                    DELETE FROM public.photos_4326_nav n
+                    USING public.photos_4326 p
+                    WHERE n.from_id = p.id AND p.session = ANY(sessions) AND n.rel IN ('next', 'prev');
+
+                    INSERT INTO public.photos_4326_nav (from_id, rel, to_id, distance, heading)
+                    SELECT s.id, e.rel, e.to_id,
+                           ST_Distance(s.geom::geography, e.to_geom::geography),
+                           degrees(ST_Azimuth(s.geom::geography, e.to_geom::geography))
+                    FROM (
+                        SELECT p.id, p.geom, p."timestamp",
+                               lead(p.id) OVER w AS next_id, lead(p.geom) OVER w AS next_geom,
+                               lead(p."timestamp") OVER w AS next_ts,
+                               lag(p.id) OVER w AS prev_id, lag(p.geom) OVER w AS prev_geom,
+                               lag(p."timestamp") OVER w AS prev_ts
+                        FROM public.photos_4326 p
+                        WHERE p.session = ANY(sessions)
+                        WINDOW w AS (PARTITION BY p.session ORDER BY p."timestamp", p."order", p.id)
+                    ) s
+                    CROSS JOIN LATERAL (VALUES ('next'::varchar, s.next_id, s.next_geom, s.next_ts),
+                                               ('prev'::varchar, s.prev_id, s.prev_geom, s.prev_ts)) e(rel, to_id, to_geom, to_ts)
+                    WHERE e.to_id IS NOT NULL
+                      AND s.geom IS NOT NULL AND e.to_geom IS NOT NULL
+                      AND abs(extract(epoch FROM e.to_ts - s."timestamp")) <= %(max_gap)s
+                      AND ST_DWithin(s.geom::geography, e.to_geom::geography, %(max_distance)s)
+                    ON CONFLICT DO NOTHING;
+
+                    INSERT INTO public.photos_4326_nav (from_id, rel, to_id, distance, heading)
+                    SELECT e.a, 'near', e.b,
+                           ST_Distance(e.ga::geography, e.gb::geography),
+                           degrees(ST_Azimuth(e.ga::geography, e.gb::geography))
+                    FROM (
+                        SELECT p.id AS a, q.id AS b, p.geom AS ga, q.geom AS gb
+                        FROM public.photos_4326 p
+                        CROSS JOIN LATERAL (
+                            SELECT q.id, q.geom FROM public.photos_4326 q
+                            WHERE q.id <> p.id
+                            ORDER BY q.geom <-> p.geom
+                            LIMIT %(near_limit)s
+                        ) q
+                        WHERE p.id = ANY(ids) AND p.geom IS NOT NULL
+                          AND ST_DWithin(p.geom::geography, q.geom::geography, %(near_radius)s)
+                    ) pairs
+                    CROSS JOIN LATERAL (VALUES (pairs.a, pairs.b, pairs.ga, pairs.gb),
+                                               (pairs.b, pairs.a, pairs.gb, pairs.ga)) e(a, b, ga, gb)
+                    ON CONFLICT DO NOTHING;
+                END;
+                $$;
+
+                CREATE OR REPLACE FUNCTION public.photos_4326_nav_sync()
+                RETURNS trigger LANGUAGE plpgsql AS $$
+                DECLARE
+                    changed INTEGER[];
+                BEGIN
+                    -- Массовый импорт отложил граф (SET LOCAL photos_4326.nav_deferred = on)
+                    -- и сам вызовет photos_4326_nav_rebuild после загрузки
+                    IF current_setting('photos_4326.nav_deferred', true) = 'on' THEN
+                        RETURN NULL;
+                    END IF;
+
+                    IF TG_OP = 'INSERT' THEN
+                        PERFORM public.photos_4326_nav_link(ARRAY(SELECT id FROM new_rows));
+                    ELSIF TG_OP = 'DELETE' THEN
+                        PERFORM public.photos_4326_nav_unlink(ARRAY(SELECT id FROM old_rows));
+                    ELSE
+                        changed := ARRAY(
+                            SELECT n.id FROM new_rows n JOIN old_rows o ON o.id = n.id
+                            WHERE n.geom IS DISTINCT FROM o.geom
+                               OR n."timestamp" IS DISTINCT FROM o."timestamp"
+                               OR n."order" IS DISTINCT FROM o."order"
+                               OR n.session IS DISTINCT FROM o.session
+                        );
+                        IF array_length(changed, 1) > 0 THEN
+                            PERFORM public.photos_4326_nav_unlink(changed);
+                            PERFORM public.photos_4326_nav_link(changed);
+                        END IF;
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$;
+
+                CREATE OR REPLACE TRIGGER photos_4326_nav_ins
+                    AFTER INSERT ON public.photos_4326
+                    REFERENCING NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION public.photos_4326_nav_sync();
+                CREATE OR REPLACE TRIGGER photos_4326_nav_upd
+                    AFTER UPDATE ON public.photos_4326
+                    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION public.photos_4326_nav_sync();
+                CREATE OR REPLACE TRIGGER photos_4326_nav_del
+                    AFTER DELETE ON public.photos_4326
+                    REFERENCING OLD TABLE AS old_rows
+                    FOR EACH STATEMENT EXECUTE FUNCTION public.photos_4326_nav_sync();
+            """, {"max_gap": max_gap, "max_distance": max_distance, "near_radius": near_radius, "near_limit": near_limit})
+
+            cursor.execute("""
+                SELECT NOT EXISTS (SELECT 1 FROM public.photos_4326_nav)
+                   AND EXISTS (SELECT 1 FROM public.photos_4326) AS empty
+            """)
+            row = cursor.fetchone()
+            empty = row["empty"] if isinstance(row, dict) else row[0]
+            self.db.commit()
+
+            # Первый запуск на существующих данных или граф по старой группировке: строим целиком
+            if empty or legacy:
+                self.rebuild()
+        except Exception as e:
+            print(f"Could not initialize pano navigation graph: {e}")
+            self.db.rollback()
+            raise e
+
+    def rebuild(self):
+        """Полная пересборка графа (например, после смены NAV_* параметров)"""
+        try:
+            cursor = self.db.get_cursor()
+            cursor.execute("LOCK TABLE public.photos_4326_nav IN ACCESS EXCLUSIVE MODE")
+            cursor.execute("TRUNCATE public.photos_4326_nav")
+            cursor.execute("SELECT public.photos_4326_nav_rebuild(ARRAY(SELECT id FROM public.photos_4326))")
+            self.db.commit()
+        except Exception as e:
+            print(f"Error rebuilding pano navigation graph: {e}")
+            self.db.rollback()
+            raise e
+
+    def get_links(self, pano_id, rel=None):
+        """Ребра графа для панорамы (все или одного типа), ближайшие первыми"""
+        cursor = self.db.get_cursor()
+        query = """
+            SELECT n.rel, n.to_id AS id, p.filename, n.distance, n.heading, p.direction
+            FROM public.photos_4326_nav n
+            JOIN public.photos_4326 p ON p.id = n.to_id
+            WHERE n.from_id = %s
+        """
+        params = [pano_id]
+        if rel:
+            query += " AND n.rel = %s"
+            params.append(rel)
+        query += " ORDER BY n.rel, n.distance"
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def get_neighbors(self, pano_id, radius, limit, heading=None, tolerance=45.0, candidates=64):
+        """
+        Ближайшие панорамы через KNN (<->) по GiST-индексу: берем candidates ближайших,
+        затем фильтруем по радиусу (метры) и, если задан heading, по направлению на соседа.
+        Возвращает None, если исходной панорамы нет.
+        """
+        cursor = self.db.get_cursor()
+        cursor.execute("SELECT ST_X(geom) AS lon, ST_Y(geom) AS lat FROM public.photos_4326 WHERE id = %s", (pano_id,))
+        origin = cursor.fetchone()
+        if not origin or origin["lon"] is None:
+            return None
+
+        cursor.execute("""
+            WITH cand AS (
+                SELECT p.id, p.filename, p.direction, p.geom
+                FROM public.photos_4326 p
+                WHERE p.id <> %(id)s
+                ORDER BY p.geom <-> ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)
+                LIMIT %(candidates)s
+            ),
+            measured AS (
+                SELECT id, filename, direction,
+                       ST_Distance(geom::geography, ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)::geography) AS distance,
+                       degrees(ST_Azimuth(ST_SetSRID(ST_MakePoint(%(lon)s, %(lat)s), 4326)::geography, geom::geography)) AS heading
+                FROM cand
+            )
+            SELECT id, filename, direction, distance, heading
+            FROM measured
+            WHERE distance <= %(radius)s
+              AND (%(want)s::double precision IS NULL
+                   OR abs(heading - %(want)s - 360 * floor((heading - %(want)s + 180) / 360)) <= %(tolerance)s)
+            ORDER BY distance
+            LIMIT %(limit)s
+        """, {
+            "id": pano_id, "lon": origin["lon"], "lat": origin["lat"], "candidates": max(candidates, limit),
+            "radius": radius, "want": heading, "tolerance": tolerance, "limit": limit
+        })
+        return [dict(row) for row in cursor.fetchall()]
@@ -1,7 +1,7 @@
 # ./backend/managers/user_manager.py
 
 from models.user import User
-from werkzeug.security import generate_password_hash
+from services.password_service import hash_password
 
 class UserManager:
     def __init__(self, db):
@@ -30,7 +30,7 @@ class UserManager:
         Создаем пользователя с хешированным паролем.
         """
         cursor = self.db.get_cursor()
-        hashed_password = generate_password_hash(password)
+        hashed_password = hash_password(password)
         query = "INSERT INTO users (username, password) VALUES (?, ?)"
         cursor.execute(query, (username, hashed_password))
         self.db.commit()
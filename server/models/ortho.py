@@ -1,7 +1,7 @@
 # ./backend/models/ortho.py
 
 class Ortho:
-    def __init__(self, filename, bounds=None, url=None, ortho_id=None, upload_date=None, crs=None, is_visible=False, is_cog=False, geometry_wkt=None, preview_filename=None, wgs84_bounds=None):
+    def __init__(self, filename, bounds=None, url=None, ortho_id=None, upload_date=None, crs=None, is_visible=False, is_cog=False, geometry_wkt=None, preview_filename=None, wgs84_bounds=None, cog_profile=None):
         self.id = ortho_id
         self.filename = filename
         self.bounds = bounds
@@ -15,6 +15,7 @@ class Ortho:
         self.geometry_wkt = geometry_wkt  # Используется для передачи WKT в менеджер при вставке
         self.preview_filename = preview_filename # Ссылка на файл превью
         self.wgs84_bounds = wgs84_bounds # [NEW] Точные границы (Bounding Box) в градусах WGS84 из PostGIS
+        self.cog_profile = cog_profile # Профиль сжатия COG (jpeg / webp / zstd / deflate / lerc / none)
 
     def to_dict(self):
         """
@@ -29,6 +30,7 @@ class Ortho:
             "crs": self.crs,
             "is_visible": self.is_visible,
             "is_cog": self.is_cog,  # Добавляем флаг COG в ответ API
+            "cog_profile": self.cog_profile,
             "upload_date": str(self.upload_date) if self.upload_date else None,
             "preview_filename": self.preview_filename # Отдаем имя превью на фронтенд
         }
\ No newline at end of file
@@ -17,6 +17,15 @@ from hashlib import sha256
 from typing import Optional, Dict, Any
 
 import config
+from services.ttl_cache import TTLCache
+
+# Недавно проверенные токены: ключ — подпись, запись живет до exp токена.
+# Повторные запросы с той же cookie не пересчитывают HMAC и не разбирают JSON.
+_verified = TTLCache(maxsize=getattr(config, "JWT_CACHE_SIZE", 4096), ttl=0)
+
+# Заготовка HMAC с уже обработанным ключом: copy() дешевле, чем hmac.new на каждый токен
+_signer_secret = None
+_signer = None
 
 
 def _b64url(data: bytes) -> str:
@@ -32,6 +41,19 @@ def _unb64url(s: str) -> bytes:
     return base64.urlsafe_b64decode(s.encode("ascii"))
 
 
+def _hmac(signing_input: bytes) -> bytes:
+    """HMAC-SHA256 от signing_input на ключе JWT_SECRET (заготовка пересоздается при смене секрета)."""
+    global _signer_secret, _signer
+    secret = config.JWT_SECRET
+    if _signer is None or _signer_secret != secret:
+        _signer = hmac.new(secret.encode("utf-8"), digestmod=sha256)
+        _signer_secret = secret
+        _verified.clear()
+    mac = _signer.copy()
+    mac.update(signing_input)
+    return mac.digest()
+
+
 def create_access_token(claims: Dict[str, Any], *, expires_in: int) -> str:
     """
     Формирует токен с алгоритмом HS256.
@@ -50,7 +72,7 @@ def create_access_token(claims: Dict[str, Any], *, expires_in: int) -> str:
     payload_b64 = _b64url(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
     signing_input = f"{header_b64}.{payload_b64}".encode("ascii")
 
-    signature = hmac.new(config.JWT_SECRET.encode("utf-8"), signing_input, sha256).digest()
+    signature = _hmac(signing_input)
     sig_b64 = _b64url(signature)
     return f"{header_b64}.{payload_b64}.{sig_b64}"
 
@@ -58,29 +80,40 @@ def create_access_token(claims: Dict[str, Any], *, expires_in: int) -> str:
 def decode_access_token(token: str) -> Optional[Dict[str, Any]]:
     """
     Валидирует подпись и срок действия токена.
+    Успешно проверенные токены кэшируются до истечения срока (см. _verified).
     :return: payload при успехе, иначе None
     """
     try:
-        parts = token.split(".")
-        if len(parts) != 3:
+        signing_input, _, sig_b64 = token.rpartition(".")
+        if signing_input.count(".") != 1:
             return None
-
-        header_b64, payload_b64, sig_b64 = parts
-        signing_input = f"{header_b64}.{payload_b64}".encode("ascii")
-
-        expected_sig = hmac.new(config.JWT_SECRET.encode("utf-8"), signing_input, sha256).digest()
+        now = int(time.time())
+
+        cached = _verified.get(sig_b64)
+        # Подпись та же, но заголовок/payload другие — не доверяем кэшу, проверяем заново
+        if cached is not None and cached[0] == signing_input:
+            payload = cached[1]
+            if int(payload.get("exp", 0)) < now:
+                return None
+            return dict(payload)
+
+        signing_input = signing_input.encode("ascii")
+        expected_sig = _hmac(signing_input)
         actual_sig = _unb64url(sig_b64)
 
         if not hmac.compare_digest(expected_sig, actual_sig):
             return None
 
+        payload_b64 = signing_input.split(b".", 1)[1].decode("ascii")
         payload = json.loads(_unb64url(payload_b64).decode("utf-8"))
 
         # Проверка срока действия
-        if int(payload.get("exp", 0)) < int(time.time()):
+        exp = int(payload.get("exp", 0))
+        if exp < now:
             return None
 
-        return payload
+        _verified.set(sig_b64, (signing_input.decode("ascii"), payload), ttl=exp - now + 1)
+        return dict(payload)
     except Exception:
         # Любая ошибка чтения/декодирования — считаем токен невалидным
         return None
@@ -0,0 +1,150 @@
+# server/services/exif_reader.py
+import struct
+from datetime import datetime
+
+# Сколько байт с начала JPEG достаточно для EXIF: сегмент APP1 не длиннее 64 КБ,
+# перед ним могут стоять APP0 (JFIF) и XMP
+EXIF_HEAD_BYTES = 128 * 1024
+
+# Теги TIFF/EXIF, которые нам нужны
+_TAG_EXIF_IFD = 0x8769
+_TAG_GPS_IFD = 0x8825
+_TAG_DATETIME = 0x0132
+_TAG_DATETIME_ORIGINAL = 0x9003
+_GPS_LAT_REF, _GPS_LAT, _GPS_LON_REF, _GPS_LON = 1, 2, 3, 4
+_GPS_ALT_REF, _GPS_ALT = 5, 6
+_GPS_IMG_DIRECTION = 17
+
+# Размер одного значения по типу TIFF
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+
+
+def _find_app1(data):
+    """Возвращает содержимое TIFF из сегмента APP1 "Exif" или None. Дальше SOS не идем."""
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # заполняющие байты
+            pos += 1
+            continue
+        if marker == 0xDA or marker == 0xD9:  # начались данные изображения
+            return None
+        length = struct.unpack(">H", data[pos + 2:pos + 4])[0]
+        if marker == 0xE1 and data[pos + 4:pos + 10] == b"Exif\x00\x00":
+            end = pos + 2 + length
+            if end > len(data):
+                return None
+            return data[pos + 10:end]
+        pos += 2 + length
+    return None
+
+
+class _Tiff:
+    def __init__(self, tiff):
+        self.tiff = tiff
+        order = tiff[:2]
+        if order == b"II":
+            self.endian = "<"
+        elif order == b"MM":
+            self.endian = ">"
+        else:
+            raise ValueError("bad byte order")
+
+    def unpack(self, fmt, offset):
+        return struct.unpack_from(self.endian + fmt, self.tiff, offset)
+
+    def first_ifd(self):
+        return self.unpack("I", 4)[0]
+
+    def read_ifd(self, offset, wanted):
+        """Читает только теги из wanted: {tag: значение}"""
+        result = {}
+        count = self.unpack("H", offset)[0]
+        for i in range(count):
+            entry = offset + 2 + i * 12
+            tag, typ, n = self.unpack("HHI", entry)
+            if tag not in wanted or typ not in _TYPE_SIZES:
+                continue
+            size = _TYPE_SIZES[typ] * n
+            value_offset = entry + 8 if size <= 4 else self.unpack("I", entry + 8)[0]
+            if value_offset + size > len(self.tiff):
+                continue
+            result[tag] = self._value(typ, n, value_offset)
+        return result
+
+    def _value(self, typ, n, offset):
+        if typ == 2:
+            return self.tiff[offset:offset + n].split(b"\x00", 1)[0].decode("ascii", "ignore")
+        if typ in (1, 7):
+            raw = self.tiff[offset:offset + n]
+            return raw[0] if n == 1 else raw
+        if typ == 3:
+            values = self.unpack(f"{n}H", offset)
+        elif typ == 4:
+            values = self.unpack(f"{n}I", offset)
+        elif typ == 9:
+            values = self.unpack(f"{n}i", offset)
+        else:
+            fmt = "I" if typ == 5 else "i"
+            raw = self.unpack(f"{2 * n}{fmt}", offset)
+            values = tuple(raw[i] / raw[i + 1] if raw[i + 1] else 0.0 for i in range(0, 2 * n, 2))
+        return values[0] if n == 1 else values
+
+
+def _to_degrees(value):
+    if not isinstance(value, tuple) or len(value) < 3:
+        return None
+    return float(value[0]) + float(value[1]) / 60.0 + float(value[2]) / 3600.0
+
+
+def read_exif_gps(data):
+    """
+    Быстрый разбор EXIF без декодирования изображения: ищет APP1 в первых байтах JPEG
+    и читает только GPS (широта, долгота, высота, направление) и DateTimeOriginal.
+
+    Возвращает (lat, lon, alt, direction, dt) в том же виде, что PanoController._parse_exif_data,
+    или None, если EXIF не найден/поврежден (тогда вызывающий использует PIL).
+    """
+    tiff = _find_app1(data)
+    if not tiff:
+        return None
+    try:
+        reader = _Tiff(tiff)
+        ifd0 = reader.read_ifd(reader.first_ifd(), {_TAG_EXIF_IFD, _TAG_GPS_IFD, _TAG_DATETIME})
+
+        gps = {}
+        if _TAG_GPS_IFD in ifd0:
+            gps = reader.read_ifd(ifd0[_TAG_GPS_IFD], {
+                _GPS_LAT_REF, _GPS_LAT, _GPS_LON_REF, _GPS_LON, _GPS_ALT_REF, _GPS_ALT, _GPS_IMG_DIRECTION
+            })
+        exif = {}
+        if _TAG_EXIF_IFD in ifd0:
+            exif = reader.read_ifd(ifd0[_TAG_EXIF_IFD], {_TAG_DATETIME_ORIGINAL})
+    except (struct.error, ValueError):
+        return None
+
+    lat = lon = alt = None
+    if _GPS_LAT in gps and _GPS_LAT_REF in gps:
+        lat = _to_degrees(gps[_GPS_LAT])
+        if lat is not None and gps[_GPS_LAT_REF] == "S": lat = -lat
+    if _GPS_LON in gps and _GPS_LON_REF in gps:
+        lon = _to_degrees(gps[_GPS_LON])
+        if lon is not None and gps[_GPS_LON_REF] == "W": lon = -lon
+    if _GPS_ALT in gps:
+        alt = float(gps[_GPS_ALT])
+        # AltitudeRef = 1 — ниже уровня моря
+        if gps.get(_GPS_ALT_REF) == 1: alt = -alt
+    direction = float(gps.get(_GPS_IMG_DIRECTION, 0.0) or 0.0)
+
+    dt = None
+    date_str = exif.get(_TAG_DATETIME_ORIGINAL) or ifd0.get(_TAG_DATETIME)
+    if date_str:
+        try:
+            dt = datetime.strptime(date_str.strip(), "%Y:%m:%d %H:%M:%S")
+        except ValueError:
+            pass
+    return lat, lon, alt, direction, dt
@@ -1,25 +1,244 @@
 # server/services/gdal_service.py
 import os
+import threading
 import traceback
-from osgeo import gdal, osr, ogr
+from collections import OrderedDict
+from services.lazy_import import lazy_module
+from storage import get_minio_client
+import config
 
-# Включаем использование исключений для GDAL, чтобы ошибки нормально ловились в try/except
-gdal.UseExceptions()
+
+def _init_gdal(module):
+    """Первая загрузка GDAL в процессе: исключения вместо кодов ошибок и доступ к MinIO"""
+    # Включаем использование исключений для GDAL, чтобы ошибки нормально ловились в try/except
+    module.UseExceptions()
+    for key, value in GdalService.remote_access_options().items():
+        module.SetConfigOption(key, value)
+
+
+# GDAL/PROJ загружаются при первом обращении, а не при импорте: воркеру,
+# который не трогает растры, они не нужны (см. services/lazy_import.py)
+gdal = lazy_module("osgeo.gdal", on_load=_init_gdal)
+osr = lazy_module("osgeo.osr")
+ogr = lazy_module("osgeo.ogr")
+
+EMPTY_BOUNDS = {"north": 0, "south": 0, "east": 0, "west": 0}
+
+# Профили сжатия COG. Опции общие для gdal.Translate и gdal.Warp с format="COG".
+COG_PROFILES = {
+    # RGB ортофото: JPEG в YCbCr (драйвер COG включает YCbCr для 3 каналов автоматически)
+    "jpeg": {"options": ["COMPRESS=JPEG"], "quality": True, "byte_only": True, "bands": (1, 3, 4)},
+    # RGB/RGBA ортофото с прозрачностью: WEBP
+    "webp": {"options": ["COMPRESS=WEBP"], "quality": True, "byte_only": True, "bands": (3, 4)},
+    # Универсальные lossless-профили с предиктором
+    "zstd": {"options": ["COMPRESS=ZSTD", "LEVEL=9", "PREDICTOR=YES"]},
+    "deflate": {"options": ["COMPRESS=DEFLATE", "LEVEL=6", "PREDICTOR=YES"]},
+    # DEM / DSM: LERC с контролируемой погрешностью
+    "lerc": {"options": ["COMPRESS=LERC_ZSTD"], "max_z_error": True},
+    # Старое поведение без сжатия
+    "none": {"options": ["COMPRESS=NONE"]},
+}
+
+OVERVIEW_RESAMPLINGS = ("NEAREST", "AVERAGE", "BILINEAR", "CUBIC", "CUBICSPLINE", "LANCZOS", "MODE", "RMS")
+
+# Кэш метаданных растров: один gdal.Open на файл вместо отдельного открытия в каждом методе
+_INSPECT_CACHE_SIZE = 64
+_inspect_cache = OrderedDict()
+_inspect_lock = threading.Lock()
 
 class GdalService:
-    
+
     @staticmethod
-    def get_crs(path):
-        """Определяет проекцию (МСК-05, Google, WGS84) с помощью нативного GDAL"""
+    def remote_access_options():
+        """
+        Опции драйвера /vsis3/ (MinIO) и блочного кэша GDAL.
+        Опции глобальны для процесса и применяются один раз при загрузке GDAL (_init_gdal).
+        """
+        endpoint = getattr(config, "MINIO_ENDPOINT", "minio:9000")
+        secure = getattr(config, "MINIO_SECURE", False)
+
+        options = {
+            # --- Доступ к MinIO ---
+            "AWS_S3_ENDPOINT": endpoint,
+            "AWS_ACCESS_KEY_ID": getattr(config, "MINIO_ACCESS_KEY", "minioadmin"),
+            "AWS_SECRET_ACCESS_KEY": getattr(config, "MINIO_SECRET_KEY", "minioadmin"),
+            "AWS_REGION": os.getenv("AWS_REGION", "us-east-1"),
+            "AWS_HTTPS": "YES" if secure else "NO",
+            "AWS_VIRTUAL_HOSTING": "FALSE",
+
+            # --- Минимум лишних запросов при открытии ---
+            "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+            "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff,.TIF,.TIFF,.ovr",
+            "GDAL_INGESTED_BYTES_AT_OPEN": str(getattr(config, "GDAL_INGESTED_BYTES_AT_OPEN", 32768)),
+
+            # --- Кэши и склейка range-запросов ---
+            "GDAL_CACHEMAX": str(getattr(config, "GDAL_CACHEMAX", 512)),
+            "VSI_CACHE": "TRUE",
+            "VSI_CACHE_SIZE": str(getattr(config, "GDAL_VSI_CACHE_SIZE", 64 * 1024 * 1024)),
+            "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+            "GDAL_HTTP_MULTIRANGE": "YES",
+            "GDAL_HTTP_MAX_RETRY": "3",
+            "GDAL_HTTP_RETRY_DELAY": "1",
+        }
+        return options
+
+    @staticmethod
+    def vsis3_path(bucket, key):
+        """Путь к объекту MinIO для потокового чтения GDAL"""
+        return f"/vsis3/{bucket}/{key}"
+
+    @staticmethod
+    def is_remote(path):
+        return isinstance(path, str) and path.startswith("/vsi")
+
+
+    # ------------------------------------------------------------------
+    # Единый сбор метаданных
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _remote_version(path):
+        """
+        (ETag, размер) объекта /vsis3/<bucket>/<key> по одному HEAD-запросу в MinIO.
+        Перезаливка под тем же именем и повторная запись <name>_cog.tif меняют ETag.
+        """
+        if not path.startswith("/vsis3/"):
+            return None
+        bucket, _, key = path[len("/vsis3/"):].partition("/")
+        try:
+            stat = get_minio_client().stat_object(bucket, key)
+        except Exception:
+            return None
+        return (stat.etag, stat.size)
+
+    @staticmethod
+    def _cache_key(path):
+        """Локальные файлы различаем по размеру и mtime, объекты MinIO — по ETag и размеру"""
+        if GdalService.is_remote(path):
+            version = GdalService._remote_version(path)
+            return (path,) + version if version else None
+        try:
+            st = os.stat(path)
+            return (path, st.st_size, st.st_mtime_ns)
+        except OSError:
+            return None
+
+    @staticmethod
+    def inspect(path):
+        """
+        Открывает файл один раз и собирает все метаданные, нужные при загрузке и обработке:
+        границы, CRS, признак COG, footprint в WGS84, статистику каналов, список overview,
+        размер блока и nodata. Результат кэшируется (словарь, его не нужно менять).
+        """
+        key = GdalService._cache_key(path)
+        if key is not None:
+            with _inspect_lock:
+                cached = _inspect_cache.get(key)
+                if cached is not None:
+                    _inspect_cache.move_to_end(key)
+                    return cached
+
+        if key is not None and GdalService.is_remote(path):
+            # Новая версия объекта: прежние записи и блоки в кэше /vsicurl/ больше не годятся
+            GdalService.invalidate(path)
+
+        info = GdalService._read_info(path)
+
+        if key is not None and info.get("ok"):
+            with _inspect_lock:
+                _inspect_cache[key] = info
+                _inspect_cache.move_to_end(key)
+                while len(_inspect_cache) > _INSPECT_CACHE_SIZE:
+                    _inspect_cache.popitem(last=False)
+        return info
+
+    @staticmethod
+    def invalidate(path):
+        """Удаляет из кэша все записи по пути (после перезаписи/удаления файла)"""
+        with _inspect_lock:
+            for key in [k for k in _inspect_cache if k[0] == path]:
+                del _inspect_cache[key]
+        if GdalService.is_remote(path):
+            # Заголовки и блоки, закэшированные самим GDAL для этого пути
+            gdal.VSICurlPartialClearCache(path)
+
+    @staticmethod
+    def _read_info(path):
+        info = {
+            "ok": False,
+            "path": path,
+            "width": 0,
+            "height": 0,
+            "band_count": 0,
+            "bounds": dict(EMPTY_BOUNDS),
+            "crs": "Unknown",
+            "is_cog": False,
+            "footprint_wkt": None,
+            "block_size": None,
+            "is_tiled": False,
+            "overviews": [],
+            "nodata": None,
+            "data_type": None,
+            "compression": None,
+            "band_stats": [],
+        }
+        ds = None
         try:
             ds = gdal.Open(path)
             if not ds:
-                return "Unknown"
-                
+                return info
+
+            info["width"] = ds.RasterXSize
+            info["height"] = ds.RasterYSize
+            info["band_count"] = ds.RasterCount
+
+            gt = ds.GetGeoTransform()
             wkt = ds.GetProjection()
-            if not wkt:
-                return "Unknown"
+            info["bounds"] = GdalService._bounds_from_gt(gt, ds.RasterXSize, ds.RasterYSize)
+            info["crs"] = GdalService._crs_name(wkt)
+            info["footprint_wkt"] = GdalService._footprint_from_gt(gt, ds.RasterXSize, ds.RasterYSize, wkt)
+
+            structure = ds.GetMetadata("IMAGE_STRUCTURE") or {}
+            info["is_cog"] = structure.get("LAYOUT", "") == "COG"
+            info["compression"] = structure.get("COMPRESSION")
+
+            if ds.RasterCount > 0:
+                band = ds.GetRasterBand(1)
+                block_x, block_y = band.GetBlockSize()
+                info["block_size"] = [block_x, block_y]
+                info["is_tiled"] = block_x < ds.RasterXSize and block_y > 1
+                info["nodata"] = band.GetNoDataValue()
+                info["data_type"] = gdal.GetDataTypeName(band.DataType)
+                info["overviews"] = [
+                    [band.GetOverview(i).XSize, band.GetOverview(i).YSize]
+                    for i in range(band.GetOverviewCount())
+                ]
 
+            # Статистику берём только уже сохранённую в файле (force=False): без чтения пикселей
+            for i in range(1, ds.RasterCount + 1):
+                stats = None
+                try:
+                    values = ds.GetRasterBand(i).GetStatistics(True, False)
+                    if values and values[1] > values[0]:
+                        stats = {"min": values[0], "max": values[1], "mean": values[2], "std": values[3]}
+                except Exception:
+                    pass
+                info["band_stats"].append(stats)
+
+            info["ok"] = True
+            return info
+        except Exception as e:
+            print(f"Error inspecting raster {path}: {e}")
+            return info
+        finally:
+            ds = None # Освобождаем память
+
+    @staticmethod
+    def _crs_name(wkt):
+        """Определяет проекцию (МСК-05, Google, WGS84) по WKT"""
+        if not wkt:
+            return "Unknown"
+        try:
             srs = osr.SpatialReference()
             srs.ImportFromWkt(wkt)
             
@@ -45,79 +264,32 @@ class GdalService:
         except Exception as e:
             print(f"Error detecting CRS: {e}")
             return "Unknown"
-        finally:
-            ds = None # Освобождаем память
 
     @staticmethod
-    def get_bounds(path):
-        """Получает границы (bounds) напрямую из GeoTransform"""
-        try:
-            ds = gdal.Open(path)
-            if not ds:
-                return {"north": 0, "south": 0, "east": 0, "west": 0}
+    def _bounds_from_gt(gt, width, height):
+        """Вычисляет границы (bounds) напрямую из GeoTransform"""
+        min_x = gt[0]
+        max_y = gt[3]
+        max_x = gt[0] + width * gt[1] + height * gt[2]
+        min_y = gt[3] + width * gt[4] + height * gt[5]
 
-            gt = ds.GetGeoTransform()
-            width = ds.RasterXSize
-            height = ds.RasterYSize
+        return {
+            "north": max_y if max_y > min_y else min_y,
+            "south": min_y if min_y < max_y else max_y,
+            "east": max_x if max_x > min_x else min_x,
+            "west": min_x if min_x < max_x else max_x
+        }
 
-            # Вычисляем крайние точки
-            min_x = gt[0]
-            max_y = gt[3]
-            max_x = gt[0] + width * gt[1] + height * gt[2]
-            min_y = gt[3] + width * gt[4] + height * gt[5]
-
-            return {
-                "north": max_y if max_y > min_y else min_y,
-                "south": min_y if min_y < max_y else max_y,
-                "east": max_x if max_x > min_x else min_x,
-                "west": min_x if min_x < max_x else max_x
-            }
-        except Exception as e:
-            print(f"Error getting bounds: {e}")
-            return {"north": 0, "south": 0, "east": 0, "west": 0}
-        finally:
-            ds = None
-
-    def check_is_cog(self, file_path):
-        """
-        Проверяет, является ли файл Cloud Optimized GeoTIFF.
-        Использует binding gdal для проверки метаданных структуры.
-        """
-        try:
-            ds = gdal.Open(file_path)
-            if not ds:
-                return False
-            
-            # Получаем метаданные структуры изображения
-            metadata = ds.GetMetadata("IMAGE_STRUCTURE")
-            layout = metadata.get("LAYOUT", "")
-            
-            # Если указано COG, значит файл оптимизирован
-            if layout == "COG":
-                return True
-                
-            return False
-        except Exception as e:
-            print(f"Error checking COG: {e}")
-            return False
-        finally:
-            ds = None
-
-    def get_footprint_wkt(self, file_path):
+    @staticmethod
+    def _footprint_from_gt(gt, width, height, src_wkt):
         """
         Создает WKT (Well-Known Text) полигон границ изображения,
         перепроецированный в EPSG:4326 для записи в БД.
         """
+        if not src_wkt:
+            # Если проекции нет, вернуть None
+            return None
         try:
-            ds = gdal.Open(file_path)
-            if not ds:
-                return None
-
-            # 1. Получаем гео-трансформацию (координаты пикселей -> координаты карты)
-            gt = ds.GetGeoTransform()
-            width = ds.RasterXSize
-            height = ds.RasterYSize
-
             # Точный расчет углов:
             min_x = gt[0]
             max_y = gt[3]
@@ -132,16 +304,9 @@ class GdalService:
             ring.AddPoint(min_x, min_y) # BL
             ring.AddPoint(min_x, max_y) # Close ring
 
-            # Создаем полигон
             poly = ogr.Geometry(ogr.wkbPolygon)
             poly.AddGeometry(ring)
 
-            # 2. Определяем исходную и целевую проекции
-            src_wkt = ds.GetProjection()
-            if not src_wkt:
-                # Если проекции нет, вернуть None или попытаться использовать raw
-                return None
-
             src_srs = osr.SpatialReference()
             src_srs.ImportFromWkt(src_wkt)
 
@@ -150,7 +315,6 @@ class GdalService:
             # Важно: Force traditional axis order (Long, Lat) для WKT
             tgt_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
 
-            # 3. Трансформируем геометрию
             transform = osr.CoordinateTransformation(src_srs, tgt_srs)
             poly.Transform(transform)
 
@@ -158,11 +322,127 @@ class GdalService:
             # чтобы PostGIS не ругался "Geometry has Z dimension"
             poly.FlattenTo2D()
 
-            # Возвращаем строку WKT
             return poly.ExportToWkt()
-
         except Exception as e:
             print(f"Error creating footprint WKT: {e}")
             return None
-        finally:
-            ds = None
\ No newline at end of file
+
+    # ------------------------------------------------------------------
+    # Решения о способе чтения
+    # ------------------------------------------------------------------
+
+    def needs_local_copy(self, path, random_access=False):
+        """
+        Решает, нужно ли скачивать файл целиком перед обработкой.
+        Последовательное чтение (COG, превью) всегда идёт потоком.
+        Для произвольного доступа (Warp) потоком читаем только тайловые файлы:
+        полосовой (strip) GeoTIFF через HTTP даёт лавину мелких range-запросов.
+        """
+        if not self.is_remote(path) or not random_access:
+            return False
+        info = self.inspect(path)
+        if not info["ok"]:
+            return True
+        return not info["is_tiled"]
+
+    @staticmethod
+    def pick_overview_level(path, target_width):
+        """
+        Возвращает индекс самого грубого overview, ширина которого ещё не меньше target_width,
+        либо None, если достаточно исходного разрешения или overview нет.
+        """
+        level = None
+        for i, (ov_width, _) in enumerate(GdalService.inspect(path)["overviews"]):
+            if ov_width >= target_width:
+                level = i
+            else:
+                break
+        return level
+
+    def open_for_preview(self, path, target_width=400):
+        """
+        Открывает датасет на нужном уровне overview, чтобы при генерации превью
+        читались только маленькие уровни пирамиды, а не полное разрешение.
+        """
+        level = self.pick_overview_level(path, target_width)
+        if level is None:
+            return gdal.Open(path)
+        return gdal.OpenEx(path, gdal.OF_RASTER, open_options=[f"OVERVIEW_LEVEL={level}"])
+
+    # ------------------------------------------------------------------
+    # Профили COG
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def resolve_cog_profile(profile, info):
+        """
+        Выбирает профиль сжатия с учётом данных: для auto — по типу и числу каналов,
+        для явно заданного — проверяет совместимость (JPEG/WEBP только для 8 бит).
+        """
+        profile = (profile or getattr(config, "COG_DEFAULT_PROFILE", "auto") or "auto").lower()
+        data_type = info.get("data_type") or "Byte"
+        bands = info.get("band_count") or 0
+
+        if profile == "auto":
+            if data_type == "Byte" and bands == 3:
+                return "jpeg"
+            if data_type == "Byte" and bands == 4:
+                return "webp"
+            if data_type.startswith("Float") and bands == 1:
+                return "lerc"
+            return "deflate" if data_type == "Byte" else "zstd"
+
+        spec = COG_PROFILES.get(profile)
+        if spec is None:
+            raise ValueError(f"Неизвестный профиль COG: {profile}")
+        if spec.get("byte_only") and (data_type != "Byte" or bands not in spec["bands"]):
+            # Несовместимый lossy-профиль — откатываемся на lossless
+            return "deflate"
+        return profile
+
+    @staticmethod
+    def cog_creation_options(profile, blocksize=None, overview_resampling=None):
+        """Собирает creationOptions драйвера COG для выбранного профиля"""
+        spec = COG_PROFILES[profile]
+        blocksize = int(blocksize or getattr(config, "COG_BLOCKSIZE", 512))
+        resampling = (overview_resampling or getattr(config, "COG_OVERVIEW_RESAMPLING", "AVERAGE")).upper()
+        if resampling not in OVERVIEW_RESAMPLINGS:
+            raise ValueError(f"Недопустимый метод ресемплинга overview: {resampling}")
+
+        options = list(spec["options"])
+        if spec.get("quality"):
+            options.append(f"QUALITY={getattr(config, 'COG_JPEG_QUALITY', 85)}")
+        if spec.get("max_z_error"):
+            options.append(f"MAX_Z_ERROR={getattr(config, 'COG_LERC_MAX_Z_ERROR', 0.01)}")
+
+        options += [
+            f"BLOCKSIZE={blocksize}",
+            f"OVERVIEW_RESAMPLING={resampling}",
+            "OVERVIEWS=IGNORE_EXISTING",
+            "BIGTIFF=IF_NEEDED",
+            "NUM_THREADS=ALL_CPUS",
+            "SPARSE_OK=TRUE",
+        ]
+        return options
+
+    # ------------------------------------------------------------------
+    # Совместимые точечные методы (обёртки над inspect)
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def get_crs(path):
+        """Определяет проекцию (МСК-05, Google, WGS84) с помощью нативного GDAL"""
+        return GdalService.inspect(path)["crs"]
+
+    @staticmethod
+    def get_bounds(path):
+        """Получает границы (bounds) напрямую из GeoTransform"""
+        return dict(GdalService.inspect(path)["bounds"])
+
+    def check_is_cog(self, file_path):
+        """Проверяет, является ли файл Cloud Optimized GeoTIFF (LAYOUT=COG)"""
+        return self.inspect(file_path)["is_cog"]
+
+    def get_footprint_wkt(self, file_path):
+        """WKT-полигон границ изображения в EPSG:4326 для записи в БД"""
+        return self.inspect(file_path)["footprint_wkt"]
@@ -0,0 +1,81 @@
+# server/services/lazy_import.py
+import importlib
+import threading
+
+# Все ленивые модули процесса по имени: один заместитель на модуль
+_registry = {}
+_registry_lock = threading.RLock()
+
+
+class LazyModule:
+    """
+    Заместитель модуля: настоящий import выполняется при первом обращении к атрибуту.
+    Тяжелые библиотеки (GDAL/PROJ, PIL, numpy, piexif) не загружаются в воркер,
+    который обслуживает только векторные тайлы и API.
+
+    on_load(module) вызывается один раз сразу после импорта и до того,
+    как модулем смогут воспользоваться другие потоки (например, gdal.UseExceptions()).
+    """
+    def __init__(self, name, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with _registry_lock:
+                module = self._module
+                if module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load:
+                        self._on_load(module)
+                    self._module = module
+        return module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_module(name, on_load=None):
+    """
+    Возвращает заместитель модуля name. Повторный вызов с тем же именем отдает тот же объект;
+    on_load учитывается только при первой регистрации.
+    """
+    with _registry_lock:
+        module = _registry.get(name)
+        if module is None:
+            module = _registry[name] = LazyModule(name, on_load)
+        return module
+
+
+def preload(names):
+    """
+    Загружает зарегистрированные ленивые модули заранее (например, в мастере gunicorn
+    при preload_app, чтобы их страницы памяти были общими для воркеров).
+    Возвращает список загруженных имен; неизвестные и несуществующие модули пропускаются.
+    """
+    loaded = []
+    for name in names:
+        module = _registry.get(name)
+        if module is None:
+            continue
+        try:
+            module._load()
+            loaded.append(name)
+        except ImportError as e:
+            print(f"Warning: preload of {name} failed: {e}")
+    return loaded
+
+
+def loaded_modules():
+    """Имена ленивых модулей, которые уже были импортированы в этом процессе"""
+    return sorted(name for name, module in _registry.items() if module.loaded)
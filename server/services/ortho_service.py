@@ -5,15 +5,15 @@ import uuid
 import threading
 import json
 import traceback
-import requests
 from io import BytesIO
-from PIL import Image
-from osgeo import gdal
 from models.ortho import Ortho
+from services.gdal_service import gdal
+from services.lazy_import import lazy_module
 import config  # [NEW] Импортируем конфигурацию для доступа к .env
 
-# Включаем исключения GDAL, чтобы отлавливать ошибки в try/except
-gdal.UseExceptions()
+# GDAL (с UseExceptions и настройками /vsis3/), PIL и requests загружаются при первом использовании
+Image = lazy_module("PIL.Image")
+requests = lazy_module("requests")
 
 class OrthoService:
     def __init__(self, db, ortho_manager, storage_service, gdal_service, task_service):
@@ -30,32 +30,24 @@ class OrthoService:
             try: os.makedirs(self.temp_dir, exist_ok=True)
             except: pass
 
+    def _spawn(self, worker):
+        """Фоновый поток обработки; взятое им соединение из пула PostgreSQL возвращается по завершении"""
+        def run():
+            try:
+                worker()
+            finally:
+                self.db.release()
+        threading.Thread(target=run).start()
+
     def get_all(self):
-        orthos = self.manager.get_all_orthos()
-        results = []
-        for o in orthos:
-            b = None
-            if o.bounds:
-                try: b = json.loads(o.bounds)
-                except: pass 
-            
-            crs_val = getattr(o, 'crs', None)
-            if not crs_val and o.filename and "_3857" in o.filename:
-                crs_val = "EPSG:3857"
-
-            results.append({
-                "id": o.id,
-                "filename": o.filename,
-                "url": f"/api/orthophotos/{o.id}/download",
-                "preview_url": f"/api/orthophotos/{o.id}/preview" if getattr(o, 'preview_filename', None) else None,
-                "bounds": b if b else {"north": 0, "south": 0, "east": 0, "west": 0},
-                "wgs84_bounds": getattr(o, 'wgs84_bounds', None),
-                "crs": crs_val,
-                "is_visible": getattr(o, 'is_visible', False),
-                "is_cog": getattr(o, 'is_cog', False),
-                "upload_date": str(o.upload_date) if hasattr(o, 'upload_date') else None
-            })
-        return results
+        return json.loads(self.list_json(paginate=False))
+
+    def list_json(self, after_id=None, limit=None, fields=None, paginate=True):
+        """Список ортофотопланов JSON-текстом: строки, URL и bounds собирает PostgreSQL (OrthoManager.list_orthos_json)"""
+        return self.manager.list_orthos_json(after_id=after_id, limit=limit, fields=fields, paginate=paginate)
+
+    def get_summary(self):
+        return self.manager.get_summary()
 
     def _create_progress_callback(self, task_id, message="Обработка..."):
         """Создает функцию обратного вызова для нативного GDAL с честными процентами"""
@@ -72,8 +64,27 @@ class OrthoService:
             return 1 # 1 означает "продолжать работу"
         return progress_callback
 
-    def start_upload_process(self, temp_file_path, filename):
-        """Асинхронная обработка свежезагруженного файла"""
+    def _resolve_source(self, filename, local_path, task_id, random_access=False):
+        """
+        Возвращает путь, по которому GDAL будет читать исходник.
+        По умолчанию файл читается потоком из MinIO (/vsis3/); полное скачивание
+        во TEMP_FOLDER выполняется, только если потоковое чтение невыгодно.
+        """
+        stream_path = self.storage.get_stream_path(filename)
+        if stream_path and not self.gdal.needs_local_copy(stream_path, random_access=random_access):
+            self.tasks.save_state(task_id, {"status": "processing", "progress": 2, "message": "Потоковое чтение из S3..."})
+            return stream_path
+
+        self.tasks.save_state(task_id, {"status": "processing", "progress": 2, "message": "Скачивание из S3..."})
+        self.storage.download_file(filename, local_path)
+        return local_path
+
+    def start_upload_process(self, temp_file_path, filename, already_stored=False):
+        """
+        Асинхронная обработка свежезагруженного файла.
+        already_stored=True — файл уже лежит в MinIO (chunked upload): читаем его оттуда
+        и пропускаем повторную загрузку в хранилище.
+        """
         task_id = str(uuid.uuid4())
         self.tasks.save_state(task_id, {"status": "pending", "progress": 0, "message": "В очереди..."})
 
@@ -81,14 +92,19 @@ class OrthoService:
             logs = []
             preview_path = None
             try:
+                source_path = temp_file_path
+                if already_stored:
+                    source_path = self._resolve_source(filename, temp_file_path, task_id)
+
                 self.tasks.save_state(task_id, {"status": "processing", "progress": 10, "message": "Сбор метаданных..."})
                 logs.append(f"Начало фоновой обработки: {filename}")
                 
-                # 1. Сбор метаданных
-                bounds = self.gdal.get_bounds(temp_file_path)
-                crs = self.gdal.get_crs(temp_file_path)
-                is_cog = self.gdal.check_is_cog(temp_file_path)
-                footprint_wkt = self.gdal.get_footprint_wkt(temp_file_path)
+                # 1. Сбор метаданных (одно открытие файла)
+                info = self.gdal.inspect(source_path)
+                bounds = info["bounds"]
+                crs = info["crs"]
+                is_cog = info["is_cog"]
+                footprint_wkt = info["footprint_wkt"]
                 logs.append(f"Границы: {bounds}, CRS: {crs}, COG: {is_cog}")
 
                 # 2. Генерация миниатюры
@@ -105,8 +121,10 @@ class OrthoService:
                         height=0, # Вычислить пропорционально
                         resampleAlg="nearest"
                     )
-                    ds = gdal.Translate(preview_path, temp_file_path, options=translate_options)
+                    src_ds = self.gdal.open_for_preview(source_path, target_width=400)
+                    ds = gdal.Translate(preview_path, src_ds, options=translate_options)
                     ds = None # Закрываем датасет, чтобы сбросить буфер на диск
+                    src_ds = None
                     has_preview = True
                     logs.append("Миниатюра успешно сгенерирована.")
                 except Exception as e:
@@ -114,8 +132,9 @@ class OrthoService:
 
                 # 3. Загрузка в MinIO
                 self.tasks.save_state(task_id, {"status": "processing", "progress": 70, "message": "Отправка в хранилище..."})
-                self.storage.upload_file(filename, temp_file_path)
-                logs.append("Основной файл загружен в MinIO")
+                if not already_stored:
+                    self.storage.upload_file(filename, temp_file_path)
+                    logs.append("Основной файл загружен в MinIO")
                 
                 if has_preview:
                     self.storage.upload_file(preview_filename, preview_path)
@@ -155,10 +174,21 @@ class OrthoService:
                     try: os.remove(preview_path)
                     except: pass
 
-        threading.Thread(target=worker).start()
+        self._spawn(worker)
         return task_id
 
-    def start_cog_process(self, ortho_id):
+    def _cog_options(self, source_path, profile, blocksize, overview_resampling):
+        """Выбирает профиль сжатия по метаданным исходника и собирает опции COG"""
+        info = self.gdal.inspect(source_path)
+        resolved = self.gdal.resolve_cog_profile(profile, info)
+        options = self.gdal.cog_creation_options(resolved, blocksize, overview_resampling)
+        return resolved, options
+
+    def start_stored_upload_process(self, filename):
+        """Обработка файла, собранного в MinIO из частей (без промежуточного диска)"""
+        return self.start_upload_process(os.path.join(self.temp_dir, filename), filename, already_stored=True)
+
+    def start_cog_process(self, ortho_id, profile=None, blocksize=None, overview_resampling=None):
         """Оптимизация файла в Cloud Optimized GeoTIFF (COG)"""
         ortho = self.manager.get_ortho_by_id(ortho_id)
         if not ortho: return None
@@ -170,8 +200,7 @@ class OrthoService:
             local_path = os.path.join(self.temp_dir, ortho.filename)
             cog_path = None
             try:
-                self.tasks.save_state(task_id, {"status": "processing", "progress": 2, "message": "Скачивание из S3..."})
-                self.storage.download_file(ortho.filename, local_path)
+                source_path = self._resolve_source(ortho.filename, local_path, task_id)
 
                 name_part, ext = os.path.splitext(ortho.filename)
                 new_filename = f"{name_part}_v2.tif" if "_cog" in name_part else f"{name_part}_cog.tif"
@@ -179,29 +208,25 @@ class OrthoService:
 
                 # Нативный GDAL с коллбэком прогресса
                 cb = self._create_progress_callback(task_id, message="Конвертация в COG...")
+                cog_profile, creation_options = self._cog_options(source_path, profile, blocksize, overview_resampling)
                 
                 translate_options = gdal.TranslateOptions(
                     format="COG",
-                    creationOptions=[
-                        "BIGTIFF=IF_NEEDED",
-                        "COMPRESS=NONE",
-                        "NUM_THREADS=ALL_CPUS",
-                        "SPARSE_OK=TRUE",
-                        "OVERVIEWS=IGNORE_EXISTING"
-                    ],
+                    creationOptions=creation_options,
                     callback=cb
                 )
 
-                ds = gdal.Translate(cog_path, local_path, options=translate_options)
+                ds = gdal.Translate(cog_path, source_path, options=translate_options)
                 ds = None # Завершаем запись файла
                 
                 self.tasks.save_state(task_id, {"status": "processing", "progress": 95, "message": "Сохранение метаданных..."})
                 
                 # Обновляем метаданные и загружаем результат
-                bounds = self.gdal.get_bounds(cog_path)
-                crs = self.gdal.get_crs(cog_path)
-                is_cog = self.gdal.check_is_cog(cog_path)
-                geom_wkt = self.gdal.get_footprint_wkt(cog_path)
+                info = self.gdal.inspect(cog_path)
+                bounds = info["bounds"]
+                crs = info["crs"]
+                is_cog = info["is_cog"]
+                geom_wkt = info["footprint_wkt"]
 
                 self.storage.upload_file(new_filename, cog_path)
 
@@ -213,11 +238,12 @@ class OrthoService:
                     is_visible=False,
                     is_cog=is_cog,          
                     geometry_wkt=geom_wkt,
-                    preview_filename=getattr(ortho, 'preview_filename', None)
+                    preview_filename=getattr(ortho, 'preview_filename', None),
+                    cog_profile=cog_profile
                 )
                 self.manager.insert_ortho(new_ortho)
 
-                self.tasks.save_state(task_id, {"status": "success", "progress": 100, "message": "Оптимизация завершена!"})
+                self.tasks.save_state(task_id, {"status": "success", "progress": 100, "message": f"Оптимизация завершена! (профиль: {cog_profile})"})
             except Exception as e:
                 traceback.print_exc()
                 self.tasks.save_state(task_id, {"status": "error", "error": str(e)})
@@ -229,10 +255,10 @@ class OrthoService:
                     try: os.remove(cog_path)
                     except: pass
 
-        threading.Thread(target=worker).start()
+        self._spawn(worker)
         return task_id
 
-    def start_reproject_process(self, ortho_id):
+    def start_reproject_process(self, ortho_id, profile=None, blocksize=None, overview_resampling=None):
         """Перепроецирование в Web Mercator (EPSG:3857) с сохранением COG"""
         ortho = self.manager.get_ortho_by_id(ortho_id)
         if not ortho: return None
@@ -244,8 +270,8 @@ class OrthoService:
             local_path = os.path.join(self.temp_dir, ortho.filename)
             output_path = None
             try:
-                self.tasks.save_state(task_id, {"status": "processing", "progress": 2, "message": "Скачивание из S3..."})
-                self.storage.download_file(ortho.filename, local_path)
+                # Warp читает блоки вразнобой — для полосовых файлов скачиваем целиком
+                source_path = self._resolve_source(ortho.filename, local_path, task_id, random_access=True)
                 
                 name_part, ext = os.path.splitext(ortho.filename)
                 clean_name = name_part.replace("_cog", "").replace("_3857", "")
@@ -254,29 +280,26 @@ class OrthoService:
 
                 # Нативный GDAL Warp с коллбэком прогресса
                 cb = self._create_progress_callback(task_id, message="Перепроецирование в 3857...")
+                cog_profile, creation_options = self._cog_options(source_path, profile, blocksize, overview_resampling)
 
                 warp_options = gdal.WarpOptions(
                     dstSRS="EPSG:3857",
                     resampleAlg="cubic",
                     format="COG",
-                    creationOptions=[
-                        "BIGTIFF=IF_NEEDED",
-                        "COMPRESS=NONE",
-                        "NUM_THREADS=ALL_CPUS",
-                        "SPARSE_OK=TRUE"
-                    ],
+                    creationOptions=creation_options,
                     callback=cb
                 )
 
-                ds = gdal.Warp(output_path, local_path, options=warp_options)
+                ds = gdal.Warp(output_path, source_path, options=warp_options)
                 ds = None # Завершаем запись
                 
                 self.tasks.save_state(task_id, {"status": "processing", "progress": 95, "message": "Сохранение метаданных..."})
 
                 # Забираем новые метаданные
-                new_bounds = self.gdal.get_bounds(output_path)
-                is_cog = self.gdal.check_is_cog(output_path)
-                geom_wkt = self.gdal.get_footprint_wkt(output_path)
+                info = self.gdal.inspect(output_path)
+                new_bounds = info["bounds"]
+                is_cog = info["is_cog"]
+                geom_wkt = info["footprint_wkt"]
 
                 self.storage.upload_file(new_filename, output_path)
 
@@ -288,7 +311,8 @@ class OrthoService:
                     is_visible=False,
                     is_cog=is_cog,         
                     geometry_wkt=geom_wkt,
-                    preview_filename=getattr(ortho, 'preview_filename', None)
+                    preview_filename=getattr(ortho, 'preview_filename', None),
+                    cog_profile=cog_profile
                 )
                 self.manager.insert_ortho(new_ortho)
 
@@ -304,7 +328,7 @@ class OrthoService:
                     try: os.remove(output_path)
                     except: pass
 
-        threading.Thread(target=worker).start()
+        self._spawn(worker)
         return task_id
 
     def start_preview_process(self, ortho_id):
@@ -319,8 +343,7 @@ class OrthoService:
             local_path = os.path.join(self.temp_dir, ortho.filename)
             preview_path = None
             try:
-                self.tasks.save_state(task_id, {"status": "processing", "progress": 10, "message": "Скачивание исходника..."})
-                self.storage.download_file(ortho.filename, local_path)
+                source_path = self._resolve_source(ortho.filename, local_path, task_id)
                 
                 name_part, ext = os.path.splitext(ortho.filename)
                 preview_filename = f"{name_part}_preview.png"
@@ -336,8 +359,11 @@ class OrthoService:
                     callback=cb
                 )
                 
-                ds = gdal.Translate(preview_path, local_path, options=translate_options)
+                # Открываем подходящий уровень overview: читаем только маленькую часть пирамиды
+                src_ds = self.gdal.open_for_preview(source_path, target_width=400)
+                ds = gdal.Translate(preview_path, src_ds, options=translate_options)
                 ds = None
+                src_ds = None
 
                 self.tasks.save_state(task_id, {"status": "processing", "progress": 90, "message": "Загрузка превью в хранилище..."})
                 self.storage.upload_file(preview_filename, preview_path)
@@ -356,7 +382,7 @@ class OrthoService:
                     try: os.remove(preview_path)
                     except: pass
 
-        threading.Thread(target=worker).start()
+        self._spawn(worker)
         return task_id
 
     def proxy_tile(self, ortho_id, z, x, y):
@@ -0,0 +1,150 @@
+# server/services/pano_manifest.py
+import csv
+import io
+import json
+from datetime import datetime
+
+MANIFEST_FORMATS = ("csv", "geojson", "jsonl")
+
+# Допустимые имена колонок/свойств -> поле записи
+_ALIASES = {
+    "filename": "filename", "file": "filename", "name": "filename",
+    "path": "path",
+    "directory": "directory", "dir": "directory",
+    "latitude": "latitude", "lat": "latitude",
+    "longitude": "longitude", "lon": "longitude", "lng": "longitude",
+    "altitude": "altitude", "alt": "altitude",
+    "direction": "direction", "heading": "direction",
+    "rotation": "rotation", "roll": "rotation",
+    "timestamp": "timestamp", "datetime": "timestamp", "date": "timestamp", "upload_date": "timestamp",
+    "session": "session", "capture": "session", "sequence": "session",
+}
+
+# Сколько ошибок разбора возвращаем клиенту
+MAX_REPORTED_ERRORS = 50
+
+
+class ManifestError(Exception):
+    """Манифест нельзя прочитать целиком (неизвестный формат, битый JSON) -> HTTP 400"""
+    pass
+
+
+def guess_format(filename="", content_type=""):
+    name = (filename or "").lower()
+    content_type = (content_type or "").lower()
+    if name.endswith((".geojson", ".json")) or "geo+json" in content_type:
+        return "geojson"
+    if name.endswith((".jsonl", ".ndjson")) or "ndjson" in content_type or "jsonl" in content_type:
+        return "jsonl"
+    return "csv"
+
+
+def _parse_timestamp(value):
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value)
+    value = str(value).strip()
+    for fmt in ("%Y:%m:%d %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y%m%d_%H%M%S"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _optional_float(value):
+    return None if value in (None, "") else float(value)
+
+
+class PanoManifestReader:
+    """
+    Потоково читает манифест панорам (CSV, GeoJSON, JSON lines) и выдает нормализованные записи
+    для PanoManager.bulk_upsert. Некорректные строки пропускаются и попадают в errors.
+    """
+    def __init__(self, stream, fmt, default_directory=None, bucket_name=None):
+        if fmt not in MANIFEST_FORMATS:
+            raise ManifestError(f"Неизвестный формат манифеста: {fmt}. Допустимо: {', '.join(MANIFEST_FORMATS)}")
+        self.stream = stream
+        self.fmt = fmt
+        self.default_directory = default_directory
+        self.bucket_name = bucket_name
+        self.invalid = 0
+        self.errors = []
+
+    def __iter__(self):
+        for line_no, raw in self._raw_records():
+            try:
+                yield self._normalize(raw)
+            except (TypeError, ValueError, KeyError, AttributeError, IndexError) as e:
+                self.invalid += 1
+                if len(self.errors) < MAX_REPORTED_ERRORS:
+                    self.errors.append(f"#{line_no}: {e}")
+
+    def _raw_records(self):
+        if self.fmt == "csv":
+            text = io.TextIOWrapper(self.stream, encoding="utf-8-sig", newline="")
+            for line_no, row in enumerate(csv.DictReader(text), start=2):
+                yield line_no, row
+        elif self.fmt == "jsonl":
+            for line_no, line in enumerate(self.stream, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    yield line_no, e
+        else:
+            try:
+                data = json.load(self.stream)
+            except ValueError as e:
+                raise ManifestError(f"Некорректный GeoJSON: {e}")
+            features = data.get("features", []) if isinstance(data, dict) else data
+            for index, feature in enumerate(features, start=1):
+                # Разбор feature — в _normalize: битая запись не должна прерывать весь импорт
+                yield index, feature
+
+    @staticmethod
+    def _from_feature(feature):
+        props = dict(feature.get("properties") or {})
+        geometry = feature.get("geometry") or {}
+        if geometry.get("type") == "Point":
+            coords = geometry.get("coordinates") or []
+            props["longitude"] = coords[0]
+            props["latitude"] = coords[1]
+            if len(coords) > 2 and props.get("altitude") in (None, ""):
+                props["altitude"] = coords[2]
+        return props
+
+    def _normalize(self, raw):
+        if isinstance(raw, Exception):
+            raise ValueError(str(raw))
+        if self.fmt == "geojson":
+            raw = self._from_feature(raw)
+        record = {}
+        for key, value in raw.items():
+            field = _ALIASES.get(str(key).strip().lower())
+            if field:
+                record[field] = value
+
+        filename = str(record.get("filename") or "").strip()
+        if not filename:
+            raise ValueError("нет filename")
+        lat = float(record["latitude"])
+        lon = float(record["longitude"])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"координаты вне диапазона: {lat}, {lon}")
+
+        return {
+            "filename": filename,
+            "path": record.get("path") or (f"{self.bucket_name}/{filename}" if self.bucket_name else filename),
+            "directory": record.get("directory") or self.default_directory,
+            "latitude": lat,
+            "longitude": lon,
+            "altitude": _optional_float(record.get("altitude")),
+            "direction": _optional_float(record.get("direction")),
+            "rotation": int(float(record.get("rotation") or 0)),
+            "timestamp": _parse_timestamp(record.get("timestamp")),
+            "session": str(record.get("session") or "").strip() or None,
+        }
@@ -0,0 +1,254 @@
+# server/services/pano_tile_service.py
+import io
+import json
+import math
+import os
+import tempfile
+import threading
+from services.lazy_import import lazy_module
+import config
+
+# numpy и PIL нужны только при построении пирамиды — загружаем при первой генерации
+np = lazy_module("numpy")
+Image = lazy_module("PIL.Image")
+
+# Порядок граней куба как в Marzipano (CubeGeometry / cubeMapPreviewFaceOrder "bdflru")
+CUBE_FACES = ("b", "d", "f", "l", "r", "u")
+
+# Сколько строк грани проецируем за один проход (ограничивает пиковую память numpy)
+_STRIP_ROWS = 256
+
+# Одновременно строим не больше PANO_TILE_WORKERS пирамид на процесс
+_generate_slots = threading.BoundedSemaphore(max(1, getattr(config, "PANO_TILE_WORKERS", 2)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _cpu_pool():
+    """
+    Пул настоящих потоков gevent для проекции граней и кодирования JPEG, если воркер работает
+    под gevent (monkey-patch), иначе None. В гринлете numpy/PIL остановили бы все запросы воркера
+    на секунды; в потоке пула они отпускают GIL, а цикл событий продолжает работать.
+    """
+    global _pool
+    try:
+        from gevent import monkey
+    except ImportError:
+        return None
+    if not monkey.is_module_patched("threading"):
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from gevent.threadpool import ThreadPool
+                # Создается лениво — уже в процессе воркера, после fork
+                _pool = ThreadPool(max(1, getattr(config, "PANO_TILE_WORKERS", 2)))
+    return _pool
+
+
+def _run_cpu(func, *args):
+    pool = _cpu_pool()
+    if pool is None:
+        return func(*args)
+    return pool.apply(func, args)
+
+
+def _face_vectors(face, a, b):
+    """
+    Направления лучей для точек грани. a — вправо, b — вниз, оба в [-1, 1].
+    Система координат: x вправо, y вверх, z вперёд (yaw 0 = центр эквиректангулярного кадра).
+    """
+    one = np.ones_like(a)
+    if face == "f": return a, -b, one
+    if face == "b": return -a, -b, -one
+    if face == "r": return one, -b, -a
+    if face == "l": return -one, -b, a
+    if face == "u": return a, one, b
+    if face == "d": return a, -one, -b
+    raise ValueError(f"Неизвестная грань: {face}")
+
+
+def _project_face(equirect, face, size):
+    """Строит одну грань куба size x size из эквиректангулярного массива (H, W, 3) билинейной интерполяцией"""
+    height, width = equirect.shape[:2]
+    coords = (np.arange(size, dtype=np.float32) + 0.5) * (2.0 / size) - 1.0
+    out = np.empty((size, size, 3), dtype=np.uint8)
+
+    for row in range(0, size, _STRIP_ROWS):
+        rows = coords[row:row + _STRIP_ROWS]
+        a, b = np.meshgrid(coords, rows)
+        x, y, z = _face_vectors(face, a, b)
+
+        yaw = np.arctan2(x, z)
+        pitch = np.arctan2(y, np.hypot(x, z))
+        u = (yaw / (2 * math.pi) + 0.5) * width - 0.5
+        v = (0.5 - pitch / math.pi) * height - 0.5
+
+        x0 = np.floor(u)
+        y0 = np.floor(v)
+        fx = (u - x0)[..., None]
+        fy = (v - y0)[..., None]
+        # По долготе кадр замкнут, по широте — прижимаем к краю
+        x0 = x0.astype(np.int64) % width
+        x1 = (x0 + 1) % width
+        y0 = np.clip(y0.astype(np.int64), 0, height - 1)
+        y1 = np.clip(y0 + 1, 0, height - 1)
+
+        top = equirect[y0, x0] * (1 - fx) + equirect[y0, x1] * fx
+        bottom = equirect[y1, x0] * (1 - fx) + equirect[y1, x1] * fx
+        out[row:row + len(rows)] = np.clip(top * (1 - fy) + bottom * fy + 0.5, 0, 255).astype(np.uint8)
+
+    return Image.fromarray(out, "RGB")
+
+
+class PanoTileService:
+    """
+    Многоуровневая пирамида кубических граней для панорам (формат Marzipano CubeGeometry).
+
+    В MinIO рядом с оригиналом (в том же бакете) кладётся:
+      tiles/<id>/<level>/<face>/<x>_<y>.jpg — тайлы уровней 1..N (level 1 — грань 512 px)
+      tiles/<id>/preview.jpg                — полоса 6 граней по PANO_PREVIEW_FACE_SIZE (уровень 0, первая отрисовка)
+      tiles/<id>/meta.json                  — описание уровней для просмотрщика
+    """
+    def __init__(self, storage, bucket_name):
+        self.storage = storage
+        self.bucket_name = bucket_name
+        self.tile_size = getattr(config, "PANO_TILE_SIZE", 512)
+        self.quality = getattr(config, "PANO_TILE_QUALITY", 85)
+        self.preview_face_size = getattr(config, "PANO_PREVIEW_FACE_SIZE", 256)
+
+    # --- Ключи объектов ---
+
+    @staticmethod
+    def tile_prefix(pano_id):
+        return f"tiles/{int(pano_id)}/"
+
+    def tile_key(self, pano_id, level, face, x, y):
+        return f"{self.tile_prefix(pano_id)}{int(level)}/{face}/{int(x)}_{int(y)}.jpg"
+
+    def preview_key(self, pano_id):
+        return f"{self.tile_prefix(pano_id)}preview.jpg"
+
+    def meta_key(self, pano_id):
+        return f"{self.tile_prefix(pano_id)}meta.json"
+
+    # --- Построение пирамиды ---
+
+    def level_sizes(self, width):
+        """
+        Размеры граней по уровням: tile_size, 2*tile_size, ... пока не превышен width/pi
+        (на экваторе грань такого размера сохраняет разрешение оригинала).
+        """
+        target = width / math.pi
+        sizes = [self.tile_size]
+        while sizes[-1] * 2 <= target:
+            sizes.append(sizes[-1] * 2)
+        return sizes
+
+    def _encode_jpeg(self, image):
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=self.quality, optimize=True, progressive=False)
+        buf.seek(0)
+        return buf
+
+    def _put_jpeg(self, buf, key):
+        self.storage.save_file(buf, key, content_type="image/jpeg", bucket_name=self.bucket_name)
+
+    # CPU-часть (выполняется в потоке пула): ничего не пишет в MinIO и БД
+
+    def _decode(self, path):
+        with Image.open(path) as img:
+            sizes = self.level_sizes(img.width)
+            # JPEG можно декодировать сразу в уменьшенном масштабе (DCT scaling) — экономит время и память
+            needed_width = int(sizes[-1] * math.pi) + 1
+            img.draft("RGB", (needed_width, needed_width // 2))
+            return np.asarray(img.convert("RGB")), sizes
+
+    def _render_face(self, equirect, face, sizes):
+        """Тайлы одной грани по всем уровням [(level, x, y, jpeg)] и ее уменьшенная копия для превью"""
+        full = _project_face(equirect, face, sizes[-1])
+        tiles = []
+        for level, size in enumerate(sizes, start=1):
+            face_img = full if size == sizes[-1] else full.resize((size, size), Image.LANCZOS)
+            for y in range(0, size, self.tile_size):
+                for x in range(0, size, self.tile_size):
+                    tile = face_img.crop((x, y, min(x + self.tile_size, size), min(y + self.tile_size, size)))
+                    tiles.append((level, x // self.tile_size, y // self.tile_size, self._encode_jpeg(tile)))
+        p = self.preview_face_size
+        return tiles, full.resize((p, p), Image.LANCZOS)
+
+    def _render_preview(self, thumbs):
+        # Превью: вертикальная полоса граней в порядке CUBE_FACES
+        p = self.preview_face_size
+        preview = Image.new("RGB", (p, p * len(CUBE_FACES)))
+        for i, face in enumerate(CUBE_FACES):
+            preview.paste(thumbs[face], (0, i * p))
+        return self._encode_jpeg(preview)
+
+    def generate(self, pano_id, filename):
+        """
+        Скачивает оригинал во временный файл, строит грани, тайлы и превью, загружает в MinIO.
+        Проекция и кодирование идут в пуле потоков по одной грани (память — тайлы одной грани),
+        сетевые операции — в вызывающем гринлете.
+        """
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1] or ".jpg",
+                                        dir=getattr(config, "TEMP_FOLDER", None))
+        os.close(fd)
+        try:
+            self.storage.download_file(filename, tmp_path, bucket_name=self.bucket_name)
+            equirect, sizes = _run_cpu(self._decode, tmp_path)
+
+            thumbs = {}
+            for face in CUBE_FACES:
+                tiles, thumbs[face] = _run_cpu(self._render_face, equirect, face, sizes)
+                for level, x, y, buf in tiles:
+                    self._put_jpeg(buf, self.tile_key(pano_id, level, face, x, y))
+            del equirect
+            levels = [{"tileSize": self.tile_size, "size": size} for size in sizes]
+
+            p = self.preview_face_size
+            self._put_jpeg(_run_cpu(self._render_preview, thumbs), self.preview_key(pano_id))
+
+            meta = {
+                "pano_id": int(pano_id),
+                "faces": "".join(CUBE_FACES),
+                "levels": [{"tileSize": p, "size": p, "fallbackOnly": True}] + levels,
+            }
+            self.storage.save_file(io.BytesIO(json.dumps(meta).encode("utf-8")), self.meta_key(pano_id),
+                                   content_type="application/json", bucket_name=self.bucket_name)
+            return meta
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def generate_async(self, pano_id, filename):
+        """
+        Запускает генерацию в фоне; одновременных генераций не больше PANO_TILE_WORKERS.
+        Под gevent поток ниже — гринлет, который только скачивает и загружает файлы,
+        а numpy/PIL выполняются в пуле настоящих потоков (_run_cpu).
+        """
+        if not getattr(config, "PANO_TILES_ENABLED", True):
+            return
+
+        def worker():
+            with _generate_slots:
+                try:
+                    self.generate(pano_id, filename)
+                    print(f"Pano tiles ready: {pano_id}")
+                except Exception as e:
+                    print(f"Pano tiles error ({pano_id}): {e}")
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    # --- Чтение / удаление ---
+
+    def get_meta(self, pano_id):
+        """Описание пирамиды или None, если она ещё не построена"""
+        if self.storage.stat_file(self.meta_key(pano_id), bucket_name=self.bucket_name) is None:
+            return None
+        raw = self.storage.read_head(self.meta_key(pano_id), 64 * 1024, bucket_name=self.bucket_name)
+        return json.loads(raw)
+
+    def delete(self, pano_id):
+        self.storage.delete_prefix(self.tile_prefix(pano_id), bucket_name=self.bucket_name)
@@ -0,0 +1,85 @@
+# server/services/password_service.py
+"""
+Хеширование и проверка паролей (werkzeug.security) вне цикла событий gevent.
+
+scrypt/pbkdf2 — десятки миллисекунд чистого CPU. В воркере gevent такой вызов в гринлете
+останавливает все остальные запросы воркера, поэтому под gevent вычисление уходит
+в пул настоящих потоков (gevent threadpool; hashlib отпускает GIL на время хеширования).
+Без gevent (скрипты, dev-сервер) функции выполняются напрямую.
+
+Алгоритм и стоимость задаются PASSWORD_HASH_METHOD в формате werkzeug:
+    scrypt:32768:8:1 | pbkdf2:sha256:600000 | ...
+Хеши со старыми параметрами пересчитываются при успешном входе (needs_rehash).
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import config
+
+_pool = None
+_pool_lock = threading.Lock()
+_method_prefix = None
+
+
+def _gevent_pool():
+    """Пул потоков gevent, если воркер работает под gevent (monkey-patch), иначе None"""
+    global _pool
+    try:
+        from gevent import monkey
+    except ImportError:
+        return None
+    if not monkey.is_module_patched("threading"):
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from gevent.threadpool import ThreadPool
+                # Создается лениво — уже в процессе воркера, после fork
+                _pool = ThreadPool(max(1, getattr(config, "PASSWORD_HASH_THREADS", 2)))
+    return _pool
+
+
+def _run(func, *args):
+    pool = _gevent_pool()
+    if pool is None:
+        return func(*args)
+    return pool.apply(func, args)
+
+
+def _method() -> str:
+    return getattr(config, "PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
+
+def hash_password(password: str) -> str:
+    """Хеш пароля с текущими PASSWORD_HASH_METHOD"""
+    return _run(generate_password_hash, password, _method())
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+    """Проверка пароля по сохраненному хешу (алгоритм и параметры берутся из самого хеша)"""
+    if not password_hash:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+
+def _current_prefix() -> str:
+    """
+    Параметры текущего метода так, как werkzeug пишет их в хеш ("scrypt:32768:8:1").
+    Короткая запись в конфиге ("scrypt", "pbkdf2") раскрывается самим werkzeug — один раз на процесс.
+    """
+    global _method_prefix
+    if _method_prefix is None:
+        _method_prefix = hash_password("").split("$", 1)[0]
+    return _method_prefix
+
+
+def needs_rehash(password_hash: Optional[str]) -> bool:
+    """True, если хеш создан не текущими PASSWORD_HASH_METHOD (другой алгоритм или стоимость)"""
+    if not password_hash or "$" not in password_hash:
+        return True
+    return password_hash.split("$", 1)[0] != _current_prefix()
@@ -0,0 +1,191 @@
+# server/services/static_assets.py
+import gzip
+import mimetypes
+import os
+import re
+import sys
+from flask import request, Response
+from werkzeug.wsgi import wrap_file
+import config
+
+# Хеш содержимого фиксированной длины в имени файла сборки: CRA — 8 hex (main.3f2a1b9c.js,
+# 787.4a5b6c7d.chunk.js) или 20 hex у медиа (logo.6ce24c58023cc2f8caa4.svg), Vite — 8 символов
+# base64url (index-B2xk9_aQ.js). Такой файл никогда не меняется, его можно кэшировать навсегда
+HASHED_NAME_RE = re.compile(r"(?:\.[0-9a-f]{8}(?:[0-9a-f]{12})?(?:\.chunk)?|-(?=[\w-]{0,7}[0-9A-Z])[\w-]{8})(?:\.\w+)+$")
+
+# Сжатые копии рядом с файлом в порядке предпочтения: имя Content-Encoding -> суффикс
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Что имеет смысл сжимать заранее (precompress)
+_COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                       "image/svg+xml", "application/xml")
+_COMPRESSIBLE_EXTENSIONS = (".js", ".mjs", ".css", ".map", ".json", ".html", ".svg", ".txt", ".xml", ".webmanifest")
+
+
+class StaticAssets:
+    """
+    Отдача статики фронтенда без обращений к файловой системе на каждый запрос.
+
+    При создании один раз обходит папки roots и строит таблицу "путь URL -> файл": размер, mtime, ETag,
+    MIME-тип и готовые сжатые копии (file.js.br, file.js.gz), которые выбираются по Accept-Encoding.
+    Файлы сборки с хешем в имени получают Cache-Control: public, max-age, immutable, остальные
+    (index.html, manifest.json, все файлы public) — no-cache с ревалидацией по ETag.
+
+    roots: [(префикс URL, папка, имена или None[, hashed])] в порядке приоритета; если имена заданы,
+    из папки берутся только эти файлы, иначе — все рекурсивно. hashed=True — папка сборки,
+    где имена с хешем выдает сборщик; в остальных папках имя файла ничего не гарантирует.
+    """
+    def __init__(self, roots):
+        self.roots = [(root[0], str(root[1]), root[2], bool(root[3]) if len(root) > 3 else False)
+                      for root in roots]
+        self.max_age = getattr(config, "STATIC_IMMUTABLE_MAX_AGE", 365 * 24 * 3600)
+        self.auto_reload = getattr(config, "STATIC_AUTO_RELOAD", False)
+        self._table = {}
+        self.reload()
+
+    # --- Таблица файлов ---
+
+    def reload(self):
+        table = {}
+        for prefix, folder, names, hashed in self.roots:
+            if not os.path.isdir(folder):
+                continue
+            for rel, path in self._candidates(folder, names):
+                key = prefix + rel.replace(os.sep, "/")
+                if key in table or not os.path.isfile(path):
+                    continue
+                table[key] = self._entry(path, hashed and bool(HASHED_NAME_RE.search(key)))
+        self._table = table
+        return len(table)
+
+    @staticmethod
+    def _candidates(folder, names):
+        if names:
+            for name in names:
+                yield name, os.path.join(folder, name)
+            return
+        for dirpath, _, filenames in os.walk(folder):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, folder), path
+
+    @staticmethod
+    def _entry(path, immutable):
+        st = os.stat(path)
+        variants = {}
+        for encoding, suffix in ENCODINGS:
+            try:
+                compressed = os.stat(path + suffix)
+            except OSError:
+                continue
+            # Сжатая копия старше оригинала (сборку обновили без precompress) — не отдаем
+            if compressed.st_mtime >= st.st_mtime:
+                variants[encoding] = (path + suffix, compressed.st_size)
+        return {
+            "path": path,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "etag": f"{int(st.st_mtime * 1000):x}-{st.st_size:x}",
+            "mimetype": mimetypes.guess_type(path)[0] or "application/octet-stream",
+            "immutable": immutable,
+            "variants": variants,
+        }
+
+    def lookup(self, key):
+        entry = self._table.get(key)
+        if entry is None and self.auto_reload:
+            self.reload()
+            entry = self._table.get(key)
+        return entry
+
+    def __len__(self):
+        return len(self._table)
+
+    # --- Ответ ---
+
+    @staticmethod
+    def _negotiate(entry):
+        """Лучшее из доступных сжатий по Accept-Encoding (при равном q — br) или None"""
+        accept = request.accept_encodings
+        best = None
+        for encoding, _ in ENCODINGS:
+            if encoding in entry["variants"] and accept[encoding] > 0:
+                if best is None or accept[encoding] > accept[best]:
+                    best = encoding
+        return best
+
+    def send(self, key, retry=True):
+        """Response для файла key или None, если такого файла нет"""
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+        encoding = self._negotiate(entry) if entry["variants"] else None
+        path, size = entry["variants"][encoding] if encoding else (entry["path"], entry["size"])
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # Сборку заменили после старта: перечитываем таблицу один раз
+            if not retry:
+                return None
+            self.reload()
+            return self.send(key, retry=False)
+
+        # direct_passthrough: flask-compress не сжимает ответ повторно
+        response = Response(wrap_file(request.environ, f), mimetype=entry["mimetype"], direct_passthrough=True)
+        response.content_length = size
+        response.last_modified = entry["mtime"]
+        response.set_etag(f"{entry['etag']}-{encoding}" if encoding else entry["etag"])
+        if encoding:
+            response.content_encoding = encoding
+        if entry["variants"]:
+            response.vary.add("Accept-Encoding")
+        if entry["immutable"]:
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+
+def _compressible(path):
+    if path.endswith(_COMPRESSIBLE_EXTENSIONS):
+        return True
+    mimetype = mimetypes.guess_type(path)[0] or ""
+    return mimetype.startswith(_COMPRESSIBLE_TYPES)
+
+
+def precompress(root, min_size=512):
+    """
+    Пишет рядом с текстовыми файлами сборки file.gz (gzip -9) и file.br (brotli q11, если установлен).
+    Копия сохраняется, только если она меньше оригинала. Возвращает число записанных файлов.
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print("Warning: brotli is not installed, only .gz files will be written")
+
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if name.endswith((".gz", ".br")) or not _compressible(path) or os.path.getsize(path) < min_size:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            outputs = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli:
+                outputs[".br"] = brotli.compress(data, quality=11)
+            for suffix, compressed in outputs.items():
+                if len(compressed) < len(data):
+                    with open(path + suffix, "wb") as f:
+                        f.write(compressed)
+                    written += 1
+    return written
+
+
+if __name__ == "__main__":
+    # Сборка образа: PYTHONPATH=server python -m services.static_assets public/build
+    for folder in sys.argv[1:] or ["."]:
+        print(f"{folder}: {precompress(folder)} compressed files written")
@@ -1,19 +1,20 @@
 # server/services/storage_service.py
 import json
 import os
+from minio.datatypes import Part
 from storage import LocalStorage, MinioStorage
 import config
 
 class StorageService:
     def __init__(self):
         self.local = LocalStorage(config.ORTHO_FOLDER)
-        self.minio = MinioStorage()
         # [NEW] Подтягиваем имя бакета из конфигурации (.env)
         self.bucket_name = getattr(config, 'MINIO_ORTHO_BUCKET', 'orthophotos')
-        self._ensure_bucket()
+        # Общий пул соединений MinIO; бакет ортофото — умолчание этого экземпляра
+        self.minio = MinioStorage(bucket_name=self.bucket_name)
 
-    def _ensure_bucket(self):
-        """Проверка и создание бакета при инициализации"""
+    def ensure_bucket(self):
+        """Проверка и создание бакета с политикой Public Read (bootstrap.py, один раз при развертывании)"""
         if self.minio.client:
             try:
                 # Используем динамическое имя бакета
@@ -56,18 +57,71 @@ class StorageService:
             return True
         return False
 
+    def get_stream_path(self, filename):
+        """
+        Путь для потокового чтения GDAL напрямую из MinIO (/vsis3/).
+        Возвращает None, если режим отключен или MinIO недоступен.
+        """
+        if not getattr(config, "GDAL_VSIS3_ENABLED", True) or not self.minio.client:
+            return None
+        return f"/vsis3/{self.bucket_name}/{filename}"
+
+    # --- Multipart upload (возобновляемые загрузки) ---
+
+    def create_multipart_upload(self, filename, content_type="image/tiff"):
+        """Открывает S3 multipart upload в бакете ортофотопланов, возвращает upload_id"""
+        if not self.minio.client:
+            raise Exception("MinIO client not initialized")
+        return self.minio.client._create_multipart_upload(
+            self.bucket_name, filename, {"Content-Type": content_type}
+        )
+
+    def upload_part(self, filename, upload_id, part_number, data):
+        """Загружает одну часть (bytes), возвращает ETag"""
+        return self.minio.client._upload_part(
+            self.bucket_name, filename, data, None, upload_id, part_number
+        )
+
+    def list_parts(self, filename, upload_id):
+        """Возвращает уже загруженные части: [{part_number, etag, size}]"""
+        parts = []
+        marker = None
+        while True:
+            result = self.minio.client._list_parts(
+                self.bucket_name, filename, upload_id, part_number_marker=marker
+            )
+            for part in result.parts:
+                parts.append({"part_number": part.part_number, "etag": part.etag, "size": part.size})
+            if not result.is_truncated:
+                break
+            marker = result.next_part_number_marker
+        return parts
+
+    def complete_multipart_upload(self, filename, upload_id, parts):
+        """Собирает объект из частей на стороне MinIO"""
+        s3_parts = [Part(p["part_number"], p["etag"]) for p in sorted(parts, key=lambda p: p["part_number"])]
+        self.minio.client._complete_multipart_upload(self.bucket_name, filename, upload_id, s3_parts)
+
+    def abort_multipart_upload(self, filename, upload_id):
+        if self.minio.client:
+            self.minio.client._abort_multipart_upload(self.bucket_name, filename, upload_id)
+
+    # --- Presigned URL: браузер грузит напрямую в MinIO ---
+
+    def presigned_put_url(self, filename):
+        return self.minio.presigned_put_url(filename, bucket_name=self.bucket_name)
+
+    def presigned_part_url(self, filename, upload_id, part_number):
+        return self.minio.presigned_part_url(filename, upload_id, part_number, bucket_name=self.bucket_name)
+
+    def stat_file(self, filename):
+        return self.minio.stat_file(filename, bucket_name=self.bucket_name)
+
     def delete_file(self, filename):
-        """Удаление файла"""
+        """Удаление файла (бакет передается явно — без подмены bucket_name у общего клиента)"""
         if self.minio.client:
             try:
-                # [UPDATED] Переключаем бакет перед удалением (как в send_file), 
-                # чтобы случайно не удалить файл из бакета панорам
-                orig_bucket = self.minio.bucket_name
-                self.minio.bucket_name = self.bucket_name
-                
-                self.minio.delete_file(filename) 
-                
-                self.minio.bucket_name = orig_bucket
+                self.minio.delete_file(filename, bucket_name=self.bucket_name)
             except Exception as e:
                 print(f"MinIO delete warning: {e}")
 
@@ -76,14 +130,8 @@ class StorageService:
         # Сначала пробуем MinIO
         if self.minio.client:
             try:
-                # Временно переключаем бакет базового класса на бакет ортофотопланов
-                orig_bucket = self.minio.bucket_name
-                self.minio.bucket_name = self.bucket_name # [UPDATED]
-                
-                response = self.minio.send_local_file(filename, mimetype=mimetype)
-                
-                self.minio.bucket_name = orig_bucket
-                return response
+                # Поток / 302 на presigned URL / X-Accel-Redirect — в зависимости от DOWNLOAD_MODE
+                return self.minio.serve_file(filename, mimetype=mimetype, bucket_name=self.bucket_name)
             except Exception as e:
                 print(f"MinIO download failed: {e}")
         
@@ -26,6 +26,19 @@ class TaskService:
         except Exception as e:
             print(f"Error saving task {task_id}: {e}")
 
+    def list_ids(self):
+        """Идентификаторы всех сохраненных состояний"""
+        try:
+            return [name[:-5] for name in os.listdir(self.tasks_dir) if name.endswith(".json")]
+        except OSError:
+            return []
+
+    def delete_state(self, task_id):
+        try:
+            os.remove(os.path.join(self.tasks_dir, f"{task_id}.json"))
+        except OSError:
+            pass
+
     def get_state(self, task_id):
         """Читает состояние задачи"""
         filepath = os.path.join(self.tasks_dir, f"{task_id}.json")
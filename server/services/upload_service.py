@@ -0,0 +1,260 @@
+# server/services/upload_service.py
+import os
+import time
+import uuid
+import config
+from services.task_service import TaskService
+
+class UploadError(Exception):
+    """Ошибка протокола загрузки (неверный offset, размер части и т.п.) -> HTTP 4xx"""
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# Лимит S3 на одиночный PUT; файлы крупнее грузятся через multipart
+SINGLE_PUT_MAX = 5 * 1024 * 1024 * 1024
+
+# Как часто (сек) процесс проверяет устаревшие сессии загрузки
+_CLEANUP_INTERVAL = 600
+_last_cleanup = 0.0
+
+class UploadService:
+    """
+    Возобновляемая загрузка больших файлов частями (init -> PUT chunk с offset -> complete).
+    Каждая часть сразу уходит в S3 multipart upload MinIO, на диск сервера ничего не пишется.
+    Список принятых частей хранится в самом MinIO (list_parts), поэтому части можно
+    слать параллельно и дозагружать после обрыва соединения.
+
+    Режим direct: сервер только выдаёт presigned URL, байты идут из браузера прямо в MinIO.
+    """
+    def __init__(self, storage_service, sessions=None):
+        self.storage = storage_service
+        # Состояния сессий храним так же, как состояния задач (атомарные JSON-файлы)
+        self.sessions = sessions or TaskService(getattr(config, "UPLOAD_SESSIONS_FOLDER", "data/uploads"))
+        self.chunk_size = getattr(config, "UPLOAD_CHUNK_SIZE", 16 * 1024 * 1024)
+        self.session_ttl = getattr(config, "UPLOAD_SESSION_TTL", 24 * 3600)
+
+    @staticmethod
+    def _validate(filename, size):
+        filename = os.path.basename(filename or "").strip()
+        if not filename:
+            raise UploadError("Не указано имя файла")
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError("Не указан размер файла")
+        if size <= 0:
+            raise UploadError("Размер файла должен быть больше нуля")
+        return filename, size
+
+    def _free_name(self, filename):
+        """
+        Имя объекта, не занятое в бакете. Имя клиента не должно заменить ортофотоплан,
+        на который уже ссылается строка orthophotos: при совпадении добавляется короткий суффикс.
+        """
+        if self.storage.stat_file(filename) is None:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}_{uuid.uuid4().hex[:8]}{ext}"
+
+    def cleanup_expired(self, force=False):
+        """
+        Удаляет сессии старше UPLOAD_SESSION_TTL (по created_at); у незавершенных
+        multipart-загрузок отменяет S3 upload, чтобы MinIO освободил принятые части.
+        Вызывается попутно при создании загрузок, не чаще раза в _CLEANUP_INTERVAL секунд.
+        """
+        global _last_cleanup
+        now = time.time()
+        if not force and now - _last_cleanup < _CLEANUP_INTERVAL:
+            return 0
+        _last_cleanup = now
+
+        removed = 0
+        for upload_id in self.sessions.list_ids():
+            session = self.sessions.get_state(upload_id)
+            if session and now - session.get("created_at", 0) < self.session_ttl:
+                continue
+            if session and session.get("status") == "uploading" and session.get("mode", "multipart") == "multipart":
+                try:
+                    self.storage.abort_multipart_upload(session["filename"], session["s3_upload_id"])
+                except Exception as e:
+                    print(f"Upload cleanup: abort {upload_id} failed: {e}")
+            self.sessions.delete_state(upload_id)
+            removed += 1
+        if removed:
+            print(f"Upload cleanup: removed {removed} expired sessions")
+        return removed
+
+    def init_upload(self, filename, size, content_type="image/tiff", direct=False):
+        filename, size = self._validate(filename, size)
+        self.cleanup_expired()
+        filename = self._free_name(filename)
+
+        if (size + self.chunk_size - 1) // self.chunk_size > 10000:
+            # Ограничение S3: не более 10 000 частей в одном multipart upload
+            raise UploadError("Файл слишком большой для текущего UPLOAD_CHUNK_SIZE")
+
+        s3_upload_id = self.storage.create_multipart_upload(filename, content_type=content_type)
+        upload_id = str(uuid.uuid4())
+        session = {
+            "upload_id": upload_id,
+            "s3_upload_id": s3_upload_id,
+            "filename": filename,
+            "size": size,
+            "chunk_size": self.chunk_size,
+            "total_parts": (size + self.chunk_size - 1) // self.chunk_size,
+            "mode": "multipart",
+            "direct": direct,
+            "status": "uploading",
+            "created_at": int(time.time()),
+        }
+        self.sessions.save_state(upload_id, session)
+        return self._public(session, [])
+
+    def init_direct_upload(self, filename, size, content_type="image/tiff"):
+        """
+        Начинает загрузку в обход Flask: до 5 ГБ — один presigned PUT,
+        больше — presigned URL на каждую часть multipart upload.
+        """
+        filename, size = self._validate(filename, size)
+        if size > SINGLE_PUT_MAX:
+            return self.init_upload(filename, size, content_type=content_type, direct=True)
+        self.cleanup_expired()
+        filename = self._free_name(filename)
+
+        upload_id = str(uuid.uuid4())
+        session = {
+            "upload_id": upload_id,
+            "filename": filename,
+            "size": size,
+            "chunk_size": size,
+            "total_parts": 1,
+            "mode": "single",
+            "direct": True,
+            "status": "uploading",
+            "created_at": int(time.time()),
+        }
+        self.sessions.save_state(upload_id, session)
+        result = self._public(session, [])
+        result["url"] = self.storage.presigned_put_url(filename)
+        return result
+
+    def get_part_urls(self, upload_id, part_numbers):
+        """Presigned URL для указанных частей multipart upload"""
+        session = self.get_session(upload_id)
+        if session["status"] != "uploading" or session.get("mode", "multipart") != "multipart":
+            raise UploadError("Для этой загрузки URL частей не выдаются", status=409)
+        urls = {}
+        for n in part_numbers:
+            if n < 1 or n > session["total_parts"]:
+                raise UploadError(f"Номер части вне диапазона: {n}")
+            urls[str(n)] = self.storage.presigned_part_url(session["filename"], session["s3_upload_id"], n)
+        return {"upload_id": upload_id, "chunk_size": session["chunk_size"], "urls": urls}
+
+    def get_session(self, upload_id):
+        session = self.sessions.get_state(upload_id)
+        if not session:
+            raise UploadError("Загрузка не найдена", status=404)
+        return session
+
+    def get_status(self, upload_id):
+        session = self.get_session(upload_id)
+        parts = []
+        if session["status"] == "uploading" and session.get("mode", "multipart") == "multipart":
+            parts = self.storage.list_parts(session["filename"], session["s3_upload_id"])
+        return self._public(session, parts)
+
+    def put_chunk(self, upload_id, offset, data):
+        """Принимает часть, начинающуюся с offset. Повторная отправка той же части безопасна."""
+        session = self.get_session(upload_id)
+        if session["status"] != "uploading":
+            raise UploadError("Загрузка уже завершена или отменена", status=409)
+        if session.get("mode", "multipart") != "multipart":
+            raise UploadError("Файл загружается напрямую по presigned URL", status=409)
+
+        chunk_size = session["chunk_size"]
+        size = session["size"]
+        try:
+            offset = int(offset)
+        except (TypeError, ValueError):
+            raise UploadError("Не указан offset")
+        if offset < 0 or offset >= size or offset % chunk_size != 0:
+            raise UploadError(f"offset должен быть кратен {chunk_size} и меньше размера файла")
+
+        expected = min(chunk_size, size - offset)
+        if len(data) != expected:
+            raise UploadError(f"Ожидалось {expected} байт, получено {len(data)}")
+
+        part_number = offset // chunk_size + 1
+        etag = self.storage.upload_part(session["filename"], session["s3_upload_id"], part_number, data)
+        return {"upload_id": upload_id, "part_number": part_number, "etag": etag, "offset": offset + len(data)}
+
+    def complete(self, upload_id):
+        """Проверяет, что все части на месте, и собирает объект в MinIO. Возвращает имя файла."""
+        session = self.get_session(upload_id)
+        if session["status"] != "uploading":
+            raise UploadError("Загрузка уже завершена или отменена", status=409)
+
+        if session.get("mode") == "single":
+            stat = self.storage.stat_file(session["filename"])
+            if stat is None:
+                raise UploadError("Файл ещё не загружен в хранилище", status=409)
+            if stat.size != session["size"]:
+                raise UploadError(f"Размер объекта {stat.size} не совпадает с заявленным {session['size']}", status=409)
+            session["status"] = "completed"
+            self.sessions.save_state(upload_id, session)
+            return session["filename"]
+
+        parts = self.storage.list_parts(session["filename"], session["s3_upload_id"])
+        total_parts = session["total_parts"]
+        parts = [p for p in parts if 1 <= p["part_number"] <= total_parts]
+        received = {p["part_number"] for p in parts}
+        missing = [n for n in range(1, total_parts + 1) if n not in received]
+        if missing:
+            raise UploadError(f"Не хватает частей: {missing[:20]}", status=409)
+
+        # В режиме direct байты идут мимо Flask: размеры частей проверяем по list_parts.
+        # Все части, кроме последней, — ровно chunk_size, последняя — остаток файла.
+        chunk_size = session["chunk_size"]
+        last_size = session["size"] - (total_parts - 1) * chunk_size
+        wrong = [p["part_number"] for p in parts
+                 if p["size"] != (last_size if p["part_number"] == total_parts else chunk_size)]
+        if wrong:
+            raise UploadError(f"Неверный размер частей (загрузите их заново): {sorted(wrong)[:20]}", status=409)
+        total = sum(p["size"] for p in parts)
+        if total != session["size"]:
+            raise UploadError(f"Сумма частей {total} не совпадает с заявленным размером {session['size']}", status=409)
+        if self.storage.stat_file(session["filename"]) is not None:
+            # Объект с этим именем появился после init (параллельная загрузка) — не перезаписываем
+            raise UploadError("Файл с таким именем уже загружен, начните загрузку заново", status=409)
+
+        self.storage.complete_multipart_upload(session["filename"], session["s3_upload_id"], parts)
+        session["status"] = "completed"
+        self.sessions.save_state(upload_id, session)
+        return session["filename"]
+
+    def abort(self, upload_id):
+        session = self.get_session(upload_id)
+        if session["status"] == "uploading" and session.get("mode", "multipart") == "multipart":
+            self.storage.abort_multipart_upload(session["filename"], session["s3_upload_id"])
+        session["status"] = "aborted"
+        self.sessions.save_state(upload_id, session)
+
+    @staticmethod
+    def _public(session, parts):
+        received = sorted(p["part_number"] for p in parts)
+        received_set = set(received)
+        # Следующий offset — начало первой недостающей части (для простого последовательного клиента)
+        next_part = next((n for n in range(1, session["total_parts"] + 1) if n not in received_set), None)
+        return {
+            "upload_id": session["upload_id"],
+            "filename": session["filename"],
+            "size": session["size"],
+            "chunk_size": session["chunk_size"],
+            "total_parts": session["total_parts"],
+            "mode": session.get("mode", "multipart"),
+            "direct": session.get("direct", False),
+            "status": session["status"],
+            "received_parts": received,
+            "next_offset": (next_part - 1) * session["chunk_size"] if next_part else session["size"],
+        }
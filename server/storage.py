@@ -1,9 +1,24 @@
 # server/storage.py
 import os
 import io
-from flask import send_file, send_from_directory, jsonify, abort
+import threading
+from datetime import timedelta
+from urllib.parse import quote
+from flask import send_file, send_from_directory, jsonify, abort, request, Response, redirect
+import urllib3
 from minio import Minio
 from minio.error import S3Error
+from minio.deleteobjects import DeleteObject
+import config
+
+def _content_disposition(name):
+    """inline-заголовок с поддержкой не-ASCII имён (RFC 5987), как в flask.send_file"""
+    try:
+        name.encode("latin-1")
+        return f'inline; filename="{name}"'
+    except UnicodeEncodeError:
+        ascii_name = name.encode("ascii", "ignore").decode("ascii") or "file"
+        return f"inline; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(name)}"
 
 # ==========================================
 # 1. LocalStorage (Нужен для OrthoController)
@@ -52,47 +67,119 @@ class LocalStorage:
 
 
 # ==========================================
-# 2. MinioStorage (Нужен для Panoramas)
+# 2. Общий клиент MinIO (один пул соединений на процесс)
+# ==========================================
+_client_lock = threading.Lock()
+_shared_clients = {}
+_http_clients = []
+_ensured_buckets = set()
+
+def _make_http_client(secure):
+    """
+    Один urllib3.PoolManager на процесс: все контроллеры и greenlet'ы берут
+    соединения из общего пула размером MINIO_POOL_MAXSIZE.
+    """
+    kwargs = {
+        "maxsize": getattr(config, "MINIO_POOL_MAXSIZE", 32),
+        "timeout": urllib3.Timeout(connect=10, read=300),
+        "retries": urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    }
+    if secure:
+        import certifi
+        kwargs["cert_reqs"] = "CERT_REQUIRED"
+        kwargs["ca_certs"] = os.environ.get("SSL_CERT_FILE") or certifi.where()
+    http = urllib3.PoolManager(**kwargs)
+    _http_clients.append(http)
+    return http
+
+def reset_after_fork():
+    """
+    Вызывается в воркере сразу после fork (gunicorn post_fork при preload_app).
+    Клиенты MinIO остаются прежними (на них уже ссылаются контроллеры),
+    а сокеты urllib3, унаследованные от мастера, выбрасываются из пулов.
+    """
+    global _client_lock
+    _client_lock = threading.Lock()
+    for http in _http_clients:
+        http.clear()
+
+def get_minio_client(public=False):
+    """
+    Возвращает общий для процесса клиент MinIO (потокобезопасен).
+    public=True — клиент с внешним адресом MinIO, только для подписи presigned URL
+    (подпись включает Host; регион задан явно, поэтому подпись не ходит в сеть).
+    """
+    key = "public" if public else "internal"
+    client = _shared_clients.get(key)
+    if client is not None:
+        return client
+
+    with _client_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            access_key = os.environ.get("MINIO_ACCESS_KEY", "minioadmin")
+            secret_key = os.environ.get("MINIO_SECRET_KEY", "minioadmin")
+            # Для локальной разработки secure=False (http), для продакшена True (https)
+            secure = os.environ.get("MINIO_SECURE", "False").lower() == "true"
+            if public:
+                client = Minio(
+                    getattr(config, "MINIO_PUBLIC_ENDPOINT", os.environ.get("MINIO_ENDPOINT", "minio:9000")),
+                    access_key=access_key,
+                    secret_key=secret_key,
+                    secure=getattr(config, "MINIO_PUBLIC_SECURE", secure),
+                    region=getattr(config, "MINIO_REGION", "us-east-1")
+                )
+            else:
+                client = Minio(
+                    os.environ.get("MINIO_ENDPOINT", "minio:9000"),
+                    access_key=access_key,
+                    secret_key=secret_key,
+                    secure=secure,
+                    region=getattr(config, "MINIO_REGION", "us-east-1"),
+                    http_client=_make_http_client(secure)
+                )
+            _shared_clients[key] = client
+    return client
+
+
+# ==========================================
+# 3. MinioStorage (Панорамы и ортофото)
 # ==========================================
 class MinioStorage:
     """
     Класс для работы с S3-хранилищем (MinIO).
+    Бакет передается явно в каждый вызов (bucket_name); значение из конструктора —
+    только умолчание и никогда не меняется, поэтому экземпляр безопасно
+    использовать из параллельных greenlet'ов.
     """
-    def __init__(self):
+    def __init__(self, bucket_name=None):
         # Получаем настройки из переменных окружения
         self.endpoint = os.environ.get("MINIO_ENDPOINT", "minio:9000")
-        self.access_key = os.environ.get("MINIO_ACCESS_KEY", "minioadmin")
-        self.secret_key = os.environ.get("MINIO_SECRET_KEY", "minioadmin")
-        self.bucket_name = os.environ.get("MINIO_BUCKET_NAME", "panoramas")
-        # Для локальной разработки secure=False (http), для продакшена True (https)
+        self.bucket_name = bucket_name or os.environ.get("MINIO_BUCKET_NAME", "panoramas")
         self.secure = os.environ.get("MINIO_SECURE", "False").lower() == "true"
 
-        # Инициализация клиента
+        # Общий клиент с пулом соединений (без сетевых вызовов: бакеты создает bootstrap.py)
         try:
-            self.client = Minio(
-                self.endpoint,
-                access_key=self.access_key,
-                secret_key=self.secret_key,
-                secure=self.secure
-            )
-            self._ensure_bucket()
+            self.client = get_minio_client()
         except Exception as e:
             print(f"Warning: Failed to initialize MinIO client. {e}")
             self.client = None
 
-    def _ensure_bucket(self):
-        """Создает бакет, если он не существует."""
-        if not self.client: return
+    def ensure_bucket(self, bucket_name=None):
+        """Создает бакет, если он не существует (один раз на процесс)."""
+        bucket_name = bucket_name or self.bucket_name
+        if not self.client or bucket_name in _ensured_buckets: return
         try:
-            if not self.client.bucket_exists(self.bucket_name):
-                self.client.make_bucket(self.bucket_name)
-                print(f"Bucket '{self.bucket_name}' created.")
+            if not self.client.bucket_exists(bucket_name):
+                self.client.make_bucket(bucket_name)
+                print(f"Bucket '{bucket_name}' created.")
+            _ensured_buckets.add(bucket_name)
         except S3Error as e:
             print(f"MinIO Error (Ensure Bucket): {e}")
         except Exception as e:
             print(f"MinIO Connection Error: {e}")
 
-    def save_file(self, file_stream, filename, content_type="image/jpeg"):
+    def save_file(self, file_stream, filename, content_type="image/jpeg", bucket_name=None):
         """
         Загружает файл в MinIO.
         """
@@ -105,7 +192,7 @@ class MinioStorage:
 
             # Загрузка
             self.client.put_object(
-                self.bucket_name,
+                bucket_name or self.bucket_name,
                 filename,
                 file_stream,
                 length=file_size,
@@ -116,54 +203,207 @@ class MinioStorage:
             print(f"Error saving to MinIO: {e}")
             raise e
 
-    def delete_file(self, filename):
+    def delete_file(self, filename, bucket_name=None):
         """
         Удаляет файл из MinIO.
         """
         if not self.client: return
+        bucket_name = bucket_name or self.bucket_name
         try:
-            self.client.remove_object(self.bucket_name, filename)
-            print(f"File '{filename}' deleted from MinIO bucket '{self.bucket_name}'.")
+            self.client.remove_object(bucket_name, filename)
+            print(f"File '{filename}' deleted from MinIO bucket '{bucket_name}'.")
         except Exception as e:
             print(f"Error deleting file from MinIO: {e}")
             raise e
 
-    def send_local_file(self, filename, mimetype='image/jpeg'):
+    # Размер куска при потоковой отдаче объекта из MinIO
+    STREAM_CHUNK_SIZE = 256 * 1024
+
+    def send_local_file(self, filename, mimetype='image/jpeg', bucket_name=None):
         """
-        Скачивает файл из MinIO и отдает его клиенту через Flask.
+        Отдает файл из MinIO клиенту потоком, не буферизуя его в памяти воркера.
+        Поддерживает Range (206), If-None-Match (304) и пробрасывает ETag,
+        Last-Modified и Content-Length.
         (Название метода сохранено для совместимости интерфейсов, 
          хотя файл берется из удаленного хранилища).
         """
         if not self.client: return jsonify({"error": "MinIO not available"}), 500
-        
+        bucket_name = bucket_name or self.bucket_name
+
+        try:
+            stat = self.client.stat_object(bucket_name, filename)
+        except S3Error as e:
+            print(f"MinIO Fetch Error: {e}")
+            return jsonify({"error": "File not found in storage"}), 404
+        except Exception as e:
+            print(f"General Error fetching file: {e}")
+            return jsonify({"error": str(e)}), 500
+
+        size = stat.size
+        etag = (stat.etag or "").strip('"')
+
+        # Клиент уже держит актуальную копию
+        if etag and etag in request.if_none_match:
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+
+        # Range учитываем, только если If-Range (при наличии) совпадает с текущим ETag
+        byte_range = request.range
+        if byte_range and request.if_range.etag and request.if_range.etag != etag:
+            byte_range = None
+
+        start, stop = 0, size
+        status = 200
+        # Несколько диапазонов (bytes=0-1,5-9) и другие единицы не поддерживаем: по RFC 9110
+        # Range можно проигнорировать и отдать файл целиком (200). 416 — только для одного
+        # байтового диапазона, который действительно лежит за пределами файла
+        if byte_range and byte_range.units == "bytes" and len(byte_range.ranges) == 1:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                unsatisfiable = Response(status=416)
+                unsatisfiable.headers["Content-Range"] = f"bytes */{size}"
+                return unsatisfiable
+            start, stop = bounds
+            status = 206
+
         response = None
         try:
-            # Получаем поток данных от MinIO
-            response = self.client.get_object(self.bucket_name, filename)
-            
-            # Читаем данные в память
-            file_data = io.BytesIO(response.read())
-            file_data.seek(0)
-            
-            return send_file(
-                file_data, 
-                mimetype=mimetype, 
-                download_name=filename
-            )
+            if size == 0:
+                response = None
+            elif status == 206:
+                response = self.client.get_object(bucket_name, filename, offset=start, length=stop - start)
+            else:
+                response = self.client.get_object(bucket_name, filename)
         except S3Error as e:
             print(f"MinIO Fetch Error: {e}")
             return jsonify({"error": "File not found in storage"}), 404
         except Exception as e:
             print(f"General Error fetching file: {e}")
             return jsonify({"error": str(e)}), 500
+
+        chunk_size = self.STREAM_CHUNK_SIZE
+
+        def generate():
+            # Соединение возвращается в пул urllib3, когда генератор завершён или закрыт клиентом
+            if response is None:
+                return
+            try:
+                for chunk in response.stream(chunk_size):
+                    yield chunk
+            finally:
+                response.close()
+                response.release_conn()
+
+        result = Response(generate(), status=status, mimetype=mimetype, direct_passthrough=True)
+        result.headers["Content-Length"] = str(stop - start)
+        result.headers["Accept-Ranges"] = "bytes"
+        result.headers["Content-Disposition"] = _content_disposition(os.path.basename(filename))
+        if status == 206:
+            result.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        if etag:
+            result.set_etag(etag)
+        if stat.last_modified:
+            result.last_modified = stat.last_modified
+        return result
+
+    # --- Presigned URL (загрузка напрямую из браузера в MinIO) ---
+
+    def _get_public_client(self):
+        """Клиент с публичным адресом MinIO для подписи presigned URL"""
+        return get_minio_client(public=True)
+
+    def presigned_put_url(self, filename, expires=None, bucket_name=None):
+        """URL для одиночного PUT объекта (до 5 ГБ)"""
+        expires = expires or getattr(config, "PRESIGNED_UPLOAD_EXPIRES", 3600)
+        return self._get_public_client().presigned_put_object(
+            bucket_name or self.bucket_name, filename, expires=timedelta(seconds=expires)
+        )
+
+    def presigned_part_url(self, filename, upload_id, part_number, expires=None, bucket_name=None):
+        """URL для PUT одной части multipart upload"""
+        expires = expires or getattr(config, "PRESIGNED_UPLOAD_EXPIRES", 3600)
+        return self._get_public_client().get_presigned_url(
+            "PUT",
+            bucket_name or self.bucket_name,
+            filename,
+            expires=timedelta(seconds=expires),
+            extra_query_params={"uploadId": upload_id, "partNumber": str(part_number)}
+        )
+
+    def presigned_get_url(self, filename, mimetype=None, expires=None, bucket_name=None):
+        """Короткоживущий URL на чтение объекта"""
+        expires = expires or getattr(config, "PRESIGNED_DOWNLOAD_EXPIRES", 300)
+        response_headers = {"response-content-type": mimetype} if mimetype else None
+        return self._get_public_client().presigned_get_object(
+            bucket_name or self.bucket_name,
+            filename,
+            expires=timedelta(seconds=expires),
+            response_headers=response_headers
+        )
+
+    def serve_file(self, filename, mimetype='image/jpeg', bucket_name=None):
+        """
+        Отдает файл в соответствии с DOWNLOAD_MODE: поток через Flask, 302 на presigned URL
+        или X-Accel-Redirect для nginx. В двух последних режимах воркер не занят передачей.
+        """
+        mode = getattr(config, "DOWNLOAD_MODE", "proxy")
+        bucket_name = bucket_name or self.bucket_name
+        if not self.client or mode == "proxy":
+            return self.send_local_file(filename, mimetype=mimetype, bucket_name=bucket_name)
+
+        # Не отдаем ссылку на несуществующий объект
+        if self.stat_file(filename, bucket_name=bucket_name) is None:
+            return jsonify({"error": "File not found in storage"}), 404
+
+        if mode == "redirect":
+            return redirect(self.presigned_get_url(filename, mimetype=mimetype, bucket_name=bucket_name), code=302)
+
+        if mode == "accel":
+            prefix = getattr(config, "DOWNLOAD_ACCEL_PREFIX", "/_minio/").rstrip("/")
+            response = Response(status=200, mimetype=mimetype)
+            response.headers["X-Accel-Redirect"] = f"{prefix}/{bucket_name}/{quote(filename)}"
+            response.headers["Content-Disposition"] = _content_disposition(os.path.basename(filename))
+            return response
+
+        return self.send_local_file(filename, mimetype=mimetype, bucket_name=bucket_name)
+
+    def stat_file(self, filename, bucket_name=None):
+        """Метаданные объекта или None, если объекта нет"""
+        if not self.client: return None
+        try:
+            return self.client.stat_object(bucket_name or self.bucket_name, filename)
+        except S3Error:
+            return None
+
+    def read_head(self, filename, length, bucket_name=None):
+        """Читает первые length байт объекта (range-запрос), например заголовок JPEG с EXIF"""
+        if not self.client: raise Exception("MinIO client not initialized")
+        response = None
+        try:
+            response = self.client.get_object(bucket_name or self.bucket_name, filename, offset=0, length=length)
+            return response.read()
         finally:
-            # Важно закрыть соединение с MinIO
             if response:
                 response.close()
                 response.release_conn()
 
-    def get_local_file_path(self, filename):
+    def download_file(self, filename, local_path, bucket_name=None):
+        """Скачивает объект в локальный файл потоком (без буферизации в памяти)"""
+        if not self.client: raise Exception("MinIO client not initialized")
+        self.client.fget_object(bucket_name or self.bucket_name, filename, local_path)
+        return local_path
+
+    def delete_prefix(self, prefix, bucket_name=None):
+        """Удаляет все объекты с указанным префиксом (например, тайлы панорамы)"""
+        if not self.client: return
+        bucket_name = bucket_name or self.bucket_name
+        objects = (DeleteObject(obj.object_name) for obj in self.client.list_objects(bucket_name, prefix=prefix, recursive=True))
+        for error in self.client.remove_objects(bucket_name, objects):
+            print(f"Error deleting '{error.name}' from MinIO: {error}")
+
+    def get_local_file_path(self, filename, bucket_name=None):
         """
         Возвращает путь для внешнего доступа (если нужно).
         """
-        return f"{self.endpoint}/{self.bucket_name}/{filename}"
\ No newline at end of file
+        return f"{self.endpoint}/{bucket_name or self.bucket_name}/{filename}"
\ No newline at end of file